@@ -0,0 +1,208 @@
+"""Read only JSON API over the county data
+
+    GET /api/v1/counties?fields=MEDIAN_RENT,POVERTY_RATE&offset=0&limit=100
+    GET /api/v1/counties/<fips>?fields=MEDIAN_RENT
+    GET /api/v1/metrics/<metric>?offset=0&limit=100
+    GET /api/v1/rankings/<metric>?direction=top&offset=0&limit=10
+    GET /api/v1/distributions/<metric>?bins=20
+
+Every endpoint takes year= (default the base survey year). Lists are paged with
+offset= and limit= (at most MAX_LIMIT) and say where the next page starts. The
+answers are sliced out of arrays already on the data snapshot (column values,
+ranks, a FIPS index), so no DataFrame is touched per request. Responses carry
+ETags through ConditionalResponses, like the callbacks.
+"""
+import flask
+import numpy as np
+
+import export
+import serialize
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def respond(payload, status=200):
+    return flask.Response(serialize.dumps(payload), status=status, mimetype='application/json')
+
+
+def county_index(data):
+    """rows of the counties in FIPS order (one per code), and FIPS code -> row"""
+    def build():
+        rows = export.select_rows(data)
+        codes = data.total_census_grouped['FIPS'].values[rows]
+        return rows, dict(zip(codes.tolist(), rows.tolist()))
+    return data.cached(('api', 'counties'), build)
+
+
+def county_names(data):
+    def build():
+        table = data.total_census_grouped
+        return {column: np.asarray(table[column]).astype(str) for column in export.ID_COLUMNS}
+    return data.cached(('api', 'names'), build)
+
+
+def fields_of(data):
+    """fields asked for with fields=, every census field when there is no fields="""
+    columns = [column for column in data.vintages.columns if column not in export.SKIP_COLUMNS]
+    text = flask.request.args.get('fields')
+    if not text:
+        return columns
+    fields = [field.strip() for field in text.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in data.vintages.column]
+    if unknown:
+        raise ApiError(400, "unknown fields: " + ", ".join(unknown))
+    return fields
+
+
+def year_of(data):
+    try:
+        year = int(flask.request.args.get('year', data.base_year))
+    except ValueError:
+        year = None
+    if year not in data.vintages.years:
+        raise ApiError(400, "no census data for {}".format(flask.request.args.get('year')))
+    return year
+
+
+def int_arg(name, default):
+    """whole number query parameter, a 400 rather than the default when it is not one"""
+    text = flask.request.args.get(name)
+    if text is None:
+        return default
+    try:
+        return int(text)
+    except ValueError:
+        raise ApiError(400, "{} must be a whole number, not {}".format(name, text))
+
+
+def page_of():
+    """offset and limit of the requested page"""
+    offset = int_arg('offset', 0)
+    limit = int_arg('limit', DEFAULT_LIMIT)
+    if offset < 0 or not 1 <= limit <= MAX_LIMIT:
+        raise ApiError(400, "offset must be >= 0 and limit between 1 and {}".format(MAX_LIMIT))
+    return offset, limit
+
+
+def paged(items, total, offset, limit):
+    """page of items with where it sits in the whole list"""
+    following = offset + limit
+    return dict(items, total=total, offset=offset, limit=limit,
+                next=following if following < total else None)
+
+
+def metric_of(data, metric):
+    if metric not in data.vintages.column:
+        raise ApiError(404, "unknown metric {}".format(metric))
+    return metric
+
+
+def create_api(registry):
+    """Blueprint of version 1 of the API, reading from the registry's current snapshot"""
+    api = flask.Blueprint('api_v1', __name__, url_prefix='/api/v1')
+
+    @api.errorhandler(ApiError)
+    def api_error(error):
+        return respond({'error': error.message}, error.status)
+
+    @api.route('/counties')
+    def counties():
+        """page of county records in FIPS order"""
+        data = registry.current
+        year = year_of(data)
+        fields = fields_of(data)
+        rows, _ = county_index(data)
+        offset, limit = page_of()
+        page = rows[offset:offset + limit]
+
+        names = county_names(data)
+        columns = {'FIPS': data.county_fips[page]}
+        columns.update((column, names[column][page]) for column in export.ID_COLUMNS)
+        columns.update((field, data.vintages.values(field, year)[page]) for field in fields)
+        return respond(paged({'year': year, 'counties': columns}, len(rows), offset, limit))
+
+    @api.route('/counties/<fips>')
+    def county(fips):
+        """one county record"""
+        data = registry.current
+        year = year_of(data)
+        fields = fields_of(data)
+        _, row_of = county_index(data)
+        row = row_of.get(int(fips)) if fips.isdigit() else None
+        if row is None:
+            raise ApiError(404, "no county with FIPS {}".format(fips))
+
+        names = county_names(data)
+        record = {'FIPS': data.county_fips[row], 'year': year}
+        record.update((column, names[column][row]) for column in export.ID_COLUMNS)
+        record.update((field, data.vintages.values(field, year)[row]) for field in fields)
+        return respond(record)
+
+    @api.route('/metrics/<metric>')
+    def metric_vector(metric):
+        """values of one metric for a page of counties, in FIPS order"""
+        data = registry.current
+        year = year_of(data)
+        metric = metric_of(data, metric)
+        rows, _ = county_index(data)
+        offset, limit = page_of()
+        page = rows[offset:offset + limit]
+        return respond(paged({'metric': metric, 'year': year, 'fips': data.county_fips[page],
+                              'values': data.vintages.values(metric, year)[page]},
+                             len(rows), offset, limit))
+
+    @api.route('/rankings/<metric>')
+    def rankings(metric):
+        """counties from the highest value down (direction=top) or the lowest up (direction=bottom)"""
+        data = registry.current
+        year = year_of(data)
+        ranks = data.ranks(year)
+        if metric not in ranks.column:
+            raise ApiError(404, "no ranking for {}".format(metric))
+        direction = flask.request.args.get('direction', 'top')
+        if direction not in ('top', 'bottom'):
+            raise ApiError(400, "direction must be top or bottom")
+
+        j = ranks.column[metric]
+        count = int(ranks.count[j])
+        offset, limit = page_of()
+        order = ranks.order[:count, j]
+        if direction == 'bottom':
+            order = order[::-1]
+        page = order[offset:offset + limit]
+
+        names = county_names(data)
+        return respond(paged({'metric': metric, 'year': year, 'direction': direction,
+                              'fips': data.county_fips[page],
+                              'name': names['Geographic Area Name'][page],
+                              'value': data.vintages.values(metric, year)[page], 'rank': ranks.rank[page, j],
+                              'percentile': ranks.percentile[page, j]},
+                             count, offset, limit))
+
+    @api.route('/distributions/<metric>')
+    def distribution(metric):
+        """histogram of one metric over every county"""
+        data = registry.current
+        year = year_of(data)
+        metric = metric_of(data, metric)
+        bins = int_arg('bins', 20)
+        if not 1 <= bins <= 200:
+            raise ApiError(400, "bins must be between 1 and 200")
+
+        def build():
+            values = data.vintages.values(metric, year)
+            values = values[~np.isnan(values)]
+            counts, edges = np.histogram(values, bins=bins)
+            return {'metric': metric, 'year': year, 'count': len(values),
+                    'edges': edges, 'counts': counts}
+        return respond(data.cached(('api', 'distribution', metric, year, bins), build))
+
+    return api
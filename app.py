@@ -4,6 +4,7 @@ import pathlib
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
+import dash_table
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
@@ -12,14 +13,36 @@ from dash.dependencies import State, Input, Output
 from dash.exceptions import PreventUpdate
 import numpy as np
 import json
-
+import hmac
+import logging
+import uuid
+import hashlib
+import flask
+from flask_compress import Compress
+
+from rankings import rank_text
+from downsample import density_sample, with_rows
+from registry import DataRegistry
+from rendering import FigurePool
+from templates import FigureTemplate
+from etags import ConditionalResponses
+from coalesce import Coalescer
+from sessions import SessionState, open_store
+import export
+import serialize
+from api import create_api, county_index
+from validate import EDUCATION_LEVELS, OCCUPATION_LEVELS
+from classify import METHODS, Classification
+from expressions import ExpressionError
+import cards
 
 stylesheets = ['bootstrap.min.css']
 
 external_stylesheets = [
     'https://codepen.io/chriddyp/pen/bWLwgP.css', dbc.themes.MINTY]
 
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+# compression is set up below, with our own settings
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets, compress=False)
 
 server = app.server
 
@@ -29,6 +52,27 @@ DATA_PATH = PATH.joinpath("data").resolve()
 
 token = os.getenv('TOKEN')
 
+# how the comparison scatter is drawn: 'webgl' (Scattergl) or 'svg' (Scatter), and
+# the number of points above which it is thinned out on the server before sending
+SCATTER_RENDERER = os.getenv('SCATTER_RENDERER', 'webgl')
+SCATTER_MAX_POINTS = int(os.getenv('SCATTER_MAX_POINTS', '5000'))
+
+# 'orjson' encodes callback responses with serialize.dumps, 'plotly' keeps Dash's own encoder
+JSON_ENGINE = os.getenv('JSON_ENGINE', 'orjson')
+if JSON_ENGINE == 'orjson':
+    serialize.install()
+
+# compression of responses (callbacks, layout and assets): algorithms in order of
+# preference, gzip level 1-9, brotli level 0-11, and the smallest response compressed
+server.config.update(
+    COMPRESS_ALGORITHM=os.getenv('COMPRESS_ALGORITHM', 'br,gzip').split(','),
+    COMPRESS_LEVEL=int(os.getenv('COMPRESS_LEVEL', '6')),
+    COMPRESS_BR_LEVEL=int(os.getenv('COMPRESS_BR_LEVEL', '4')),
+    COMPRESS_MIN_SIZE=int(os.getenv('COMPRESS_MIN_SIZE', '1024')),
+    COMPRESS_MIMETYPES=['application/json', 'text/html', 'text/css',
+                        'application/javascript', 'image/svg+xml'])
+Compress(server)
+
 # load data
 
 with urlopen(
@@ -36,21 +80,41 @@ with urlopen(
 ) as response:
     counties = json.load(response)
 
-total_census_grouped = pd.read_csv(DATA_PATH.joinpath(
-    'total_census_county_grouped.csv'), dtype={'FIPS': str})
+# level of the log lines (e.g. data loads and failed reloads), each with its process
+# id since the gunicorn workers share one stdout
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s')
+
+# survey year of the csvs in data/, other years live in data/vintages/<year>/
+BASE_YEAR = 2018
+
+# poll data/ for changed files every this many seconds (0 turns watching off), and
+# the token the /admin/reload endpoint expects in its X-Admin-Token header
+DATA_WATCH_INTERVAL = int(os.getenv('DATA_WATCH_INTERVAL', '0'))
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
 
-total_census_grouped['FIPS'] = total_census_grouped['FIPS'].apply(
-    lambda x: x.zfill(5))
+# threads building the detail figures of a clicked county (default: cores, at most 8)
+DETAIL_WORKERS = int(os.getenv('DETAIL_WORKERS', '0'))
 
-total_census_grouped['STCOUNTYFP'] = total_census_grouped['STCOUNTYFP'].astype(
-    str).apply(lambda x: x.zfill(5))
+# seconds a map, scatter or detail render waits for the session's previous one to
+# finish, before it is either dropped as stale or rendered anyway
+COALESCE_WAIT = float(os.getenv('COALESCE_WAIT', '0.25'))
 
-census_education = pd.read_csv(
-    DATA_PATH.joinpath('census_county_data_education.csv'))
+# folder of the rendered county card images and how much disk it may take
+CARD_CACHE_DIR = os.getenv('CARD_CACHE_DIR', str(PATH.joinpath('cache', 'cards')))
+CARD_CACHE_MB = int(os.getenv('CARD_CACHE_MB', '512'))
 
-census_occ = pd.read_csv(DATA_PATH.joinpath('census_data_occ.csv'))
+# what each page was last sent: 'memory' (this process) or 'sqlite:<path>' (shared
+# by the gunicorn workers), and how many pages the in-memory store remembers
+SESSION_STORE = os.getenv('SESSION_STORE', 'memory')
+SESSION_MAX = int(os.getenv('SESSION_MAX', '10000'))
 
-census_nat = pd.read_csv(DATA_PATH.joinpath('census_nat.csv'))
+# where the data validation report of each snapshot is written
+VALIDATION_REPORT = os.getenv('VALIDATION_REPORT', str(PATH.joinpath('cache', 'validation.json')))
+
+# lookups built for derived metrics and filters (values, ranks, correlations, classes,
+# filter indexes) kept per data snapshot, the least recently used dropped first
+DERIVED_CACHE_MAX = int(os.getenv('DERIVED_CACHE_MAX', '256'))
 
 
 def update_scatter_axis(dd_select):
@@ -146,6 +210,10 @@ def update_scatter_axis(dd_select):
     elif dd_select == "MEDIAN_INCOME_DOLLARS":
         return "Median Household Income ($)"
 
+    # a derived metric is shown as its expression
+    else:
+        return dd_select
+
 
 # create formatted dropdowns
 dropdown_map = dcc.Dropdown(
@@ -251,6 +319,149 @@ dropdown_scatterx = dcc.Dropdown(
     value="POVERTY_RATE"
 )
 
+# every metric that can be picked in the dropdowns
+metric_columns = [option['value'] for option in dropdown_map.options]
+
+metric_labels = {option['value']: option['label'].strip()
+                 for option in dropdown_map.options}
+
+
+def metric_label(metric):
+    """label of a metric, a derived metric's is its expression"""
+    return metric_labels.get(metric, metric)
+
+
+def loaded_year(year):
+    """a year sent by the page, the base year when there is none or it isn't loaded"""
+    return year if year in registry.current.vintages.years else BASE_YEAR
+
+
+def filter_matches(query, year):
+    """True for each county matching a filter query in a year, None without a valid query"""
+    if not query:
+        return None
+    try:
+        return registry.current.matching(query, year)
+    except ExpressionError:
+        return None
+
+
+# the census tables and everything derived from them, swapped whole when data/ changes
+registry = DataRegistry(DATA_PATH, BASE_YEAR, metric_columns,
+                        geo_ids={feature['id'] for feature in counties['features']},
+                        report_path=VALIDATION_REPORT, derived_max=DERIVED_CACHE_MAX)
+
+if DATA_WATCH_INTERVAL:
+    registry.watch(DATA_WATCH_INTERVAL)
+
+figure_pool = FigurePool(DETAIL_WORKERS or None)
+
+# renders a newer request of the same session made stale are dropped
+coalesce = Coalescer(COALESCE_WAIT)
+
+
+def click_fips(value):
+    """FIPS codes of the counties a graph's clickData points at, any other input as it is
+
+    Map points carry their FIPS code as location, scatter points their row as
+    customdata, and a click reported with just a point number is a map row.
+    """
+    if not isinstance(value, dict) or 'points' not in value:
+        return value
+    codes = registry.current.county_fips
+    selected = []
+    for point in value['points']:
+        if 'location' in point:
+            selected.append(point['location'])
+        else:
+            row = point.get('customdata')
+            if not isinstance(row, int):
+                row = point.get('pointNumber')
+            selected.append(codes[row] if isinstance(row, int) and 0 <= row < len(codes) else row)
+    return selected
+
+
+# renders that would send a page what it already shows are skipped, clicks compared
+# by the counties they select
+session_state = SessionState(open_store(SESSION_STORE, SESSION_MAX),
+                             lambda: registry.current.version, normalize=click_fips)
+
+# responses change with the data and with the code, both are part of their ETags
+CODE_VERSION = hashlib.sha1(b''.join(
+    path.read_bytes() for path in sorted(PATH.glob('*.py')))).hexdigest()[:12]
+
+ConditionalResponses(server, lambda: registry.current.version + CODE_VERSION)
+
+
+def generate_year_slider(years):
+    """slider over every census year loaded"""
+    return dcc.Slider(
+        id="year-slider",
+        min=min(years),
+        max=max(years),
+        step=None,
+        marks={year: str(year) for year in years},
+        value=BASE_YEAR
+    )
+
+
+def generate_since_dropdown(years):
+    """dropdown of years the map can show the change since"""
+    return dcc.Dropdown(
+        id="dropdown_since",
+        options=[{"label": "Change since " + str(year), "value": year}
+                 for year in years],
+        value=None,
+        placeholder="Show values for the selected year"
+    )
+
+
+dropdown_similar = dcc.Dropdown(
+    id="dropdown_similar",
+    options=dropdown_map.options,
+    value=[],
+    multi=True,
+    placeholder="All census fields"
+)
+
+radio_correlation = dcc.RadioItems(
+    id="radio_correlation",
+    options=[
+        {"label": " Pearson", "value": "pearson"},
+        {"label": " Spearman (rank)", "value": "spearman"},
+    ],
+    value="pearson",
+    labelStyle={"display": "inline-block", "margin-right": "15px"}
+)
+
+radio_classes = dcc.RadioItems(
+    id="radio_classes",
+    options=[
+        {"label": " Quantiles", "value": "quantile"},
+        {"label": " Equal intervals", "value": "equal_interval"},
+        {"label": " Natural breaks", "value": "jenks"},
+    ],
+    value="quantile",
+    labelStyle={"display": "inline-block", "margin-right": "15px"}
+)
+
+dropdown_rank_n = dcc.Dropdown(
+    id="dropdown_rank_n",
+    options=[{"label": str(n), "value": n} for n in (5, 10, 25, 50)],
+    value=10,
+    clearable=False
+)
+
+radio_rank_direction = dcc.RadioItems(
+    id="radio_rank_direction",
+    options=[
+        {"label": " Highest", "value": "top"},
+        {"label": " Lowest", "value": "bottom"},
+    ],
+    value="top",
+    labelStyle={"display": "inline-block", "margin-right": "15px"}
+)
+
 
 def update_tooltip(dd_select, value):
     """Tooltip formatting for map and scatter"""
@@ -348,147 +559,163 @@ def update_tooltip(dd_select, value):
     elif dd_select == "MEDIAN_INCOME_DOLLARS":
         return "<b>%{text}</b><br>Median Household Income: $%{" + value + ":.1f}"
 
+    else:
+        return "<b>%{text}</b><br>" + dd_select + ": %{" + value + ":,.3g}"
 
-def generate_choro(dd_select, value=None):
-    """Map showing particular metric from 2018 Census"""
 
-    tooltip_choro = update_tooltip(dd_select, 'z')
+def format_value(value, prefix=""):
+    """metric value as shown in the text above the detail charts"""
+    if np.isnan(value):
+        return "N/A"
+    return prefix + "{:,.0f}".format(value)
 
-    if value is not None:
 
-        center_long = total_census_grouped.iloc[value[0], -3]
+def column_text(data, column):
+    """text of a column of the county table as a plain array, e.g. names for hover labels"""
+    return data.cached(('text', column), lambda: data.total_census_grouped[column].astype(str).values)
 
-        center_lat = total_census_grouped.iloc[value[0], -4]
 
-        map_data = [
+def joined_values(data, table, rows, column):
+    """values of a column of a per county table (census_education, census_occ, census_nat)
+    at rows joined by validation, NaN where the county has no row"""
+    values = data.cached(('joined', table, column),
+                         lambda: getattr(data, table)[column].values.astype(np.float64))
+    return np.where(rows >= 0, values[rows], np.nan)
 
-            go.Choroplethmapbox(
-                name="",
-                geojson=counties,
-                showscale=True,
-                locations=total_census_grouped['FIPS'].values,
-                z=total_census_grouped[dd_select].values,
-                marker_opacity=0.5,
-                text=total_census_grouped['Geographic Area Name'],
-                colorscale='deep',
-                hovertemplate=tooltip_choro,
-                selectedpoints=value,
-                selected={
-                    'marker': {'opacity': 1},
 
-                },
-                unselected={
+# static parts of the charts, validated once here, the generators fill in the data per request
 
-                    'marker': {'opacity': .3}
-                },
-                marker=dict(line={"color": "rgb(255,255,255)"}),
-                customdata=total_census_grouped[dd_select].values
+choro_template = FigureTemplate(
+    [go.Choroplethmapbox(
+        name="",
+        geojson=counties,
+        showscale=True,
+        marker_opacity=0.5,
+        colorbar=dict(ticks=""),
+        marker=dict(line={"color": "rgb(255,255,255)"}),
+    )],
+    dict(
+        hovermode='closest',
+        hoverlabel=dict(bgcolor="#CED2CC"),
+        autosize=True,
+        margin=go.layout.Margin(
+            l=0,
+            r=0,
+            b=0,
+            t=0,
+            pad=0,
+            autoexpand=True
+        ),
+        automargin=False,
+        clickmode="event+select",
+        mapbox=dict(
+            accesstoken=token,
+            style="light",
+            autosize=True,
+            marker=dict(
+                size=20,
+            ),
+        )
+    ))
 
-            )
-        ]
 
-        layout = dict(
+# colors of the map classes, from light to dark, and of counties without a value
+CLASS_COLORS = px.colors.cmocean.deep[:-1]
+MISSING_COLOR = 'rgb(220, 220, 220)'
 
-            hovermode='closest',
-            hoverlabel=dict(bgcolor="#CED2CC"),
+# counties a filter leaves out
+DIMMED_COLOR = 'rgb(245, 245, 245)'
 
-            autosize=True,
-            margin=go.layout.Margin(
-                l=0,
-                r=0,
-                b=0,
-                t=0,
-                pad=0,
-                autoexpand=True
-            ),
-
-            automargin=False,
-            clickmode="event+select",
-            mapbox=dict(
-                accesstoken=token,
-                style="light",
-                autosize=True,
 
-                marker=dict(
-                    size=20,
+def class_colorscale(classes, dimmed=False):
+    """discrete colorscale for class codes 0..classes - 1, code classes for missing values
+    and, when dimmed, code classes + 1 for the counties a filter leaves out"""
+    picked = np.linspace(0, len(CLASS_COLORS) - 1, max(classes, 2)).round().astype(int)[:classes]
+    colors = [CLASS_COLORS[i] for i in picked] + [MISSING_COLOR] + ([DIMMED_COLOR] if dimmed else [])
+    scale = []
+    for i, color in enumerate(colors):
+        scale += [[i / len(colors), color], [(i + 1) / len(colors), color]]
+    return scale
 
-                ),
 
-                center=dict(lon=center_long, lat=center_lat),
-                zoom=5,
+def generate_choro(dd_select, value=None, year=BASE_YEAR, since=None, method="quantile", matching=None):
+    """Map of a metric for a census year, or its change since another year, colored by class
 
-            )
-        )
+    The counties are sent as their uint8 class, one of the precomputed classifications
+    of the metric, and the value itself only for the tooltips. Counties not matching
+    a filter (False in matching) are drawn in a class of their own, dimmed.
+    """
+    data = registry.current
 
-        return {"data": map_data, "layout": layout}
+    if since is None or since == year:
+        values = data.values(dd_select, year)
+        classification = data.classification(dd_select, year, method)
+        tooltip_choro = update_tooltip(dd_select, 'customdata')
+    else:
+        values = data.values(dd_select, year) - data.values(dd_select, since)
+        classification = data.cached_for([dd_select], ('change_classes', dd_select, year, since, method),
+                                         lambda: Classification(values, method))
+        tooltip_choro = "<b>%{text}</b><br>" + metric_label(dd_select) + \
+            " change " + str(since) + "-" + str(year) + ": %{customdata:+.1f}"
+
+    classes = classification.classes
+    codes = classification.codes
+    labels = classification.labels() + ['N/A']
+    if matching is not None:
+        codes = np.where(matching, codes, classes + 1).astype(np.uint8)
+        labels.append('Filtered out')
+
+    map_data = {
+        'locations': data.county_fips,
+        'z': codes,
+        'zmin': -.5,
+        'zmax': len(labels) - .5,
+        'colorscale': class_colorscale(classes, matching is not None),
+        'colorbar': {'tickvals': list(range(len(labels))), 'ticktext': labels},
+        'text': column_text(data, 'Geographic Area Name'),
+        'hovertemplate': tooltip_choro,
+        'customdata': values,
+    }
 
+    if value is not None:
+        map_data.update(
+            selectedpoints=[int(row) for row in value],
+            selected={'marker': {'opacity': 1}},
+            unselected={'marker': {'opacity': .3}})
+        center, zoom = value[0], 5
     else:
-        center_long = total_census_grouped.iloc[713, -3]
+        center, zoom = 713, 3
 
-        center_lat = total_census_grouped.iloc[713, -4]
+    center_long = data.total_census_grouped.iloc[center, -3]
 
-        map_data = [
-            go.Choroplethmapbox(
-                name="",
-                geojson=counties,
-                showscale=True,
-                locations=total_census_grouped['FIPS'].values,
-                z=total_census_grouped[dd_select].values,
-                marker_opacity=0.5,
-                text=total_census_grouped['Geographic Area Name'],
-                hovertemplate=tooltip_choro,
-                colorscale='deep',
+    center_lat = data.total_census_grouped.iloc[center, -4]
 
-                marker=dict(line={"color": "rgb(255,255,255)"}),
-                customdata=total_census_grouped[dd_select].values,
+    return choro_template.fill([map_data], {'mapbox': {
+        'center': dict(lon=float(center_long), lat=float(center_lat)),
+        'zoom': zoom}})
 
-            )
-        ]
 
-        layout = dict(
-            autosize=True,
-            margin=go.layout.Margin(
-                l=0,
-                r=0,
-                b=0,
-                t=0,
-                pad=0,
-                autoexpand=True),
-            automargin=False,
-            clickmode="event+select",
-            hovermode='closest',
-            hoverlabel=dict(
-                bgcolor="#CED2CC"),
-            mapbox={
-                'accesstoken': token,
-                'style': "light",
-                'autosize': True,
-                'marker': dict(
-                    size=20,
-                ),
-                'center': dict(
-                    lon=center_long,
-                    lat=center_lat),
-                'zoom': 3})
-
-        return {"data": map_data, "layout": layout}
-
-
-def generate_scatter(dd_select_x, dd_select_y, value, ):
-    """generate scatter plot """
-
-    selected_points = [value]
-    tooltip_x = update_tooltip(dd_select_x, 'x')
+def scatter_sample(data, dd_select_x, dd_select_y, year=BASE_YEAR):
+    """rows drawn on the scatter for a pair of fields, thinned out above SCATTER_MAX_POINTS"""
+    return data.cached_for(
+        [dd_select_x, dd_select_y], ('scatter_sample', dd_select_x, dd_select_y, year),
+        lambda: density_sample(data.values(dd_select_x, year), data.values(dd_select_y, year),
+                               SCATTER_MAX_POINTS))
 
-    tooltip_y = update_tooltip(dd_select_y, 'y').replace(
-        '<b>%{text}</b><br>', '')
 
-    scatter_data = [
-        go.Scatter(
+scatter_template = FigureTemplate(
+    [
+        # counties a filter leaves out, faint behind the others
+        (go.Scatter if SCATTER_RENDERER == 'svg' else go.Scattergl)(
+            name="",
+            mode='markers',
+            opacity=0.25,
+            hoverlabel=dict(bgcolor="#CED2CC"),
+            marker={'size': 8, 'color': 'lightgray'},
+            showlegend=False
+        ),
+        (go.Scatter if SCATTER_RENDERER == 'svg' else go.Scattergl)(
             name="",
-            x=total_census_grouped[dd_select_x],
-            y=total_census_grouped[dd_select_y],
-            text=total_census_grouped['Geographic Area Name'],
             mode='markers',
             opacity=0.8,
             hoverlabel=dict(bgcolor="#CED2CC"),
@@ -497,8 +724,6 @@ def generate_scatter(dd_select_x, dd_select_y, value, ):
                 'line': {'width': 1, 'color': 'Black'}
             },
 
-            selectedpoints=selected_points,
-
             unselected={
                 'marker': {'opacity': 0.15, "color": 'gray'},
 
@@ -513,283 +738,196 @@ def generate_scatter(dd_select_x, dd_select_y, value, ):
             },
 
             line_width=2,
-            hovertemplate=tooltip_x + '<br>' + tooltip_y
-
+        ),
+        # least squares trend line
+        (go.Scatter if SCATTER_RENDERER == 'svg' else go.Scattergl)(
+            name="",
+            mode='lines',
+            line={'color': '#D32D41', 'width': 2, 'dash': 'dash'},
+            hoverinfo='skip',
+            showlegend=False
         )
-
-    ]
-
-    layout = go.Layout(
+    ],
+    go.Layout(
         hovermode='closest',
-        xaxis={'title': update_scatter_axis(dd_select_x)},
-        yaxis={'title': update_scatter_axis(dd_select_y)},
-        margin={'l': 60, 'b': 40, 't': 10, 'r': 10},
+        margin={'l': 60, 'b': 40, 't': 30, 'r': 10},
         legend={'x': 0, 'y': 1},
+        showlegend=False,
 
         # transition={'duration': 300, 'easing': 'cubic-in-out'},
 
-    )
-
-    return {"data": scatter_data, "layout": layout}
-
-
-def generate_rentbox(value):
-    """generates a boxplot showing median rent values throughout the US"""
-    if not value:
+    ))
+
+
+def generate_scatter(dd_select_x, dd_select_y, value, year=BASE_YEAR, matching=None):
+    """generate scatter plot, the counties not matching a filter (False in matching) faint"""
+    data = registry.current
+
+    # the selected county is always drawn, even when it was not in the sample
+    rows = with_rows(scatter_sample(data, dd_select_x, dd_select_y, year), [value])
+    dimmed = {}
+    if matching is not None:
+        keep = matching[rows] | (rows == value)
+        left_out = rows[~keep]
+        rows = rows[keep]
+        dimmed = {
+            'x': data.values(dd_select_x, year)[left_out],
+            'y': data.values(dd_select_y, year)[left_out],
+            'text': column_text(data, 'Geographic Area Name')[left_out],
+            'customdata': left_out,
+        }
+    if value is None:
         selected_points = []
-    selected_points = [value]
-    box_data = [
-        go.Box(
-            y=total_census_grouped["MEDIAN_RENT"],
-            text=total_census_grouped['COUNTYNAME'],
-            boxpoints='all',
-            jitter=0,
-            marker=dict(color="#1F3F49"),
-            name='',
-            selectedpoints=selected_points,
-
-            selected={
-                'marker': {'opacity': 1, "color": 'black'},
+    else:
+        selected_points = [int(np.searchsorted(rows, value))]
 
-            },
+    tooltip_x = update_tooltip(dd_select_x, 'x')
 
-            unselected={
-                'marker': {'opacity': .01, "color": 'grey'},
+    tooltip_y = update_tooltip(dd_select_y, 'y').replace(
+        '<b>%{text}</b><br>', '')
 
-            }
+    # trend line and correlation come from the precomputed pairwise stats
+    pair_stats = data.pair_stats(dd_select_x, dd_select_y, year)
+    stats = pair_stats.pair(dd_select_x, dd_select_y)
+    trend_x, trend_y = pair_stats.trend_line(dd_select_x, dd_select_y)
 
-        )
+    dimmed['hovertemplate'] = tooltip_x + '<br>' + tooltip_y
+    scatter_data = [
+        dimmed,
+        {
+            'x': data.values(dd_select_x, year)[rows],
+            'y': data.values(dd_select_y, year)[rows],
+            'text': column_text(data, 'Geographic Area Name')[rows],
+            # row of each point, clicks can't rely on pointNumber once the scatter is sampled
+            'customdata': rows,
+            'selectedpoints': selected_points,
+            'hovertemplate': tooltip_x + '<br>' + tooltip_y
+        },
+        {'x': trend_x, 'y': trend_y}
     ]
 
-    layout = go.Layout(
-        margin=dict(
-            l=40,
-            r=30,
-            b=50,
-            t=50
+    layout = {
+        'xaxis': {'title': {'text': update_scatter_axis(dd_select_x)}},
+        'yaxis': {'title': {'text': update_scatter_axis(dd_select_y)}},
+        'annotations': [{
+            'text': "Pearson r = {:.2f} | Spearman ρ = {:.2f} | R² = {:.2f}".format(
+                stats['pearson'], stats['spearman'], stats['r2']),
+            'xref': 'paper', 'yref': 'paper', 'x': 0, 'y': 1.06,
+            'xanchor': 'left', 'showarrow': False
+        }],
+    }
 
-        ),
+    return scatter_template.fill(scatter_data, layout)
 
-        yaxis=dict(
-            zerolinecolor='rgb(255, 255, 255)'
-
-        ),
-
-        xaxis=dict(
-            zerolinecolor='rgb(255, 255, 255)'
-
-        ),
 
-    )
-
-    return {"data": box_data, "layout": layout}
-
-
-def generate_householdvalue_box(value):
-    """generates a boxplot showing household values throughout the US"""
-    selected_points = [value]
-    box_data = [
-        go.Box(
-            y=total_census_grouped["MEDIAN_HOUSEHOLD_VALUE"],
-            text=total_census_grouped['COUNTYNAME'],
+def box_template(unselected_opacity):
+    """box plot of one metric over all counties, every point drawn and the selected one in black"""
+    return FigureTemplate(
+        [go.Box(
             boxpoints='all',
             jitter=0,
             marker=dict(color="#1F3F49"),
-            selectedpoints=selected_points,
-            name="",
+            name='',
             selected={
                 'marker': {'opacity': 1, "color": 'black'},
 
             },
 
             unselected={
-                'marker': {'opacity': .01, "color": 'grey'},
+                'marker': {'opacity': unselected_opacity, "color": 'grey'},
 
             }
 
-        )
-    ]
-
-    layout = go.Layout(
-
-        margin=dict(
-            l=40,
-            r=30,
-            b=50,
-            t=50
-
-        ),
-
-        yaxis=dict(
-            zerolinecolor='rgb(255, 255, 255)'
-
         ),
+         # the counties matching a filter, as points over the faint ones
+         go.Box(
+            boxpoints='all',
+            jitter=0,
+            marker=dict(color="#1F3F49", opacity=.4),
+            line=dict(width=0),
+            fillcolor='rgba(0, 0, 0, 0)',
+            name='',
+            hoveron='points',
+        )],
+        go.Layout(
+            margin=dict(
+                l=40,
+                r=30,
+                b=50,
+                t=50
 
-        xaxis=dict(
-            zerolinecolor='rgb(255, 255, 255)'
-
-        ),
-    )
-
-    return {"data": box_data, "layout": layout}
-
-
-def generate_meantimework_box(value):
-    """generates a boxplot showing mean time to get to work values throughout the US"""
-    selected_points = [value]
+            ),
 
-    box_data = [
-        go.Box(
-            y=total_census_grouped["MEAN_TIME_TO_WORK_MIN"],
-            text=total_census_grouped['COUNTYNAME'],
-            boxpoints='all',
+            yaxis=dict(
+                zerolinecolor='rgb(255, 255, 255)'
 
-            jitter=0,
-            marker=dict(color="#1F3F49"),
-            selectedpoints=selected_points,
-            name="",
-            selected={
-                'marker': {'opacity': 1, "color": 'black'},
+            ),
 
-            },
+            xaxis=dict(
+                zerolinecolor='rgb(255, 255, 255)'
 
-            unselected={
-                'marker': {'opacity': .008, "color": 'grey'},
+            ),
 
-            }
+        ))
 
-        )
-    ]
 
-    layout = go.Layout(
+rentbox_template = box_template(.01)
 
-        margin=dict(
-            l=40,
-            r=30,
-            b=50,
-            t=50
+householdvalue_box_template = box_template(.01)
 
-        ),
-        yaxis=dict(
-            zerolinecolor='rgb(255, 255, 255)'
+meantimework_box_template = box_template(.008)
 
-        ),
 
-        xaxis=dict(
-            zerolinecolor='rgb(255, 255, 255)'
+def fill_box(template, column, value, year, matching=None):
+    """box plot of a column in a census year with the county in row value selected, and the
+    counties matching a filter (True in matching) drawn over the others"""
+    data = registry.current
+    values = data.vintages.values(column, year)
+    text = column_text(data, 'COUNTYNAME')
+    box_data = [{'y': values, 'text': text, 'selectedpoints': [value]}]
+    if matching is not None:
+        box_data.append({'y': values[matching], 'text': text[matching]})
+    return template.fill(box_data)
 
-        ),
 
-    )
+def generate_rentbox(value, year=BASE_YEAR, matching=None):
+    """generates a boxplot showing median rent values throughout the US"""
+    return fill_box(rentbox_template, "MEDIAN_RENT", value, year, matching)
 
-    return {"data": box_data, "layout": layout}
 
+def generate_householdvalue_box(value, year=BASE_YEAR, matching=None):
+    """generates a boxplot showing household values throughout the US"""
+    return fill_box(householdvalue_box_template, "MEDIAN_HOUSEHOLD_VALUE", value, year, matching)
 
-def generate_dist(value):
-    """creates histogram of percent of population in each income bin"""
 
-    dist_county = total_census_grouped.iloc[value]
-    dist_data = [{'x': ['<$10K'],
-                  'y': [dist_county["INCOME_LESS_10000"]],
-                  "name": "",
-                  'type': 'bar',
-                  'marker': {"color": "#407D72",
-                             "opacity": "1",
-                             "line": {"width": "1",
-                                      "color": "black"}},
-                  'hovertemplate': "<b>%{y}</b> of people make %{x}",
-                  },
-                 {'x': ['$10-15K'],
-                  'y': [dist_county["INCOME_10000_14999"]],
-                  "name": "",
-                  'type': 'bar',
-                  'marker': {"color": "#407D72",
-                             "opacity": "1",
-                             "line": {"width": "1",
-                                      "color": "black"}},
-                  'hovertemplate': "<b>%{y}</b> of people make %{x}",
-                  },
-                 {'x': ['$15-25K'],
-                  'y': [dist_county["INCOME_15000_24999"]],
-                  "name": "",
-                  'type': 'bar',
-                  'marker': {"color": "#407D72",
-                             "opacity": "1",
-                             "line": {"width": "1",
-                                      "color": "black"}},
-                  'hovertemplate': "<b>%{y}</b> of people make %{x}",
-                  },
-                 {'x': ['$25-35K'],
-                  'y': [dist_county["INCOME_25000_34999"]],
-                  "name": "",
-                  'type': 'bar',
-                  'marker': {"color": "#407D72",
-                             "opacity": "1",
-                             "line": {"width": "1",
-                                      "color": "black"}},
-                  'hovertemplate': "<b>%{y}</b> of people make %{x}",
-                  },
-                 {'x': ['$35-50K'],
-                  'y': [dist_county["INCOME_35000_49999"]],
-                  "name": "",
-                  'type': 'bar',
-                  'marker': {"color": "#407D72",
-                             "opacity": "1",
-                             "line": {"width": "1",
-                                      "color": "black"}},
-                  'hovertemplate': "<b>%{y}</b> of people make %{x}",
-                  },
-                 {'x': ['$50-75K'],
-                  'y': [dist_county["INCOME_50000_74999"]],
-                  "name": "",
-                  'type': 'bar',
-                  'marker': {"color": "#407D72",
-                             "opacity": "1",
-                             "line": {"width": "1",
-                                      "color": "black"}},
-                  'hovertemplate': "<b>%{y}</b> of people make %{x}",
-                  },
-                 {'x': ['$75-100K'],
-                  'y': [dist_county["INCOME_75000_99999"]],
-                  "name": "",
-                  'type': 'bar',
-                  'marker': {"color": "#407D72",
-                             "opacity": "1",
-                             "line": {"width": "1",
-                                      "color": "black"}},
-                  'hovertemplate': "<b>%{y}</b> of people make %{x}",
-                  },
-                 {'x': ['$100 - 150K'],
-                  'y': [dist_county["INCOME_100000_149999"]],
-                  'type': 'bar',
-                  'marker': {"color": "#407D72",
-                             "opacity": "1",
-                             "line": {"width": "1",
-                                      "color": "black"}},
-                  'hovertemplate': "<b>%{y}</b> of people make %{x}",
-                  },
-                 {'x': ['$150-200K'],
-                  'y': [dist_county["INCOME_150000_199999"]],
-                  "name": "",
-                  'type': 'bar',
-                  'marker': {"color": "#407D72",
-                             "opacity": "1",
-                             "line": {"width": "1",
-                                      "color": "black"}},
-                  'hovertemplate': "<b>%{y}</b> of people make %{x}",
-                  },
-                 {'x': ['> $200K'],
-                  'y': [dist_county["INCOME_200000"]],
-                  "name": "",
-                  'type': 'bar',
-                  'marker': {"color": "#407D72",
-                             "opacity": "1",
-                             "line": {"width": "1",
-                                      "color": "black"}},
-                  'hovertemplate': "<b>%{y}</b> of people make %{x}",
-                  },
-                 ]
-    layout = go.Layout(
+def generate_meantimework_box(value, year=BASE_YEAR, matching=None):
+    """generates a boxplot showing mean time to get to work values throughout the US"""
+    return fill_box(meantimework_box_template, "MEAN_TIME_TO_WORK_MIN", value, year, matching)
+
+
+# label and column of each income bin in the histogram
+INCOME_BINS = [('<$10K', "INCOME_LESS_10000"),
+               ('$10-15K', "INCOME_10000_14999"),
+               ('$15-25K', "INCOME_15000_24999"),
+               ('$25-35K', "INCOME_25000_34999"),
+               ('$35-50K', "INCOME_35000_49999"),
+               ('$50-75K', "INCOME_50000_74999"),
+               ('$75-100K', "INCOME_75000_99999"),
+               ('$100 - 150K', "INCOME_100000_149999"),
+               ('$150-200K', "INCOME_150000_199999"),
+               ('> $200K', "INCOME_200000")]
+
+dist_template = FigureTemplate(
+    [{'x': [label],
+      "name": "",
+      'type': 'bar',
+      'marker': {"color": "#407D72",
+                 "opacity": "1",
+                 "line": {"width": "1",
+                          "color": "black"}},
+      'hovertemplate': "<b>%{y}</b> of people make %{x}",
+      } for label, _ in INCOME_BINS],
+    go.Layout(
         showlegend=False,
         bargap=.03,
         hovermode="closest",
@@ -809,232 +947,120 @@ def generate_dist(value):
 
         )
 
-    )
+    ))
 
-    return {"data": dist_data, "layout": layout}
 
+def dist_data(value, year=BASE_YEAR):
+    """per county part of the income histogram"""
+    data = registry.current
+    return [{'y': [float(data.vintages.values(column, year)[value])]} for _, column in INCOME_BINS]
 
-def generate_treemap(value):
-    """generates a treemap of percent of population with level of education"""
-    county = total_census_grouped.iloc[value]['COUNTYNAME']
-    state = total_census_grouped.iloc[value]['STATE']
-    df_ed_county = census_education[(census_education['COUNTYNAME'] == county) & (
-        census_education['STATE'] == state)]
 
-    tree_data = [
-        go.Treemap(
-            name="",
-            labels=df_ed_county['EDUCATION_LEVEL'].replace(
-                {
-                    'EDUCATION_BACHELORS': 'Bachelors',
-                    'EDUCATION_GRADUATE': 'Graduate',
-                    'EDUCATION_HIGHSCHOOL': 'Highschool Diploma',
-                    'EDUCATION_SOME_COLLEGE': 'Some College',
-                    'EDUCATION_ASSOCIATES': 'Associates',
-                    'EDUCATION_NO_DIPLOMA': 'Highschool No Diploma',
-                    'EDUCATION_LESS_9TH': 'Finished less than 9th'}),
-            parents=[""] * len(
-                df_ed_county['EDUCATION_LEVEL'].unique()),
-            values=df_ed_county['PERCENT TOTAL'],
-            marker=dict(
-                colors=[
-                    "#f5874c",
-                    "#407D72",
-                    "#B1836A",
-                    "#6AB187",
-                    "#B16A7F",
-                    "#CED2CC",
-                    '#1F3F49'],
-                line=dict(
-                    width=1,
-                    color="black")),
-            textfont=dict(
-                size=14),
-            textinfo='label+percent entry',
-            texttemplate="%{label}<br><b>%{value:.0f}%</b>",
-            hovertemplate="%{label}<br><b>%{value:.0f}%</b>",
-        )]
-    layout = go.Layout(
+def generate_dist(value, year=BASE_YEAR):
+    """creates histogram of percent of population in each income bin"""
+    return dist_template.fill(dist_data(value, year))
+
+
+EDUCATION_LABELS = {
+    'EDUCATION_LESS_9TH': 'Finished less than 9th',
+    'EDUCATION_NO_DIPLOMA': 'Highschool No Diploma',
+    'EDUCATION_HIGHSCHOOL': 'Highschool Diploma',
+    'EDUCATION_SOME_COLLEGE': 'Some College',
+    'EDUCATION_ASSOCIATES': 'Associates',
+    'EDUCATION_BACHELORS': 'Bachelors',
+    'EDUCATION_GRADUATE': 'Graduate'}
+
+# color of each level, by level so a county missing one doesn't shift the others
+EDUCATION_COLORS = {
+    'EDUCATION_LESS_9TH': "#f5874c",
+    'EDUCATION_NO_DIPLOMA': "#407D72",
+    'EDUCATION_HIGHSCHOOL': "#B1836A",
+    'EDUCATION_SOME_COLLEGE': "#6AB187",
+    'EDUCATION_ASSOCIATES': "#B16A7F",
+    'EDUCATION_BACHELORS': "#CED2CC",
+    'EDUCATION_GRADUATE': '#1F3F49'}
+
+treemap_template = FigureTemplate(
+    [go.Treemap(
+        name="",
+        marker=dict(
+            line=dict(
+                width=1,
+                color="black")),
+        textfont=dict(
+            size=14),
+        textinfo='label+percent entry',
+        texttemplate="%{label}<br><b>%{value:.0f}%</b>",
+        hovertemplate="%{label}<br><b>%{value:.0f}%</b>",
+    )],
+    go.Layout(
         #uniformtext=dict(minsize=100, mode='show')
 
         hovermode="closest",
         hoverlabel=dict(bgcolor="#CED2CC"),
         uniformtext=dict(minsize=10, mode='hide'), margin=dict(pad=0, t=10, b=10, r=10, l=10)
-    )
-
-    return {"data": tree_data, "layout": layout}
-
+    ))
 
-def generate_bar(value):
-    """generates horizontal stacked bar chart showing amount of people in each occupation and percent male/female"""
-    county = total_census_grouped.iloc[value]['COUNTYNAME']
-    state = total_census_grouped.iloc[value]['STATE']
-    census_occ_county = census_occ[(census_occ['COUNTYNAME'] == county) & (
-        census_occ['STATE'] == state)]
-
-    trace0 = go.Bar(
-
-        y=['Management/Business/Science/Arts'],
-        x=[census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'MANAGEMENT_BUSINESS_SCIENCE_ARTS'][
-            'MALE'].values[0]],
-        orientation='h',
-        name="Men",
-
-        marker=dict(color="#1F3F49", line=dict(width=1, color='black')),
-        customdata=census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'MANAGEMENT_BUSINESS_SCIENCE_ARTS'][
-            'PERCENT_MALE'],
-        hovertemplate="%{y}<br><b>%{customdata:.1f}%</b> are Men",
-    )
 
-    trace1 = go.Bar(
-
-        y=['Management/Business/Science/Arts'],
-        x=[census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'MANAGEMENT_BUSINESS_SCIENCE_ARTS'][
-            'FEMALE'].values[0]],
-        orientation='h',
-        text=[census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'MANAGEMENT_BUSINESS_SCIENCE_ARTS'][
-            'TOTALS'].values[0]],
-        texttemplate='%{text:.4s}',
-        textposition='auto',
-        name="Women",
-        marker=dict(color="#CED2CC", line=dict(width=1, color='black')),
-        customdata=census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'MANAGEMENT_BUSINESS_SCIENCE_ARTS'][
-            'PERCENT FEMALE'],
-        hovertemplate="%{y}<br><b>%{customdata:.1f}%</b> are Women"
-    )
+def treemap_data(value):
+    """per county part of the education treemap"""
+    data = registry.current
+    rows = data.validation.education_rows[value]
+    present = rows >= 0
 
-    trace2 = go.Bar(
-        name="",
-        y=['Service'],
-        x=[census_occ_county[census_occ_county['OCCUPATION_LEVEL']
-                             == 'SERVICE']['MALE'].values[0]],
-        orientation='h',
-        marker=dict(color="#1F3F49", line=dict(width=1, color='black')),
-        showlegend=False,
-        customdata=census_occ_county[census_occ_county['OCCUPATION_LEVEL']
-                                     == 'SERVICE']['PERCENT_MALE'],
-        hovertemplate="%{y}<br><b>%{customdata:.1f}%</b> are Men",
-    )
+    levels = [level for level, found in zip(EDUCATION_LEVELS, present) if found]
 
-    trace3 = go.Bar(
-        name="",
-        y=['Service'],
-        x=[census_occ_county[census_occ_county['OCCUPATION_LEVEL']
-                             == 'SERVICE']['FEMALE'].values[0]],
-        orientation='h',
-        text=[census_occ_county[census_occ_county['OCCUPATION_LEVEL']
-                                == 'SERVICE']['TOTALS'].values[0]],
-        texttemplate='%{text:.4s}',
-        textposition='auto',
-        marker=dict(color="#CED2CC", line=dict(width=1, color='black')),
-        showlegend=False,
-        customdata=census_occ_county[census_occ_county['OCCUPATION_LEVEL']
-                                     == 'SERVICE']['PERCENT FEMALE'],
-        hovertemplate="%{y}<br><b>%{customdata:.1f}%</b> are Women"
-    )
+    return [{
+        'labels': [EDUCATION_LABELS[level] for level in levels],
+        'parents': [""] * len(levels),
+        'marker': {'colors': [EDUCATION_COLORS[level] for level in levels]},
+        'values': joined_values(data, 'census_education', rows[present], 'PERCENT TOTAL'),
+    }]
 
-    trace4 = go.Bar(
-        name="",
-        y=['Sales/Office'],
-        x=[census_occ_county[census_occ_county['OCCUPATION_LEVEL']
-                             == 'SALES_OFFICE']['MALE'].values[0]],
-        orientation='h',
-        marker=dict(color="#1F3F49", line=dict(width=1, color='black')),
-        showlegend=False,
-        customdata=census_occ_county[census_occ_county['OCCUPATION_LEVEL']
-                                     == 'SALES_OFFICE']['PERCENT_MALE'],
-        hovertemplate="%{y}<br><b>%{customdata:.1f}%</b> are Men",
-    )
 
-    trace5 = go.Bar(
-        name="",
-        y=['Sales/Office'],
-        x=[census_occ_county[census_occ_county['OCCUPATION_LEVEL']
-                             == 'SALES_OFFICE']['FEMALE'].values[0]],
-        orientation='h',
-        text=[census_occ_county[census_occ_county['OCCUPATION_LEVEL']
-                                == 'SALES_OFFICE']['TOTALS'].values[0]],
-        texttemplate='%{text:.4s}',
-        textposition='auto',
-        marker=dict(color="#CED2CC", line=dict(width=1, color='black')),
-        showlegend=False,
-        customdata=census_occ_county[census_occ_county['OCCUPATION_LEVEL']
-                                     == 'SALES_OFFICE']['PERCENT FEMALE'],
-        hovertemplate="%{y}<br><b>%{customdata:.1f}%</b> are Women"
-    )
-
-    trace6 = go.Bar(
-        name="",
-        y=['Construction/Natural Resources'],
-        x=[census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'CONSTRUCTION_NATURAL_RESOURCES']['MALE'].values[
-            0]],
-        orientation='h',
-        marker=dict(color="#1F3F49", line=dict(width=1, color='black')),
-        showlegend=False,
-        customdata=census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'CONSTRUCTION_NATURAL_RESOURCES'][
-            'PERCENT_MALE'],
-        hovertemplate="%{y}<br><b>%{customdata:.1f}%</b> are Men",
-    )
-
-    trace7 = go.Bar(
-        name="",
-        y=['Construction/Natural Resources'],
-        x=[census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'CONSTRUCTION_NATURAL_RESOURCES'][
-            'FEMALE'].values[0]],
-        orientation='h',
-        text=[census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'CONSTRUCTION_NATURAL_RESOURCES'][
-            'TOTALS'].values[0]],
-        texttemplate='%{text:.4s}',
-        textposition='auto',
-        marker=dict(color="#CED2CC", line=dict(width=1, color='black')),
-        showlegend=False,
-        customdata=census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'CONSTRUCTION_NATURAL_RESOURCES'][
-            'PERCENT FEMALE'],
-        hovertemplate="%{y}<br><b>%{customdata:.1f}%</b> are Women"
-    )
-
-    trace8 = go.Bar(
-        name="",
-        y=['Production/Transportation/Material'],
-        x=[census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'PRODUCTION_TRANSPORTATION_MATERIAL'][
-            'MALE'].values[0]],
-        orientation='h',
-        marker=dict(color="#1F3F49", line=dict(width=1, color='black')),
-        showlegend=False,
-        customdata=census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'PRODUCTION_TRANSPORTATION_MATERIAL'][
-            'PERCENT_MALE'],
-        hovertemplate="%{y}<br><b>%{customdata:.1f}%</b> are Men",
-    )
-
-    trace9 = go.Bar(
-        name="",
-        y=['Production/Transportation/Material'],
-        x=[census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'PRODUCTION_TRANSPORTATION_MATERIAL'][
-            'FEMALE'].values[0]],
-        orientation='h',
-        text=[census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'PRODUCTION_TRANSPORTATION_MATERIAL'][
-            'TOTALS'].values[0]],
-        texttemplate='%{text:.4s}',
-        textposition='auto',
-        marker=dict(color="#CED2CC", line=dict(width=1, color='black')),
-        showlegend=False,
-        customdata=census_occ_county[census_occ_county['OCCUPATION_LEVEL'] == 'PRODUCTION_TRANSPORTATION_MATERIAL'][
-            'PERCENT FEMALE'],
-        hovertemplate="%{y}<br><b>%{customdata:.1f}%</b> are Women"
-    )
-
-    bar_data = [
-        trace0,
-        trace1,
-        trace2,
-        trace3,
-        trace4,
-        trace5,
-        trace6,
-        trace7,
-        trace8,
-        trace9]
-    layout = go.Layout(
+def generate_treemap(value):
+    """generates a treemap of percent of population with level of education"""
+    return treemap_template.fill(treemap_data(value))
+
+
+# occupation level and label of each pair of bars
+OCCUPATION_LABELS = [
+    ('MANAGEMENT_BUSINESS_SCIENCE_ARTS', 'Management/Business/Science/Arts'),
+    ('SERVICE', 'Service'),
+    ('SALES_OFFICE', 'Sales/Office'),
+    ('CONSTRUCTION_NATURAL_RESOURCES', 'Construction/Natural Resources'),
+    ('PRODUCTION_TRANSPORTATION_MATERIAL', 'Production/Transportation/Material')]
+
+
+def occupation_bars():
+    """a bar for men and one for women in every occupation, only the first pair in the legend"""
+    bars = []
+    for i, (_, label) in enumerate(OCCUPATION_LABELS):
+        if i == 0:
+            men, women = dict(name="Men"), dict(name="Women")
+        else:
+            men = women = dict(name="", showlegend=False)
+
+        bars.append(go.Bar(
+            y=[label],
+            orientation='h',
+            marker=dict(color="#1F3F49", line=dict(width=1, color='black')),
+            hovertemplate="%{y}<br><b>%{customdata:.1f}%</b> are Men",
+            **men))
+        bars.append(go.Bar(
+            y=[label],
+            orientation='h',
+            texttemplate='%{text:.4s}',
+            textposition='auto',
+            marker=dict(color="#CED2CC", line=dict(width=1, color='black')),
+            hovertemplate="%{y}<br><b>%{customdata:.1f}%</b> are Women",
+            **women))
+    return bars
+
+
+bar_template = FigureTemplate(
+    occupation_bars(),
+    go.Layout(
         hovermode="closest",
         hoverlabel=dict(bgcolor="#CED2CC"),
         barmode="stack",
@@ -1046,66 +1072,189 @@ def generate_bar(value):
             r=0,
             t=40,
         ),
-    )
+    ))
+
+
+def bar_data(value):
+    """per county part of the occupation bars, men and women of each occupation"""
+    data = registry.current
+    rows = data.validation.occupation_rows[value]
+    male, female, totals, percent_male, percent_female = (
+        joined_values(data, 'census_occ', rows, column)
+        for column in ['MALE', 'FEMALE', 'TOTALS', 'PERCENT_MALE', 'PERCENT FEMALE'])
+
+    bars = []
+    for level, _ in OCCUPATION_LABELS:
+        i = OCCUPATION_LEVELS.index(level)
+        bars.append({
+            'x': [male[i]],
+            'customdata': [percent_male[i]]})
+        bars.append({
+            'x': [female[i]],
+            'text': [str(totals[i])],
+            'customdata': [percent_female[i]]})
 
-    return {"data": bar_data, "layout": layout}
+    return bars
+
+
+def generate_bar(value):
+    """generates horizontal stacked bar chart showing amount of people in each occupation and percent male/female"""
+    return bar_template.fill(bar_data(value))
+
+
+pie_template = FigureTemplate(
+    [go.Pie(
+        name="",
+        labels=['Native', 'Foreign: Naturalized Citizen',
+                'Foreign: Not U.S. Citizen'],
+        marker=dict(colors=["#1F3F49", "#407D72", "#CED2CC"],
+                    line=dict(width=1, color='black')),
+        textfont=dict(size=14),
+        hovertemplate="<b>%{percent}</b> of population is %{label}"
+    )],
+    go.Layout(
+        hovermode="closest",
+        hoverlabel=dict(bgcolor="#CED2CC"),
+
+    ))
+
+
+def pie_data(value):
+    """per county part of the nativity pie"""
+    data = registry.current
+    row = data.validation.nativity_rows[value]
+
+    totals = [joined_values(data, 'census_nat', row, column).item() for column in (
+        'TOTAL_NATIVE', 'TOTAL_FOREIGN_BORN_NATURALIZED_CITIZEN', 'TOTAL_FOREIGN_BORN_NOT_US_CITIZEN')]
+
+    return [{'values': totals, 'customdata': totals}]
 
 
 def generate_pie(value):
     """pie chart showing the percent of population native, naturalized, and not a US citizen"""
-    county = total_census_grouped.iloc[value]['COUNTYNAME']
-    state = total_census_grouped.iloc[value]['STATE']
-    pie_data = [
-        go.Pie(
+    return pie_template.fill(pie_data(value))
+
+
+def generate_heatmap(method="pearson", year=BASE_YEAR):
+    """heatmap of the correlation between every pair of fields, built once per data version"""
+    data = registry.current
+    # method comes from the page, anything else than spearman draws pearson and is cached as it
+    method = "spearman" if method == "spearman" else "pearson"
+    return data.cached(('heatmap', method, year), lambda: correlation_heatmap(data, method, year))
+
+
+def correlation_heatmap(data, method, year):
+    """builds the correlation heatmap figure"""
+    stats = data.stats(year)
+    if method == "spearman":
+        matrix = stats.spearman
+    else:
+        matrix = stats.pearson
+
+    labels = [metric_labels[metric] for metric in stats.metrics]
+    heat_data = [
+        go.Heatmap(
             name="",
-            labels=['Native', 'Foreign: Naturalized Citizen',
-                    'Foreign: Not U.S. Citizen'],
-            customdata=[census_nat[(census_nat['COUNTYNAME'] == county) & (census_nat["STATE"] == state)][
-                'TOTAL_NATIVE'].values[0],
-                census_nat[(census_nat['COUNTYNAME'] == county) & (census_nat["STATE"] == state)][
-                'TOTAL_FOREIGN_BORN_NATURALIZED_CITIZEN'].values[0],
-                census_nat[(census_nat['COUNTYNAME'] == county) & (census_nat["STATE"] == state)][
-                'TOTAL_FOREIGN_BORN_NOT_US_CITIZEN'].values[0]],
-
-            values=[census_nat[(census_nat['COUNTYNAME'] == county) & (census_nat["STATE"] == state)][
-                'TOTAL_NATIVE'].values[0],
-                census_nat[(census_nat['COUNTYNAME'] == county) & (census_nat["STATE"] == state)][
-                'TOTAL_FOREIGN_BORN_NATURALIZED_CITIZEN'].values[0],
-                census_nat[(census_nat['COUNTYNAME'] == county) & (census_nat["STATE"] == state)][
-                'TOTAL_FOREIGN_BORN_NOT_US_CITIZEN'].values[0]],
-            marker=dict(colors=["#1F3F49", "#407D72", "#CED2CC"],
-                        line=dict(width=1, color='black')),
-            textfont=dict(size=14),
-            hovertemplate="<b>%{percent}</b> of population is %{label}"
+            z=np.round(matrix, 2),
+            x=labels,
+            y=labels,
+            zmin=-1,
+            zmax=1,
+            colorscale='RdBu',
+            hovertemplate="%{y}<br>%{x}<br><b>%{z:.2f}</b>"
         )
-
     ]
+
     layout = go.Layout(
         hovermode="closest",
         hoverlabel=dict(bgcolor="#CED2CC"),
-
+        xaxis=dict(showticklabels=False),
+        yaxis=dict(showticklabels=False, autorange='reversed'),
+        margin=dict(l=10, r=10, t=10, b=10),
+        height=600
     )
-    return {"data": pie_data, "layout": layout}
+
+    return {"data": heat_data, "layout": layout}
+
+
+def generate_similar_list(value, features=None, year=BASE_YEAR):
+    """numbered list of the counties most similar to the selected county"""
+    data = registry.current
+    rows, distances = data.similarity(year).similar(value, features)
+
+    return html.Ol([
+        html.Li([html.B(data.total_census_grouped.iloc[row]['Geographic Area Name']),
+                 " (distance {:.2f})".format(distance)])
+        for row, distance in zip(rows, distances)])
+
+
+def table_value(value):
+    """value as shown in the rank table, 3 digits below 1 for the ratios of derived metrics"""
+    return float("{:.3g}".format(value)) if abs(value) < 1 else round(float(value), 1)
+
+
+def generate_rank_table(dd_select, direction="top", n=10, year=BASE_YEAR):
+    """rows for the table of highest/lowest ranked counties for a metric"""
+    data = registry.current
+    metric_ranks = data.metric_ranks(dd_select, year)
+    if direction == "bottom":
+        rows = metric_ranks.bottom(dd_select, n)
+    else:
+        rows = metric_ranks.top(dd_select, n)
+
+    j = metric_ranks.column[dd_select]
+    return [{"rank": int(metric_ranks.rank[row, j]),
+             "county": data.total_census_grouped.iloc[row]['Geographic Area Name'],
+             "value": table_value(metric_ranks.values[row, j]),
+             "percentile": round(float(metric_ranks.percentile[row, j]), 1)}
+            for row in rows]
 
 
 # create cards for dashboard (what each row is made up of)
 
 
-dropdown_card = dbc.Card(dbc.CardBody([
-    dbc.Row([dbc.Col(
-        [dbc.Row([dbc.Col([html.H4(
-            "Select a Field to Show in Map and on Y axis of Scatterplot")])]), dropdown_map],
-        width=6), dbc.Col(
-        [dbc.Row([dbc.Col([html.H4(
-            "Select a Field to show on X axis of Scatter Plot")])]), dropdown_scatterx],
-        width=6)])
-]
-))
+def generate_dropdown_card(years):
+    """card with the field pickers and the year controls for the years loaded"""
+    return dbc.Card(dbc.CardBody([
+        dbc.Row([dbc.Col(
+            [dbc.Row([dbc.Col([html.H4(
+                "Select a Field to Show in Map and on Y axis of Scatterplot")])]), dropdown_map],
+            width=6), dbc.Col(
+            [dbc.Row([dbc.Col([html.H4(
+                "Select a Field to show on X axis of Scatter Plot")])]), dropdown_scatterx],
+            width=6)]),
+        dbc.Row([dbc.Col(
+            [dbc.Row([dbc.Col([html.H4("Survey Year")])]), generate_year_slider(years)],
+            width=6), dbc.Col(
+            [dbc.Row([dbc.Col([html.H4("Compare the Map to an Earlier Year")])]),
+             generate_since_dropdown(years)],
+            width=6)], className="mt-3"),
+        dbc.Row([dbc.Col(
+            [dbc.Row([dbc.Col([html.H4("Add a Field Computed from Others")])]),
+             dbc.Row([
+                 dbc.Col(dbc.Input(id="metric-expression", type="text", debounce=True,
+                                   placeholder="e.g. MEDIAN_RENT * 12 / MEDIAN_INCOME_DOLLARS"), width=10),
+                 dbc.Col(dbc.Button("Add", id="add-metric", color="primary"), width=2)]),
+             html.Div(id="metric-error", className="text-danger")],
+            width=6), dbc.Col(
+            [dbc.Row([dbc.Col([html.H4("Show Counties Where")])]),
+             dbc.Input(id="county-filter", type="text", debounce=True,
+                       placeholder="e.g. POVERTY_RATE > 20 and MEDIAN_RENT < 700"),
+             html.Div(id="filter-status")],
+            width=6)], className="mt-3")
+    ]
+    ))
+
 
 map_card = dbc.Card(dbc.CardBody([
     dbc.Row([dbc.Col([html.H2(html.Strong("How Counties Compare")), html.H4(
         "Click on a county to see more detailed information about that county further down on the dashboard",
         id="map-text")], width=10)]),
+    dbc.Row([dbc.Col(dbc.Input(id="county-search", type="text", autoComplete="off",
+                               placeholder="Find a county by name, state or FIPS, e.g. Dane WI"), width=6),
+             dbc.Col(dcc.RadioItems(id="search-results", options=[],
+                                    labelStyle={"display": "block"}), width=6)], className="mb-2"),
+    radio_classes,
     dcc.Graph(
 
         id='main-map',
@@ -1131,6 +1280,8 @@ rentbox_card = dbc.Card(dbc.CardBody([
                      style={"text-align": "center"})]),
     dbc.Row(
         [dbc.Col(html.H1("", id="rent_text", style={"text-align": "center"}))]),
+    dbc.Row(
+        [dbc.Col(html.P("", id="rent_rank", style={"text-align": "center"}))]),
 
     dcc.Graph(
         id='box1',
@@ -1146,6 +1297,8 @@ householdvalue_box_card = dbc.Card(dbc.CardBody([
 
     dbc.Row(
         [dbc.Col(html.H1("", id="house_price_text", style={"text-align": "center"}))]),
+    dbc.Row(
+        [dbc.Col(html.P("", id="house_price_rank", style={"text-align": "center"}))]),
 
     dcc.Graph(
         id='box2',
@@ -1161,6 +1314,8 @@ meantimeworkbox_card = dbc.Card(dbc.CardBody([
 
     dbc.Row(
         [dbc.Col(html.H1("", id="commute_text", style={"text-align": "center"}))]),
+    dbc.Row(
+        [dbc.Col(html.P("", id="commute_rank", style={"text-align": "center"}))]),
 
     dcc.Graph(
         id='box3',
@@ -1174,6 +1329,8 @@ dist_card = dbc.Card(dbc.CardBody([
                                 html.H4('Median Household Income: ', )]), style={"text-align": "center"})]),
     dbc.Row(
         [dbc.Col(html.H1("", id="inc_text", style={"text-align": "center"}))]),
+    dbc.Row(
+        [dbc.Col(html.P("", id="inc_rank", style={"text-align": "center"}))]),
 
     dcc.Graph(
         id='distribution',
@@ -1213,6 +1370,42 @@ pie_card = dbc.Card(dbc.CardBody([
 
 ]), color='light')
 
+similar_card = dbc.Card(dbc.CardBody([
+    dbc.Row([dbc.Col([html.H2(html.Strong("Counties Like This One")),
+                      html.H4("Which counties are most similar to Dane County, Wisconsin?", id="similar-title")])]),
+    dbc.Row([dbc.Col([html.H5("Compare on these fields (leave empty to use every census field)"),
+                      dropdown_similar])], className="mb-2"),
+    html.Div(generate_similar_list(713), id="similar-list")
+]), color='light')
+
+rank_card = dbc.Card(dbc.CardBody([
+    dbc.Row([dbc.Col([html.H2(html.Strong("Where Does Each County Rank?")),
+                      html.H4("Counties with the highest or lowest values for the field selected for the map",
+                              id="rank-title")])]),
+    dbc.Row([dbc.Col(radio_rank_direction, width=8), dbc.Col(dropdown_rank_n, width=4)],
+            className="mb-2"),
+    dash_table.DataTable(
+        id='rank-table',
+        columns=[{"name": "Rank", "id": "rank"},
+                 {"name": "County", "id": "county"},
+                 {"name": "Value", "id": "value"},
+                 {"name": "Percentile", "id": "percentile"}],
+        data=generate_rank_table("UNEMPL_RATE"),
+        style_cell={"text-align": "left"},
+        style_as_list_view=True,
+    )
+]), color='light')
+
+heatmap_card = dbc.Card(dbc.CardBody([
+    dbc.Row([dbc.Col([html.H2(html.Strong("How Census Fields Move Together")),
+                      html.H4("Correlation between every pair of fields, hover over a square to see the pair")])]),
+    radio_correlation,
+    dcc.Graph(
+        id='heatmap',
+        figure=generate_heatmap("pearson")
+    )
+]), color='light')
+
 # create card groups (for each row)
 
 
@@ -1223,8 +1416,6 @@ title_cards = dbc.Row(dbc.Col([html.H1(
             style={"font-size": "20px", "top-margin": "10px", "color": "#333333",
                    "text-align": "center"})]), className="mb-3",
     style={"background-color": "#407D72", "padding": "30px"})
-dropdown_cards = dbc.Row(
-    [dbc.Col(dropdown_card, width=12, style={"height": "100%"})], className="mb-3")
 firstrow_cards = dbc.Row(
     [dbc.Col(map_card, width=8, style={"height": "100%"}), dbc.Col(
         scatter_card, width=4, style={"height": "100%"})],
@@ -1240,79 +1431,132 @@ thirdrow_cards = dbc.Row(
     [dbc.Col(tree_card, width=4), dbc.Col(bar_card, width=4, style={
         "height": "100%"}), dbc.Col(pie_card, width=4)],
     className='mb-3')
+fourthrow_cards = dbc.Row(
+    [dbc.Col(similar_card, width=6), dbc.Col(rank_card, width=6)], className='mb-3')
+fifthrow_cards = dbc.Row(
+    [dbc.Col(heatmap_card, width=12)], className='mb-3')
 
 # actually create the layout
 
-app.layout = dbc.Container(
-    children=[
-        title_cards,
-        dropdown_cards,
-        firstrow_cards,
-        secondrow_cards,
-        thirdrow_cards],
-    id="content",
-    className="h-100",
-    style={
-        "padding": "20px",
-        "margin": "5px"},
-    fluid=True)
+
+def serve_layout():
+    """layout for each page load, so the year controls follow data reloaded since startup"""
+    dropdown_cards = dbc.Row(
+        [dbc.Col(generate_dropdown_card(registry.current.vintages.years),
+                 width=12, style={"height": "100%"})], className="mb-3")
+
+    return dbc.Container(
+        children=[
+            # identifies the page for the server side state of its callbacks
+            dcc.Store(id="session", data=uuid.uuid4().hex),
+            title_cards,
+            dropdown_cards,
+            firstrow_cards,
+            secondrow_cards,
+            thirdrow_cards,
+            fourthrow_cards,
+            fifthrow_cards],
+        id="content",
+        className="h-100",
+        style={
+            "padding": "20px",
+            "margin": "5px"},
+        fluid=True)
+
+
+app.layout = serve_layout
 
 
 # The callbacks!! Updating each chart
 
 @app.callback(
     Output("main-map", "figure"),
-    [Input("dropdown_map", "value"), Input("scatter", "clickData")],
+    [Input("dropdown_map", "value"), Input("scatter", "clickData"),
+     Input("main-map", "clickData"), Input("dropdown_similar", "value"),
+     Input("year-slider", "value"), Input("dropdown_since", "value"),
+     Input("radio_classes", "value"), Input("county-filter", "value")],
+    [State("session", "data")]
 )
-def update_choro(dd_select, scatterclick):
-    """update the map if someone clicks on a county in the scatter plot"""
+@session_state.skip_unchanged("map", pass_session=True)
+@coalesce("map")
+def update_choro(dd_select, scatterclick, choroclick, similar_features, year, since, method, query):
+    """update the map if someone clicks on a county in the scatter plot or map, highlighting similar counties"""
+    data = registry.current
+
+    triggered = [t["prop_id"] for t in dash.callback_context.triggered]
 
-    if scatterclick:
+    # follow whichever graph was clicked last, the map wins when neither just changed
+    if scatterclick and ("scatter.clickData" in triggered or not choroclick):
         value = []
-        pointnumbers = []
         for point in scatterclick["points"]:
-            value.append(point["text"])
-            pointnumbers.append(point["pointNumber"])
+            value.append(point["customdata"])
+    elif choroclick:
+        value = []
+        for point in choroclick["points"]:
+            value.append(point["pointNumber"])
+    else:
+        value = None
+
+    year = loaded_year(year)
+    if since not in registry.current.vintages.years:
+        since = None
+
+    if method not in METHODS:
+        method = "quantile"
+
+    matching = filter_matches(query, year)
+
+    if value:
+
+        similar, _ = data.similarity(year).similar(value[0], similar_features)
 
-            return generate_choro(dd_select, [pointnumbers[0]])
+        return generate_choro(dd_select, [value[0]] + similar.tolist(), year, since, method, matching)
 
-    return generate_choro(dd_select, None)
+    return generate_choro(dd_select, None, year, since, method, matching)
 
 
 @app.callback(
     Output("scatter", "figure"),
     [Input("dropdown_scatterx", "value"), Input(
-        "dropdown_map", "value"), Input("main-map", "clickData")]
+        "dropdown_map", "value"), Input("main-map", "clickData"),
+     Input("year-slider", "value"), Input("county-filter", "value")],
+    [State("session", "data")]
 )
-def update_scatter(dd_select_x, dd_select_y, choroclick):
+@session_state.skip_unchanged("scatter", pass_session=True)
+@coalesce("scatter")
+def update_scatter(dd_select_x, dd_select_y, choroclick, year, query):
     """Highlight county on scatter if clicked on the map"""
     if not dd_select_y:
         dd_select_y = "UNEMPL_RATE"
     if not dd_select_x:
         dd_select_x = "POVERTY_RATE"
+    year = loaded_year(year)
+    matching = filter_matches(query, year)
     if choroclick:
         value = []
         for point in choroclick["points"]:
             value.append(point["pointNumber"])
 
-            return generate_scatter(dd_select_x, dd_select_y, value[0])
+            return generate_scatter(dd_select_x, dd_select_y, value[0], year, matching)
     else:
-        return generate_scatter(dd_select_x, dd_select_y, 713)
+        return generate_scatter(dd_select_x, dd_select_y, 713, year, matching)
 
 
 @app.callback(
     Output("county_text1", "children"),
-    [Input("main-map", "clickData")]
-
+    [Input("main-map", "clickData")],
+    [State("session", "data")]
 )
+@session_state.skip_unchanged("county_text1")
 def update_rent_text(choro_click):
     """Update what county has been clicked on in the text above the rent box plot"""
+    data = registry.current
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
 
-            return total_census_grouped.iloc[value[0]]["COUNTYNAME"]
+            return data.total_census_grouped.iloc[value[0]]["COUNTYNAME"]
 
     else:
 
@@ -1321,53 +1565,43 @@ def update_rent_text(choro_click):
 
 @app.callback(
     Output("rent_text", "children"),
-    [Input("main-map", "clickData")]
+    [Input("main-map", "clickData"), Input("year-slider", "value")],
+    [State("session", "data")]
 )
-def update_rent(choro_click):
+@session_state.skip_unchanged("rent_text")
+def update_rent(choro_click, year):
     """update the value in text above rent box plot based on what has been clicked on in the map"""
+    data = registry.current
+    year = loaded_year(year)
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
-            rent = total_census_grouped.iloc[value[0]]["MEDIAN_RENT"]
+            rent = data.vintages.values("MEDIAN_RENT", year)[value[0]]
 
-            return "$" + str(rent)
+            return format_value(rent, "$")
 
     else:
-        rent = total_census_grouped.iloc[713]["MEDIAN_RENT"]
-
-        return "$" + str(rent)
-
-
-@app.callback(
-    Output("box1", "figure"),
-    [Input("main-map", "clickData")]
-)
-def update_rentbox(choroclick):
-    """update rent box plot highlighted value based on what county was clicked on in the map"""
+        rent = data.vintages.values("MEDIAN_RENT", year)[713]
 
-    if choroclick:
-        value = []
-        for point in choroclick["points"]:
-            value.append(point["pointNumber"])
-            return generate_rentbox(value[0])
-    else:
-        return generate_rentbox(713)
+        return format_value(rent, "$")
 
 
 @app.callback(
     Output("county_text2", "children"),
-    [Input("main-map", "clickData")]
-
+    [Input("main-map", "clickData")],
+    [State("session", "data")]
 )
+@session_state.skip_unchanged("county_text2")
 def update_house_text(choro_click):
     """Update text above household value boxplot based on what county was clicked on in the map"""
+    data = registry.current
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
 
-            return total_census_grouped.iloc[value[0]]["COUNTYNAME"]
+            return data.total_census_grouped.iloc[value[0]]["COUNTYNAME"]
 
     else:
 
@@ -1376,54 +1610,43 @@ def update_house_text(choro_click):
 
 @app.callback(
     Output("house_price_text", "children"),
-    [Input("main-map", "clickData")]
+    [Input("main-map", "clickData"), Input("year-slider", "value")],
+    [State("session", "data")]
 )
-def update_house_price(choro_click):
+@session_state.skip_unchanged("house_price_text")
+def update_house_price(choro_click, year):
     """Update text above household value boxplot based on what county was clicked on in the map"""
+    data = registry.current
+    year = loaded_year(year)
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
-            house_price = total_census_grouped.iloc[value[0]
-                                                    ]["MEDIAN_HOUSEHOLD_VALUE"]
+            house_price = data.vintages.values("MEDIAN_HOUSEHOLD_VALUE", year)[value[0]]
 
-            return "$" + str(house_price)
+            return format_value(house_price, "$")
 
     else:
-        house_price = total_census_grouped.iloc[713]["MEDIAN_HOUSEHOLD_VALUE"]
+        house_price = data.vintages.values("MEDIAN_HOUSEHOLD_VALUE", year)[713]
 
-        return "$" + str(house_price)
-
-
-@app.callback(
-    Output("box2", "figure"),
-    [Input("main-map", "clickData")]
-)
-def update_householdvaluebox(choroclick):
-    """update household value highlighed in boxplot based on what county was clicked on in map"""
-
-    if choroclick:
-        value = []
-        for point in choroclick["points"]:
-            value.append(point["pointNumber"])
-            return generate_householdvalue_box(value[0])
-    else:
-        return generate_householdvalue_box(713)
+        return format_value(house_price, "$")
 
 
 @app.callback(
     Output("county_text3", "children"),
-    [Input("main-map", "clickData")]
-
+    [Input("main-map", "clickData")],
+    [State("session", "data")]
 )
+@session_state.skip_unchanged("county_text3")
 def update_commute_text(choro_click):
     """update text above commute boxplot based on what county was clicked on in map"""
+    data = registry.current
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
 
-            return total_census_grouped.iloc[value[0]]["COUNTYNAME"]
+            return data.total_census_grouped.iloc[value[0]]["COUNTYNAME"]
 
     else:
 
@@ -1432,56 +1655,44 @@ def update_commute_text(choro_click):
 
 @app.callback(
     Output("commute_text", "children"),
-    [Input("main-map", "clickData")]
+    [Input("main-map", "clickData"), Input("year-slider", "value")],
+    [State("session", "data")]
 )
-def update_commute(choro_click):
+@session_state.skip_unchanged("commute_text")
+def update_commute(choro_click, year):
     """update text above commute boxplot on what county was clicked on in map"""
+    data = registry.current
+    year = loaded_year(year)
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
-            commute = round(
-                float(total_census_grouped.iloc[value[0]]["MEAN_TIME_TO_WORK_MIN"]))
+            commute = data.vintages.values("MEAN_TIME_TO_WORK_MIN", year)[value[0]]
 
-            return str(commute)
+            return format_value(commute, "")
 
     else:
-        commute = round(
-            float(total_census_grouped.iloc[713]["MEAN_TIME_TO_WORK_MIN"]))
+        commute = data.vintages.values("MEAN_TIME_TO_WORK_MIN", year)[713]
 
-        return str(commute)
-
-
-@app.callback(
-    Output("box3", "figure"),
-    [Input("main-map", "clickData")]
-)
-def update_commutebox(choroclick):
-    """update commute values highlighted in boxplot based on what county was clicked on in map"""
-
-    if choroclick:
-        value = []
-        for point in choroclick["points"]:
-            value.append(point["pointNumber"])
-            return generate_meantimework_box(value[0])
-    else:
-        return generate_meantimework_box(713)
+        return format_value(commute, "")
 
 
 @app.callback(
     Output("inc", "children"),
-    [Input("main-map", "clickData")]
-
+    [Input("main-map", "clickData")],
+    [State("session", "data")]
 )
+@session_state.skip_unchanged("inc")
 def update_dist_text(choro_click):
     """update text above histogram based on what county was clicked on in map"""
+    data = registry.current
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
 
             return "Income Distribution for " + \
-                total_census_grouped.iloc[value[0]]["COUNTYNAME"]
+                data.total_census_grouped.iloc[value[0]]["COUNTYNAME"]
 
     else:
 
@@ -1490,56 +1701,43 @@ def update_dist_text(choro_click):
 
 @app.callback(
     Output("inc_text", "children"),
-    [Input("main-map", "clickData")]
+    [Input("main-map", "clickData"), Input("year-slider", "value")],
+    [State("session", "data")]
 )
-def update_inc(choro_click):
+@session_state.skip_unchanged("inc_text")
+def update_inc(choro_click, year):
     """update income info in text above histogram based on what county was clicked on in map"""
+    data = registry.current
+    year = loaded_year(year)
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
-            inc = round(
-                float(total_census_grouped.iloc[value[0]]["MEDIAN_INCOME_DOLLARS"]))
+            inc = data.vintages.values("MEDIAN_INCOME_DOLLARS", year)[value[0]]
 
-            return '$' + str(inc)
+            return format_value(inc, '$')
 
     else:
-        inc = round(
-            float(total_census_grouped.iloc[713]["MEDIAN_INCOME_DOLLARS"]))
+        inc = data.vintages.values("MEDIAN_INCOME_DOLLARS", year)[713]
 
-        return '$' + str(inc)
-
-
-@app.callback(
-    Output('distribution', 'figure'),
-    [Input('main-map', "clickData")]
-)
-def update_dist(choroclick):
-    """update histogram based on what on what county was clicked on in map """
-    if choroclick:
-        value = []
-        for point in choroclick["points"]:
-            value.append(point["pointNumber"])
-
-        return generate_dist(value[0])
-    # county = "Abbeville County"
-    else:
-
-        return generate_dist(713)
+        return format_value(inc, '$')
 
 
 @app.callback(
     Output("education", "children"),
-    [Input("main-map", "clickData")]
+    [Input("main-map", "clickData")],
+    [State("session", "data")]
 )
+@session_state.skip_unchanged("education")
 def update_education_text(choro_click):
     """update text above treemap based on what county was clicked on in map"""
+    data = registry.current
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
-            county = total_census_grouped.iloc[value[0]]["COUNTYNAME"]
-            state = total_census_grouped.iloc[value[0]]["state"]
+            county = data.total_census_grouped.iloc[value[0]]["COUNTYNAME"]
+            state = data.total_census_grouped.iloc[value[0]]["state"]
             return "How educated is " + county + ', ' + state
 
     else:
@@ -1549,16 +1747,19 @@ def update_education_text(choro_click):
 
 @app.callback(
     Output("occup", "children"),
-    [Input("main-map", "clickData")]
+    [Input("main-map", "clickData")],
+    [State("session", "data")]
 )
+@session_state.skip_unchanged("occup")
 def update_occup_text(choro_click):
     """update text above occupation based on what county was clicked on in map"""
+    data = registry.current
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
-            county = total_census_grouped.iloc[value[0]]["COUNTYNAME"]
-            state = total_census_grouped.iloc[value[0]]["state"]
+            county = data.total_census_grouped.iloc[value[0]]["COUNTYNAME"]
+            state = data.total_census_grouped.iloc[value[0]]["state"]
             return "Comparing Occupations for " + county + ', ' + state
 
     else:
@@ -1568,16 +1769,19 @@ def update_occup_text(choro_click):
 
 @app.callback(
     Output("nativ", "children"),
-    [Input("main-map", "clickData")]
+    [Input("main-map", "clickData")],
+    [State("session", "data")]
 )
+@session_state.skip_unchanged("nativ")
 def update_occup_text(choro_click):
     """update text above pie chart based on what county was clicked on in map"""
+    data = registry.current
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
-            county = total_census_grouped.iloc[value[0]]["COUNTYNAME"]
-            state = total_census_grouped.iloc[value[0]]["state"]
+            county = data.total_census_grouped.iloc[value[0]]["COUNTYNAME"]
+            state = data.total_census_grouped.iloc[value[0]]["state"]
             return "How many people have immigrated to " + county + ', ' + state
 
     else:
@@ -1586,59 +1790,382 @@ def update_occup_text(choro_click):
 
 
 @app.callback(
-    Output('treemap', 'figure'),
-    [Input('main-map', "clickData")]
+    [Output("box1", "figure"), Output("box2", "figure"), Output("box3", "figure"),
+     Output("distribution", "figure"), Output("treemap", "figure"), Output("bar", "figure"),
+     Output("pie", "figure")],
+    [Input("main-map", "clickData"), Input("year-slider", "value"),
+     Input("county-filter", "value")],
+    [State("session", "data")]
 )
-def update_treemap(choroclick):
-    """update treemap based on what county was clicked on in map"""
+@session_state.skip_unchanged("details", pass_session=True)
+@coalesce("details")
+def update_details(choroclick, year, query):
+    """update the box plots, histogram, treemap, bar and pie charts of the county clicked on in the map
+
+    The seven figures are built at the same time on the figure pool.
+    """
+    value = 713
     if choroclick:
+        value = choroclick["points"][0]["pointNumber"]
+    year = loaded_year(year)
+    matching = filter_matches(query, year)
+
+    jobs = [(generate_rentbox, value, year, matching), (generate_householdvalue_box, value, year, matching),
+            (generate_meantimework_box, value, year, matching)]
+
+    # charts the page was last sent for this county are left as they are: a filter
+    # only changes the box plots, and the treemap, bar and pie charts show the base
+    # year tables only. What was sent is what the session state last recorded, not
+    # what triggered this render, since a render in between may never have arrived
+    previous = session_state.previous("details")
+    shown = previous is not None and previous[0] == click_fips(choroclick)
+    if shown and loaded_year(previous[1]) == year:
+        return figure_pool.build(jobs) + [dash.no_update] * 4
+
+    jobs.append((generate_dist, value, year))
+
+    if shown:
+        return figure_pool.build(jobs) + [dash.no_update] * 3
+
+    jobs += [(generate_treemap, value), (generate_bar, value), (generate_pie, value)]
+    return figure_pool.build(jobs)
+
+
+@app.callback(
+    Output("rent_rank", "children"),
+    [Input("main-map", "clickData"), Input("year-slider", "value")],
+    [State("session", "data")]
+)
+@session_state.skip_unchanged("rent_rank")
+def update_rent_rank(choro_click, year):
+    """update national rank shown above rent box plot based on what county was clicked on in map"""
+    data = registry.current
+    if choro_click:
         value = []
-        for point in choroclick["points"]:
+        for point in choro_click["points"]:
+            value.append(point["pointNumber"])
+
+        return rank_text(data.ranks(loaded_year(year)), "MEDIAN_RENT", value[0])
+
+    else:
+
+        return rank_text(data.ranks(loaded_year(year)), "MEDIAN_RENT", 713)
+
+
+@app.callback(
+    Output("house_price_rank", "children"),
+    [Input("main-map", "clickData"), Input("year-slider", "value")],
+    [State("session", "data")]
+)
+@session_state.skip_unchanged("house_price_rank")
+def update_house_price_rank(choro_click, year):
+    """update national rank shown above household value boxplot based on what county was clicked on in map"""
+    data = registry.current
+    if choro_click:
+        value = []
+        for point in choro_click["points"]:
             value.append(point["pointNumber"])
 
-        return generate_treemap(value[0])
-    # county = "Abbeville County"
+        return rank_text(data.ranks(loaded_year(year)), "MEDIAN_HOUSEHOLD_VALUE", value[0])
+
     else:
 
-        return generate_treemap(713)
+        return rank_text(data.ranks(loaded_year(year)), "MEDIAN_HOUSEHOLD_VALUE", 713)
 
 
 @app.callback(
-    Output('bar', "figure"),
-    [Input('main-map', "clickData")]
+    Output("commute_rank", "children"),
+    [Input("main-map", "clickData"), Input("year-slider", "value")],
+    [State("session", "data")]
 )
-def update_bar(choro_click):
-    """update barchart based on what county was clicked on in map"""
+@session_state.skip_unchanged("commute_rank")
+def update_commute_rank(choro_click, year):
+    """update national rank shown above commute boxplot based on what county was clicked on in map"""
+    data = registry.current
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
 
-        return generate_bar(value[0])
-    # county = "Abbeville County"
+        return rank_text(data.ranks(loaded_year(year)), "MEAN_TIME_TO_WORK_MIN", value[0])
+
     else:
 
-        return generate_bar(713)
+        return rank_text(data.ranks(loaded_year(year)), "MEAN_TIME_TO_WORK_MIN", 713)
 
 
 @app.callback(
-    Output("pie", "figure"),
-    [Input('main-map', "clickData")]
+    Output("inc_rank", "children"),
+    [Input("main-map", "clickData"), Input("year-slider", "value")],
+    [State("session", "data")]
+)
+@session_state.skip_unchanged("inc_rank")
+def update_inc_rank(choro_click, year):
+    """update national rank shown above histogram based on what county was clicked on in map"""
+    data = registry.current
+    if choro_click:
+        value = []
+        for point in choro_click["points"]:
+            value.append(point["pointNumber"])
+
+        return rank_text(data.ranks(loaded_year(year)), "MEDIAN_INCOME_DOLLARS", value[0])
+
+    else:
+
+        return rank_text(data.ranks(loaded_year(year)), "MEDIAN_INCOME_DOLLARS", 713)
 
+
+@app.callback(
+    [Output("rank-table", "data"), Output("rank-title", "children")],
+    [Input("dropdown_map", "value"), Input("radio_rank_direction", "value"),
+     Input("dropdown_rank_n", "value"), Input("year-slider", "value")],
+    [State("session", "data")]
 )
-def update_pie(choro_click):
-    """update piechart based on what county was clicked on in map"""
+@session_state.skip_unchanged("rank-table")
+def update_rank_table(dd_select, direction, n, year):
+    """update ranking table when a new field, direction or number of counties is picked"""
+    if not dd_select:
+        dd_select = "UNEMPL_RATE"
+    if not n:
+        n = 10
+
+    if direction == "bottom":
+        title = "Counties with the lowest " + metric_label(dd_select)
+    else:
+        title = "Counties with the highest " + metric_label(dd_select)
+
+    return generate_rank_table(dd_select, direction, n, loaded_year(year)), title
+
+
+@app.callback(
+    [Output("dropdown_map", "options"), Output("dropdown_scatterx", "options"),
+     Output("dropdown_map", "value"), Output("metric-error", "children")],
+    [Input("add-metric", "n_clicks")],
+    [State("metric-expression", "value"), State("dropdown_map", "options"),
+     State("dropdown_scatterx", "options"), State("session", "data")]
+)
+@session_state.skip_unchanged("dropdown_map")
+def add_metric(n_clicks, text, map_options, scatter_options):
+    """add a derived metric to both field pickers and show it on the map"""
+    if not n_clicks or not text:
+        raise PreventUpdate
+
+    data = registry.current
+    try:
+        expression = data.expression(text)
+        if not expression.columns:
+            raise ExpressionError("a field needs at least one census column")
+        # evaluated now, the map and the scatter asking for it next find it cached,
+        # and an unknown column is reported here rather than by the map
+        data.values(expression.text, BASE_YEAR)
+    except ExpressionError as error:
+        return dash.no_update, dash.no_update, dash.no_update, str(error)
+
+    option = {"label": expression.text, "value": expression.text}
+    if option["value"] not in [existing["value"] for existing in map_options]:
+        map_options = map_options + [option]
+        scatter_options = scatter_options + [option]
+    return map_options, scatter_options, expression.text, ""
+
+
+@app.callback(
+    Output("filter-status", "children"),
+    [Input("county-filter", "value"), Input("year-slider", "value")],
+    [State("session", "data")]
+)
+@session_state.skip_unchanged("filter-status")
+def update_filter_status(query, year):
+    """how many counties a filter matches, or what is wrong with it"""
+    if not query:
+        return ""
+    data = registry.current
+    try:
+        matching = data.matching(query, loaded_year(year))
+    except ExpressionError as error:
+        return html.Span(str(error), className="text-danger")
+    return "{:,} of {:,} counties match".format(int(matching.sum()), len(matching))
+
+
+@app.callback(
+    [Output("search-results", "options"), Output("search-results", "value")],
+    [Input("county-search", "value")],
+    [State("session", "data")]
+)
+@session_state.skip_unchanged("search-results")
+def update_search_results(query):
+    """counties best matching what is typed in the search box, none picked yet"""
+    if not query:
+        return [], None
+    matches = registry.current.search().search(query)
+    return [{"label": name, "value": fips} for _, fips, name in matches], None
+
+
+@app.callback(
+    Output("main-map", "clickData"),
+    [Input("search-results", "value"), Input("county-search", "n_submit")],
+    [State("county-search", "value"), State("session", "data")]
+)
+@session_state.skip_unchanged("search-select")
+def select_searched_county(fips, submitted, query):
+    """select the county picked from the search results, or the best match on enter
+
+    The county is selected as if it was clicked on the map, so every chart follows it.
+    """
+    triggered = [t["prop_id"] for t in dash.callback_context.triggered]
+    search = registry.current.search()
+    if "county-search.n_submit" in triggered:
+        matches = search.search(query or "", limit=1)
+        county = matches[0] if matches else None
+    else:
+        county = search.county(fips) if fips else None
+    if county is None:
+        raise PreventUpdate
+    row, fips, _ = county
+    return {"points": [{"curveNumber": 0, "pointNumber": row, "pointIndex": row, "location": fips}]}
+
+
+@app.callback(
+    [Output("similar-list", "children"), Output("similar-title", "children")],
+    [Input("main-map", "clickData"), Input("dropdown_similar", "value"),
+     Input("year-slider", "value")],
+    [State("session", "data")]
+)
+@session_state.skip_unchanged("similar-list")
+def update_similar(choro_click, similar_features, year):
+    """update list of similar counties based on what county was clicked on in map and the fields picked"""
+    data = registry.current
     if choro_click:
         value = []
         for point in choro_click["points"]:
             value.append(point["pointNumber"])
+        name = data.total_census_grouped.iloc[value[0]]["Geographic Area Name"]
+
+        return generate_similar_list(value[0], similar_features, loaded_year(year)), \
+            "Which counties are most similar to " + name + "?"
 
-        return generate_pie(value[0])
-    # county = "Abbeville County"
     else:
 
-        return generate_pie(713)
+        return generate_similar_list(713, similar_features, loaded_year(year)), \
+            "Which counties are most similar to Dane County, Wisconsin?"
+
+
+@app.callback(
+    Output("heatmap", "figure"),
+    [Input("radio_correlation", "value"), Input("year-slider", "value")],
+    [State("session", "data")]
+)
+@session_state.skip_unchanged("heatmap")
+def update_heatmap(method, year):
+    """switch the heatmap between Pearson and Spearman correlation and between census years"""
+    return generate_heatmap(method, loaded_year(year))
+
+
+@server.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    """rebuild the data in the background and swap it in, e.g. after copying new files into data/"""
+    supplied = flask.request.headers.get('X-Admin-Token', '')
+    if not ADMIN_TOKEN or not hmac.compare_digest(supplied, ADMIN_TOKEN):
+        flask.abort(404)
+
+    registry.reload_in_background(force=flask.request.args.get('force') == '1')
+    return flask.jsonify({'version': registry.current.version, 'reloading': True}), 202
+
+
+@server.route('/export/counties')
+def export_counties():
+    """stream the profiles of a list of counties (fips=), a state (state=) or all of them"""
+    data = registry.current
+    args = flask.request.args
+
+    export_format = args.get('format', 'csv')
+    if export_format not in export.FORMATS:
+        return flask.jsonify(error="format must be one of " + ", ".join(export.FORMATS)), 400
+
+    # parsed here rather than by args.get(type=int), which falls back to the default for junk
+    try:
+        year = int(args.get('year', BASE_YEAR))
+    except ValueError:
+        year = None
+    if year not in data.vintages.years:
+        return flask.jsonify(error="no census data for {}".format(args.get('year'))), 400
+
+    try:
+        fips = export.parse_fips(args['fips']) if 'fips' in args else None
+    except ValueError as error:
+        return flask.jsonify(error=str(error)), 400
+
+    rows = export.select_rows(data, fips=fips, state=args.get('state'))
+    if not len(rows):
+        return flask.jsonify(error="no counties match"), 404
+
+    chunks = export.profile_chunks(data, rows, year)
+    response = flask.Response(flask.stream_with_context(export.STREAMS[export_format](chunks)),
+                              mimetype=export.FORMATS[export_format])
+    response.headers['Content-Disposition'] = 'attachment; filename=counties-{}.{}'.format(
+        year, export_format)
+    return response
+
+
+server.register_blueprint(create_api(registry))
+
+
+# heading of each chart rendered as an image, by its name in /cards/<fips>/<chart>.png
+CARD_TITLES = {
+    'rent': "Median rent",
+    'house-value': "Median household value",
+    'commute': "Mean time to work (minutes)",
+    'income': "Household income",
+    'education': "Education",
+    'occupation': "Occupations",
+    'nativity': "Native and foreign born",
+}
+
+
+def card_title(row, chart):
+    name = registry.current.total_census_grouped['Geographic Area Name'].values[row]
+    return "{}: {}".format(name, CARD_TITLES[chart])
+
+
+card_renderer = cards.CardRenderer(
+    {'rent': generate_rentbox,
+     'house-value': generate_householdvalue_box,
+     'commute': generate_meantimework_box,
+     'income': generate_dist,
+     # the treemap, bar and pie charts show the base year tables only
+     'education': lambda row, year: generate_treemap(row),
+     'occupation': lambda row, year: generate_bar(row),
+     'nativity': lambda row, year: generate_pie(row)},
+    card_title,
+    cards.DiskCache(CARD_CACHE_DIR, CARD_CACHE_MB * 2 ** 20),
+    code_version=CODE_VERSION)
+
+
+@server.route('/cards/<fips>/<chart>.<image_format>')
+def county_card(fips, chart, image_format):
+    """png or svg image of one of a county's charts"""
+    data = registry.current
+    if image_format not in cards.FORMATS:
+        return flask.jsonify(error="format must be one of " + ", ".join(cards.FORMATS)), 400
+    if chart not in card_renderer.charts:
+        return flask.jsonify(error="chart must be one of " + ", ".join(card_renderer.charts)), 404
+
+    try:
+        year = int(flask.request.args.get('year', BASE_YEAR))
+    except ValueError:
+        year = None
+    if year not in data.vintages.years:
+        return flask.jsonify(error="no census data for {}".format(flask.request.args.get('year'))), 400
+
+    _, row_of = county_index(data)
+    row = row_of.get(int(fips)) if fips.isdigit() else None
+    if row is None:
+        return flask.jsonify(error="no county with FIPS {}".format(fips)), 404
+
+    image = card_renderer.image(data.version, int(fips), row, chart, year, image_format)
+    return flask.Response(image, mimetype=cards.FORMATS[image_format])
 
 
 if __name__ == '__main__':
-    app.run_server(debug=True, port=8000)
+    # development server, DASH_DEBUG=true turns on debug mode and reloading,
+    # serve in production with: gunicorn app:server -c gunicorn.conf.py
+    app.run_server(port=8000)
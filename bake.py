@@ -0,0 +1,198 @@
+"""Bake the dashboard into static files that a plain file server or a CDN can serve
+
+    python bake.py build/
+    python -m http.server --directory build
+
+Everything a visitor can ask of the map, the scatter and the county details is
+computed here once: the value of every metric for every county, the statistics of
+every pair of metrics for the scatter, and every county's detail charts, texts,
+ranks and most similar counties. The page in static_site/ fetches these JSON
+files as it needs them and fills the same figure templates the server fills, so
+clicking around costs no server CPU at all.
+
+    build/
+        index.html, dashboard.js, plotly.min.js
+        data/meta.json              metrics, counties and figure templates
+        data/counties.geojson       county shapes for the map
+        data/<year>/pairs.json      correlation and trend line of every pair of metrics
+        data/<year>/classes.json    map class breaks of every metric by every method
+        data/<year>/change/<since>.json   the same, of the change since another year
+        data/<year>/metrics/<metric>.json
+        data/<year>/counties/<state FIPS>.json   detail payloads, one shard per state
+
+The similar counties are those over all census fields; picking the fields, the
+rank table and the correlation heatmap need the server.
+"""
+import argparse
+import pathlib
+import shutil
+import time
+
+import plotly
+
+import serialize
+from classify import METHODS, Classification
+
+SITE = pathlib.Path(__file__).parent.joinpath('static_site')
+
+# metrics whose value, rank and box plot are shown above the detail charts, by the
+# name the page uses for them
+DETAIL_METRICS = {
+    'rent': ("MEDIAN_RENT", "$"),
+    'house': ("MEDIAN_HOUSEHOLD_VALUE", "$"),
+    'commute': ("MEAN_TIME_TO_WORK_MIN", ""),
+    'income': ("MEDIAN_INCOME_DOLLARS", "$"),
+}
+
+
+def write_json(path, payload):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(serialize.dumps(payload), encoding='utf-8')
+    return path.stat().st_size
+
+
+def template_json(template, strip=()):
+    """plain data and layout of a FigureTemplate, without the trace keys in strip"""
+    data = [{key: value for key, value in trace.items() if key not in strip} for trace in template.data]
+    return {'data': data, 'layout': template.layout}
+
+
+def meta(app, data):
+    """what the page needs before anything is clicked"""
+    table = data.total_census_grouped
+    metrics = [{'value': metric, 'label': app.metric_labels[metric],
+                # hover line with AXIS standing in for z, x or y
+                'hover': app.update_tooltip(metric, 'AXIS'),
+                'axis': app.update_scatter_axis(metric)}
+               for metric in app.metric_columns]
+    return {
+        'base_year': data.base_year,
+        'years': data.vintages.years,
+        'default_row': 713,
+        'metrics': metrics,
+        'counties': {
+            'fips': data.county_fips,
+            'name': app.column_text(data, 'Geographic Area Name'),
+            'county': app.column_text(data, 'COUNTYNAME'),
+            'lat': table.iloc[:, -4].values,
+            'lon': table.iloc[:, -3].values,
+        },
+        'templates': {
+            'choro': template_json(app.choro_template, strip=('geojson',)),
+            'scatter': template_json(app.scatter_template),
+            'box': {name: template_json(template) for name, template in (
+                ('rent', app.rentbox_template), ('house', app.householdvalue_box_template),
+                ('commute', app.meantimework_box_template))},
+            'dist': template_json(app.dist_template),
+            'treemap': template_json(app.treemap_template),
+            'bar': template_json(app.bar_template),
+            'pie': template_json(app.pie_template),
+        },
+        'detail_metrics': {name: column for name, (column, _) in DETAIL_METRICS.items()},
+    }
+
+
+def pairs(app, data, year):
+    """pearson, spearman, r2 and the trend line of every pair of metrics, by x then y"""
+    stats = data.stats(year)
+    baked = {}
+    for x in app.metric_columns:
+        baked[x] = {}
+        for y in app.metric_columns:
+            pair = stats.pair(x, y)
+            trend_x, trend_y = stats.trend_line(x, y)
+            baked[x][y] = {'pearson': pair['pearson'], 'spearman': pair['spearman'],
+                           'r2': pair['r2'], 'trend_x': trend_x, 'trend_y': trend_y}
+    return baked
+
+
+def classes(app, data, year, since=None):
+    """class breaks, legend and colorscale of every metric by every method, by metric then method"""
+    baked = {}
+    for metric in app.metric_columns:
+        baked[metric] = {}
+        for method in METHODS:
+            if since is None:
+                classification = data.classes(year).classes(metric, method)
+            else:
+                classification = Classification(data.vintages.change(metric, year, since), method)
+            baked[metric][method] = {'breaks': classification.breaks,
+                                     'labels': classification.labels() + ['N/A'],
+                                     'colorscale': app.class_colorscale(classification.classes)}
+    return baked
+
+
+def details(app, data, row, year):
+    """everything shown about one county once it is clicked"""
+    ranks = data.ranks(year)
+    similar, distances = data.similarity(year).similar(row)
+    return {
+        'text': {name: app.format_value(data.vintages.values(column, year)[row], prefix)
+                 for name, (column, prefix) in DETAIL_METRICS.items()},
+        'rank': {name: app.rank_text(ranks, column, row)
+                 for name, (column, _) in DETAIL_METRICS.items()},
+        'similar': similar,
+        'distances': distances,
+        'dist': app.dist_data(row, year),
+        'treemap': app.treemap_data(row),
+        'bar': app.bar_data(row),
+        'pie': app.pie_data(row),
+    }
+
+
+def bake(folder):
+    """write the static dashboard to folder, returns the number of files and bytes written"""
+    import app
+    data = app.registry.current
+    folder = pathlib.Path(folder)
+    files = written = 0
+
+    for name in ('index.html', 'dashboard.js'):
+        folder.mkdir(parents=True, exist_ok=True)
+        shutil.copy(SITE.joinpath(name), folder.joinpath(name))
+    shutil.copy(pathlib.Path(plotly.__file__).parent.joinpath('package_data', 'plotly.min.js'),
+                folder.joinpath('plotly.min.js'))
+
+    written += write_json(folder.joinpath('data', 'meta.json'), meta(app, data))
+    written += write_json(folder.joinpath('data', 'counties.geojson'), app.counties)
+    files += 2
+
+    # box plots and the texts above them need their metrics even when they are not in the dropdowns
+    columns = list(dict.fromkeys(app.metric_columns + [column for column, _ in DETAIL_METRICS.values()]))
+    states = {}
+    for row, fips in enumerate(data.county_fips):
+        states.setdefault(fips[:2], []).append(row)
+
+    for year in data.vintages.years:
+        year_folder = folder.joinpath('data', str(year))
+        for column in columns:
+            written += write_json(year_folder.joinpath('metrics', column + '.json'),
+                                  data.vintages.values(column, year))
+        written += write_json(year_folder.joinpath('pairs.json'), pairs(app, data, year))
+        written += write_json(year_folder.joinpath('classes.json'), classes(app, data, year))
+        files += len(columns) + 2
+        for since in data.vintages.years:
+            if since != year:
+                written += write_json(year_folder.joinpath('change', '{}.json'.format(since)),
+                                      classes(app, data, year, since))
+                files += 1
+
+        for state, rows in states.items():
+            shard = {row: details(app, data, row, year) for row in rows}
+            written += write_json(year_folder.joinpath('counties', state + '.json'), shard)
+            files += 1
+    return files, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('folder', nargs='?', default='build')
+    args = parser.parse_args()
+
+    started = time.time()
+    files, written = bake(args.folder)
+    print("baked {} files, {:.1f} MB, in {:.0f}s".format(files, written / 2 ** 20, time.time() - started))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Render the county charts to PNG and SVG images, for reports and emails
+
+    GET /cards/55025/income.png
+    GET /cards/55025/rent.svg?year=2018
+
+Images are drawn offline by kaleido, plotly's static image renderer, from the same
+figures the dashboard shows, and kept in a bounded disk cache keyed by the data
+and code versions, so every image is rendered once per version of the data and of
+the chart code. To fill the
+cache ahead of time, render every county's cards in a pool of processes:
+
+    python cards.py --format png --processes 4
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import os
+import pathlib
+import threading
+import time
+
+import plotly.io as pio
+
+from api import county_index
+
+FORMATS = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+# pixel size of a card image, and how many image pixels per figure pixel in a png
+WIDTH = 700
+HEIGHT = 450
+SCALE = 2
+
+
+class DiskCache:
+    """Files in a folder that together stay under max_bytes, least recently used evicted first
+
+    A file is written under a temporary name and renamed into place, so readers
+    never see a partial image and several processes (gunicorn workers, the batch
+    renderer) can share the folder. Reading a file bumps its modification time,
+    which is what eviction orders by. Each process keeps a running total of what
+    it wrote and scans the folder only once that total passes the budget.
+    """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = pathlib.Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = self.size()
+
+    def path(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return self.folder.joinpath(name[:2], name + '.' + key[-1])
+
+    def size(self):
+        return sum(path.stat().st_size for path in self.folder.glob('*/*') if path.is_file())
+
+    def get(self, key):
+        """contents stored for key, None if there are none"""
+        path = self.path(key)
+        try:
+            content = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return content
+
+    def put(self, key, content):
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        temporary = path.with_name('{}.{}.{}.tmp'.format(path.name, os.getpid(), threading.get_ident()))
+        temporary.write_bytes(content)
+        os.replace(temporary, path)
+        with self._lock:
+            self._size += len(content)
+            if self._size > self.max_bytes:
+                self._size = self.evict()
+
+    def evict(self):
+        """remove the least recently used files until the folder is at 90% of the budget, returns its size"""
+        files = []
+        for path in self.folder.glob('*/*'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort()
+
+        size = sum(size for _, size, _ in files)
+        for _, file_size, path in files:
+            if size <= self.max_bytes * 0.9:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            size -= file_size
+        return size
+
+
+class CardRenderer:
+    """Images of the county charts, rendered on first request and cached on disk
+
+    charts maps a chart name to a function building its figure from a county's row
+    in the county table and a census year. title(row, chart) gives the heading put
+    on the image, since the questions the dashboard shows above each chart are not
+    part of the figures. Cached images are keyed by the data version and by
+    code_version, so they are rendered again after the chart code changes too.
+    """
+
+    def __init__(self, charts, title, cache, width=WIDTH, height=HEIGHT, scale=SCALE, code_version=''):
+        self.charts = charts
+        self.code_version = code_version
+        self.title = title
+        self.cache = cache
+        self.width = width
+        self.height = height
+        self.scale = scale
+
+    def figure(self, row, chart, year):
+        figure = self.charts[chart](row, year)
+        layout = dict(figure.get('layout', {}), title={'text': self.title(row, chart)},
+                      width=self.width, height=self.height)
+        return dict(figure, layout=layout)
+
+    def image(self, version, fips, row, chart, year, image_format):
+        """png or svg bytes of a county's chart"""
+        key = (version, self.code_version, fips, chart, year, self.width, self.height, self.scale, image_format)
+        content = self.cache.get(key)
+        if content is None:
+            # the figures are filled templates, validated when they were built
+            content = pio.to_image(self.figure(row, chart, year), format=image_format,
+                                   scale=self.scale if image_format == 'png' else 1,
+                                   validate=False)
+            self.cache.put(key, content)
+        return content
+
+
+def _render_county(job):
+    """render every chart of one county in a batch process, returns the number of images"""
+    import app
+    data = app.registry.current
+    fips, row, year, image_format = job
+    for chart in app.card_renderer.charts:
+        app.card_renderer.image(data.version, fips, row, chart, year, image_format)
+    return len(app.card_renderer.charts)
+
+
+def render_all(image_format='png', year=None, processes=None):
+    """render the cards of every county into the cache, returns the number of images"""
+    import app
+    data = app.registry.current
+    year = year or data.base_year
+    _, row_of = county_index(data)
+    jobs = [(fips, row, year, image_format) for fips, row in row_of.items()]
+
+    started = time.time()
+    rendered = 0
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        for number, images in enumerate(pool.map(_render_county, jobs, chunksize=8), 1):
+            rendered += images
+            if number % 100 == 0:
+                print("{} of {} counties, {:.0f}s".format(number, len(jobs), time.time() - started))
+    return rendered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="render every county's cards into the image cache")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='png')
+    parser.add_argument('--year', type=int)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    started = time.time()
+    rendered = render_all(args.format, args.year, args.processes)
+    print("rendered {} images in {:.0f}s".format(rendered, time.time() - started))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Class breaks of every metric, computed once, so the map draws classes instead of raw values
+
+A continuous color scale over a skewed metric (house values, the share of non
+citizens) spends almost all of its colors on a handful of outliers. The map
+colors counties by class instead, with the breaks of three classifications:
+
+    quantile         the same number of counties in every class
+    equal_interval   classes of the same width between the lowest and highest value
+    jenks            natural breaks, the classes with the least variance within them
+
+and ships each county's class as a uint8 code rather than its float value.
+"""
+import numpy as np
+
+METHODS = ['quantile', 'equal_interval', 'jenks']
+
+# number of classes the map is drawn with
+CLASSES = 7
+
+# counties are grouped in blocks of this many rows per step of the jenks search
+BLOCK = 256
+
+
+def quantile_breaks(values, k=CLASSES):
+    """upper bounds of the first k - 1 classes, with as many values in each class"""
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return np.zeros(0)
+    return np.unique(np.quantile(values, np.arange(1, k) / k))
+
+
+def equal_interval_breaks(values, k=CLASSES):
+    """upper bounds of the first k - 1 classes, of equal width"""
+    values = values[~np.isnan(values)]
+    if not len(values) or values.min() == values.max():
+        return np.zeros(0)
+    return np.linspace(values.min(), values.max(), k + 1)[1:-1]
+
+
+def jenks_breaks(values, k=CLASSES):
+    """upper bounds of the first k - 1 classes of the Fisher-Jenks natural breaks
+
+    Exact dynamic program over the distinct values, weighted by how many counties
+    have each: the best split of the first i values in m classes is the best split
+    of the first j in m - 1 plus the squared deviations of values j..i, which the
+    prefix sums give for all j at once. Each step is a (block x values) array
+    operation, not a python loop over counties.
+    """
+    values, counts = np.unique(values[~np.isnan(values)], return_counts=True)
+    n = len(values)
+    k = min(k, n)
+    if k < 2:
+        return np.zeros(0)
+
+    weights = np.concatenate([[0], np.cumsum(counts, dtype=np.float64)])
+    sums = np.concatenate([[0], np.cumsum(counts * values, dtype=np.float64)])
+    squares = np.concatenate([[0], np.cumsum(counts * values ** 2, dtype=np.float64)])
+
+    def deviation(first, last):
+        """sum of squared deviations of values first..last from their mean"""
+        total = sums[last + 1] - sums[first]
+        return squares[last + 1] - squares[first] - total ** 2 / (weights[last + 1] - weights[first])
+
+    # cost[i] of the best split of values 0..i in the classes so far, start[m][i]
+    # the first value of the last class in it. That start never moves left as i
+    # grows (the costs form a Monge array), so each block of rows only tries the
+    # starts from the one the previous block's last row picked
+    cost = deviation(np.zeros(n, dtype=np.int64), np.arange(n))
+    start = np.zeros((k, n), dtype=np.int64)
+    for m in range(1, k):
+        best = np.full(n, np.inf)
+        low = m
+        for first in range(m, n, BLOCK):
+            last = np.arange(first, min(first + BLOCK, n))
+            # candidate starts j of the last class, low <= j <= i
+            j = np.arange(low, last[-1] + 1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                split = cost[j - 1][None, :] + deviation(j[None, :], last[:, None])
+            split[j[None, :] > last[:, None]] = np.inf
+            picked = np.argmin(split, axis=1)
+            best[last] = split[np.arange(len(last)), picked]
+            start[m, last] = j[picked]
+            low = start[m, last[-1]]
+        cost = best
+
+    breaks = []
+    last = n - 1
+    for m in range(k - 1, 0, -1):
+        last = start[m, last] - 1
+        breaks.append(values[last])
+    return np.array(breaks[::-1])
+
+
+BREAKS = {'quantile': quantile_breaks, 'equal_interval': equal_interval_breaks, 'jenks': jenks_breaks}
+
+
+def class_codes(values, breaks):
+    """uint8 class of every value, one past the last class where the value is missing"""
+    codes = np.searchsorted(breaks, values, side='left').astype(np.uint8)
+    codes[np.isnan(values)] = len(breaks) + 1
+    return codes
+
+
+def break_text(value):
+    """a break as shown in the legend, whole numbers from 100 up and 3 digits below"""
+    return "{:,.0f}".format(value) if abs(value) >= 100 else "{:.3g}".format(value)
+
+
+def class_labels(breaks, text=break_text):
+    """legend text of each class, e.g. ['≤ 5.0', '5.0 - 9.5', '> 9.5']"""
+    if not len(breaks):
+        return ['all']
+    labels = ['≤ ' + text(breaks[0])]
+    labels += [text(low) + ' - ' + text(high) for low, high in zip(breaks[:-1], breaks[1:])]
+    return labels + ['> ' + text(breaks[-1])]
+
+
+class Classification:
+    """The breaks of one set of values, and the class of each of them"""
+
+    def __init__(self, values, method='quantile', k=CLASSES):
+        if method not in METHODS:
+            raise ValueError("unknown classification method {!r}, one of {}".format(method, ", ".join(METHODS)))
+        values = np.asarray(values)
+        self.method = method
+        # breaks in the precision of the values (float32 census values), so a value
+        # equal to a break compares equal wherever it is read back, e.g. from json
+        self.breaks = BREAKS[method](values.astype(np.float64), k).astype(values.dtype)
+        self.codes = class_codes(values, self.breaks)
+        self.codes.flags.writeable = False
+
+    @property
+    def classes(self):
+        return len(self.breaks) + 1
+
+    def labels(self, text=break_text):
+        return class_labels(self.breaks, text)
+
+
+class MetricClasses:
+    """Breaks and county classes of every metric by every method, computed once at load time
+
+    Reading the classes of a metric is a dictionary lookup: the map callback ships
+    the precomputed codes and never sorts or searches values per request.
+    """
+
+    def __init__(self, df, metrics, k=CLASSES):
+        self.classifications = {
+            (metric, method): Classification(df[metric].to_numpy(), method, k)
+            for metric in metrics for method in METHODS}
+
+    def classes(self, metric, method='quantile'):
+        """Classification of a metric"""
+        if method not in METHODS:
+            raise ValueError("unknown classification method {!r}, one of {}".format(method, ", ".join(METHODS)))
+        return self.classifications[metric, method]
@@ -0,0 +1,86 @@
+import functools
+import threading
+from collections import OrderedDict
+
+from dash.exceptions import PreventUpdate
+
+
+class Coalescer:
+    """Drops renders that a newer request from the same session has already made stale
+
+    Every request for a (session, callback) key takes a ticket. A request that finds
+    an older one for its key still rendering waits for it (at most `wait` seconds),
+    then renders only if no newer ticket came in meanwhile and otherwise gives up
+    with PreventUpdate, leaving the render to the newest request. A finished render
+    that went stale while it ran is dropped too, rather than serialized and sent to
+    a browser that will discard it. A request that finds nothing in flight renders
+    right away, so a single change is never delayed.
+
+    State is per process: under several gunicorn workers it coalesces the requests
+    of a session that land on the same worker. Requests without a session are
+    rendered right away, like SessionState does, since nothing tells them apart.
+    """
+
+    def __init__(self, wait=0.25, max_keys=10000):
+        self.wait = wait
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # key -> newest ticket, oldest keys evicted first
+        self._latest = OrderedDict()
+        # key -> event set when the render in flight for it finishes
+        self._busy = {}
+        self._tickets = 0
+        self.dropped = 0
+
+    def _take(self, key):
+        with self._lock:
+            self._tickets += 1
+            self._latest[key] = self._tickets
+            self._latest.move_to_end(key)
+            while len(self._latest) > self.max_keys:
+                old, _ = self._latest.popitem(last=False)
+                self._busy.pop(old, None)
+            return self._tickets, self._busy.get(key)
+
+    def _current(self, key, ticket):
+        return self._latest.get(key, ticket) == ticket
+
+    def _drop(self):
+        with self._lock:
+            self.dropped += 1
+        raise PreventUpdate
+
+    def __call__(self, name):
+        """decorator for a callback whose last argument is the session id"""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args):
+                if args[-1] is None:
+                    return function(*args[:-1])
+                key = (args[-1], name)
+                ticket, in_flight = self._take(key)
+                if in_flight is not None:
+                    in_flight.wait(self.wait)
+
+                with self._lock:
+                    stale = not self._current(key, ticket)
+                    if not stale:
+                        done = self._busy[key] = threading.Event()
+                if stale:
+                    self._drop()
+
+                try:
+                    result = function(*args[:-1])
+                finally:
+                    with self._lock:
+                        if self._busy.get(key) is done:
+                            del self._busy[key]
+                    done.set()
+
+                with self._lock:
+                    stale = not self._current(key, ticket)
+                if stale:
+                    self._drop()
+                return result
+            return wrapper
+        return decorator
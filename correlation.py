@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+
+class PairwiseStats:
+    """Correlation and least squares fit for every pair of metrics, computed once at load time
+
+    Every statistic is built from a handful of matrix products over the
+    (counties x metrics) values, using only the counties where both metrics
+    of a pair are present. Spearman correlation is Pearson correlation of
+    the metric ranks (average ranks for ties), ranked over those same counties.
+    """
+
+    def __init__(self, df, metrics):
+        self.metrics = list(metrics)
+        self.column = {metric: j for j, metric in enumerate(self.metrics)}
+
+        values = df[self.metrics].apply(pd.to_numeric, errors='coerce')
+
+        pearson, slope, intercept, count = _pairwise(values.to_numpy(dtype=np.float64))
+        spearman = _spearman(values.to_numpy(dtype=np.float64))
+
+        self.pearson = pearson
+        self.spearman = spearman
+        self.r2 = pearson ** 2
+        self.count = count
+        self.minimum = values.min().to_numpy(dtype=np.float64)
+        self.maximum = values.max().to_numpy(dtype=np.float64)
+
+        # slope[x, y] and intercept[x, y] fit y = slope * x + intercept
+        self.slope = slope
+        self.intercept = intercept
+
+    def pair(self, x, y):
+        """all statistics for y plotted against x"""
+        i = self.column[x]
+        j = self.column[y]
+        return {'pearson': float(self.pearson[i, j]),
+                'spearman': float(self.spearman[i, j]),
+                'r2': float(self.r2[i, j]),
+                'slope': float(self.slope[i, j]),
+                'intercept': float(self.intercept[i, j]),
+                'count': int(self.count[i, j])}
+
+    def trend_line(self, x, y):
+        """end points of the least squares line of y on x across the range of x"""
+        i = self.column[x]
+        j = self.column[y]
+        x_range = [float(self.minimum[i]), float(self.maximum[i])]
+        return x_range, [self.slope[i, j] * value + self.intercept[i, j] for value in x_range]
+
+
+def _spearman(values):
+    """pairwise-complete Spearman correlation of all column pairs
+
+    Each pair is ranked over the rows both columns have. Columns missing the same
+    rows are ranked together, so there is one ranking per pair of missing-value
+    patterns rather than per pair of columns (one in all for complete data).
+    """
+    patterns, pattern = np.unique(~np.isnan(values).T, axis=0, return_inverse=True)
+    pattern = pattern.ravel()
+    spearman = np.empty((values.shape[1], values.shape[1]))
+    for a in range(len(patterns)):
+        for b in range(a, len(patterns)):
+            rows = patterns[a] & patterns[b]
+            columns = np.flatnonzero((pattern == a) | (pattern == b))
+            ranks = pd.DataFrame(values[np.ix_(rows, columns)]).rank().to_numpy(dtype=np.float64)
+            correlation = _pairwise(ranks)[0]
+            first = pattern[columns] == a
+            second = pattern[columns] == b
+            spearman[np.ix_(columns[first], columns[second])] = correlation[np.ix_(first, second)]
+            spearman[np.ix_(columns[second], columns[first])] = correlation[np.ix_(second, first)]
+    return spearman
+
+
+def _pairwise(values):
+    """pairwise-complete Pearson r, OLS slope/intercept and counts for all column pairs"""
+    # centre first so the sums of squares don't cancel catastrophically for dollar metrics
+    mean = np.nanmean(values, axis=0)
+    present = (~np.isnan(values)).astype(np.float64)
+    filled = np.nan_to_num(values - mean)
+    squared = filled ** 2
+
+    # [i, j] entries are taken over the rows where both column i and column j are present
+    n = present.T @ present
+    sum_x = filled.T @ present
+    sum_y = sum_x.T
+    sum_xx = squared.T @ present
+    sum_yy = sum_xx.T
+    sum_xy = filled.T @ filled
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_x = sum_xx - sum_x ** 2 / n
+        var_y = sum_yy - sum_y ** 2 / n
+        cov = sum_xy - sum_x * sum_y / n
+
+        pearson = cov / np.sqrt(var_x * var_y)
+        slope = cov / var_x
+        intercept = (sum_y - slope * sum_x) / n + mean[None, :] - slope * mean[:, None]
+
+    return np.clip(pearson, -1, 1), slope, intercept, n.astype(np.int64)
@@ -0,0 +1,54 @@
+import numpy as np
+
+
+def density_sample(x, y, max_points, grid=None, seed=0):
+    """row indices of at most ~max_points points that keep the shape of the x/y point cloud
+
+    Points are binned on a grid x grid lattice and each occupied cell keeps a share
+    of its points proportional to the overall sampling rate, never less than one,
+    so dense regions thin out while sparse regions and outliers survive. Rows with
+    a missing x or y are dropped. The sample is deterministic for a given seed.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    rows = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    if len(rows) <= max_points:
+        return rows
+
+    if grid is None:
+        # few enough cells that the one-point minimum can't swamp the budget
+        grid = int(min(max(np.sqrt(max_points) / 2, 4), 256))
+
+    cell = _grid_cell(x[rows], grid) * grid + _grid_cell(y[rows], grid)
+
+    # shuffle so the points kept within a cell are a random pick, then group by cell
+    shuffle = np.random.default_rng(seed).permutation(len(rows))
+    rows = rows[shuffle]
+    cell = cell[shuffle]
+    order = np.argsort(cell, kind='stable')
+    rows = rows[order]
+    cell = cell[order]
+
+    counts = np.bincount(cell, minlength=grid * grid)
+    starts = np.cumsum(counts) - counts
+    position = np.arange(len(cell)) - starts[cell]
+
+    quota = np.maximum(np.floor(counts * (max_points / len(rows))), 1)
+    return np.sort(rows[position < quota[cell]])
+
+
+def with_rows(rows, keep):
+    """sorted rows with the rows in keep added back, e.g. the selected county"""
+    keep = [row for row in keep if row is not None]
+    if not keep:
+        return rows
+    return np.union1d(rows, np.asarray(keep, dtype=rows.dtype))
+
+
+def _grid_cell(values, grid):
+    """grid column of each value over the range of values"""
+    low = values.min()
+    span = values.max() - low
+    if span == 0:
+        return np.zeros(len(values), dtype=np.int64)
+    return np.minimum(((values - low) / span * grid).astype(np.int64), grid - 1)
@@ -0,0 +1,66 @@
+import hashlib
+
+import flask
+
+# methods a matching If-None-Match is answered with 304 for
+CONDITIONAL_METHODS = ('GET', 'HEAD')
+
+# responses decided by the data version and the request alone (not the layout,
+# which hands every page load its own session id), paths ending in / cover what is under them
+DETERMINISTIC_PATHS = ('/_dash-dependencies', '/api/', '/cards/')
+
+
+class ConditionalResponses:
+    """Strong ETags and 304 Not Modified for GET responses decided by the data and the request alone
+
+    The ETag hashes the data version with the request itself (path, query string,
+    body and accepted encodings), so it is known before the response is built: a GET
+    or HEAD whose If-None-Match already holds it gets a 304 without building the
+    response. Browsers revalidate GETs like the callback dependencies, the JSON API
+    and the county cards this way on their own. Callbacks are POSTs, which a 304 is
+    no answer to, so they are not covered: renders that would repeat what a page
+    already shows are skipped by SessionState instead.
+    """
+
+    def __init__(self, server, version, paths=DETERMINISTIC_PATHS):
+        self.version = version
+        self.paths = paths
+        server.before_request(self.not_modified)
+        server.after_request(self.tag)
+
+    def etag(self):
+        """ETag of the current request"""
+        request = flask.request
+        digest = hashlib.sha1()
+        for part in (self.version(), request.method, request.full_path,
+                     request.headers.get('Accept-Encoding', '')):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        digest.update(request.get_data())
+        return digest.hexdigest()
+
+    def covers(self, path):
+        return any(path.startswith(prefix) if prefix.endswith('/') else path == prefix
+                   for prefix in self.paths)
+
+    def not_modified(self):
+        if not self.covers(flask.request.path):
+            return None
+        etag = flask.g.etag = self.etag()
+        if flask.request.method not in CONDITIONAL_METHODS:
+            return None
+        for sent in flask.request.if_none_match.as_set():
+            # compression may have added the encoding to the tag, e.g. "<etag>:br"
+            if sent.split(':')[0] == etag:
+                response = flask.current_app.response_class(status=304)
+                response.set_etag(sent)
+                return response
+        return None
+
+    def tag(self, response):
+        etag = flask.g.get('etag')
+        if etag and response.status_code == 200:
+            response.set_etag(etag)
+            # keep a copy but check back every time, the data can be reloaded
+            response.headers['Cache-Control'] = 'no-cache'
+        return response
@@ -0,0 +1,138 @@
+"""Stream county profiles in bulk
+
+A profile is a county's identifiers plus every census field of a survey year,
+the same numbers behind the map, the box plots and the income, education,
+occupation and nativity charts. Profiles are built chunk_rows counties at a time
+straight from the per column arrays of the data snapshot and handed out as they
+are encoded, so memory stays the same however many counties are exported.
+
+    GET /export/counties?format=csv
+    GET /export/counties?format=parquet&state=WI
+    GET /export/counties?format=ndjson&fips=55025,17031&year=2018
+"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import serialize
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+CHUNK_ROWS = 500
+
+# numeric columns of the county table that are row numbers or repeat the FIPS code
+SKIP_COLUMNS = ['Unnamed: 0', 'STCOUNTYFP', 'id']
+
+# text columns identifying each county, exported first
+ID_COLUMNS = ['Geographic Area Name', 'COUNTYNAME', 'STATE']
+
+
+def parse_fips(text):
+    """int FIPS codes of a comma separated list like '55025,01001', ValueError if one isn't a code"""
+    codes = [code.strip() for code in text.split(',') if code.strip()]
+    if not all(code.isdigit() and len(code) <= 5 for code in codes):
+        raise ValueError("FIPS codes are up to 5 digits, got {!r}".format(text))
+    return np.array([int(code) for code in codes], dtype=np.int64)
+
+
+def select_rows(data, fips=None, state=None):
+    """rows of the county table to export, one per FIPS code, in FIPS order
+
+    fips is a list of codes, state a USPS code ('WI') or a two digit state FIPS
+    code ('55'), and with neither every county is exported.
+    """
+    table = data.total_census_grouped
+    codes, rows = np.unique(table['FIPS'].values, return_index=True)
+
+    if fips is not None:
+        keep = np.isin(codes, fips)
+    elif state is not None:
+        if state.isdigit():
+            keep = codes // 1000 == int(state)
+        else:
+            keep = table['STATE'].astype(str).values[rows] == state.upper()
+    else:
+        keep = np.ones(len(codes), dtype=bool)
+    return rows[keep]
+
+
+def profile_chunks(data, rows, year, chunk_rows=CHUNK_ROWS):
+    """DataFrames of the profiles of chunk_rows counties at a time"""
+    table = data.total_census_grouped
+    columns = [column for column in data.vintages.columns if column not in SKIP_COLUMNS]
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        profiles = {'FIPS': data.county_fips[chunk]}
+        for column in ID_COLUMNS:
+            profiles[column] = np.asarray(table[column].values[chunk]).astype(str)
+        for column in columns:
+            profiles[column] = data.vintages.values(column, year)[chunk]
+        yield pd.DataFrame(profiles)
+
+
+def csv_stream(chunks):
+    for number, frame in enumerate(chunks):
+        yield frame.to_csv(index=False, header=number == 0)
+
+
+def ndjson_stream(chunks):
+    """one JSON object per county, float32 numbers written as short as in the csv
+    (5.2, where widening them to float64 would give 5.1999998093)"""
+    for frame in chunks:
+        columns = list(frame.columns)
+        records = zip(*(frame[column].to_numpy() for column in columns))
+        yield ''.join(serialize.dumps(dict(zip(columns, record))) + '\n' for record in records)
+
+
+class _Sink:
+    """write only file that collects what the parquet writer writes until it is taken"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def parquet_stream(chunks):
+    """one parquet row group per chunk, sent as soon as it is written"""
+    sink = _Sink()
+    writer = None
+    for frame in chunks:
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.take()
+    if writer is not None:
+        writer.close()
+        yield sink.take()
+
+
+STREAMS = {'csv': csv_stream, 'ndjson': ndjson_stream, 'parquet': parquet_stream}
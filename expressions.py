@@ -0,0 +1,177 @@
+"""Derived metrics: arithmetic over census columns, e.g. MEDIAN_RENT * 12 / MEDIAN_INCOME_DOLLARS
+
+An expression is parsed once (python syntax, but only numbers, column names,
++ - * / **, parentheses and the functions in FUNCTIONS are allowed) and compiled
+into a tree of numpy calls, so evaluating it over every county takes one
+vectorized pass per operator and no python per county. Parsed expressions are
+kept by their text, and the snapshot caches each one's values per year by key,
+a hash of its normalized text: the same metric typed with other spacing or
+redundant parentheses is evaluated once.
+
+The normalized text is also the metric's name in the dropdowns, so any worker
+can evaluate a derived metric picked on a page without having seen it defined.
+"""
+import ast
+import functools
+import hashlib
+
+import numpy as np
+
+FUNCTIONS = {
+    'abs': np.abs,
+    'exp': np.exp,
+    'log': np.log,
+    'log10': np.log10,
+    'sqrt': np.sqrt,
+    'min': np.fmin,
+    'max': np.fmax,
+}
+
+# symbol, precedence and numpy function of each operator
+OPERATORS = {
+    ast.Add: ('+', 1, np.add),
+    ast.Sub: ('-', 1, np.subtract),
+    ast.Mult: ('*', 2, np.multiply),
+    ast.Div: ('/', 2, np.true_divide),
+    ast.Pow: ('**', 4, np.power),
+}
+UNARY = {ast.USub: ('-', np.negative), ast.UAdd: ('+', np.positive)}
+UNARY_PRECEDENCE = 3
+ATOM_PRECEDENCE = 5
+
+# longest expression and most operators, columns and numbers accepted
+MAX_LENGTH = 300
+MAX_NODES = 60
+
+
+class ExpressionError(ValueError):
+    """an expression that can't be parsed or refers to something unknown"""
+
+
+class Expression:
+    """A parsed derived metric
+
+    text is the normalized expression, columns the census columns it reads and
+    key the hash its values are cached under.
+    """
+
+    def __init__(self, text):
+        if len(text) > MAX_LENGTH:
+            raise ExpressionError("expression longer than {} characters".format(MAX_LENGTH))
+        try:
+            tree = ast.parse(text.strip(), mode='eval')
+        except SyntaxError:
+            raise ExpressionError("not a valid expression: {}".format(text))
+        if sum(1 for _ in ast.walk(tree)) > MAX_NODES:
+            raise ExpressionError("expression too long")
+        self._build(tree.body)
+
+    @classmethod
+    def from_node(cls, node):
+        """Expression of an ast node parsed as part of something else, e.g. a filter"""
+        expression = cls.__new__(cls)
+        expression._build(node)
+        return expression
+
+    def _build(self, node):
+        self.columns = []
+        self.text, _, self._evaluate = self._compile(node)
+        self.key = hashlib.sha1(self.text.encode()).hexdigest()[:12]
+
+    def _compile(self, node):
+        """normalized text, precedence and numpy evaluation of a node"""
+        if isinstance(node, ast.BinOp) and type(node.op) in OPERATORS:
+            symbol, precedence, function = OPERATORS[type(node.op)]
+            left, right = self._compile(node.left), self._compile(node.right)
+            # ** groups to the right, the others to the left
+            left_text = _parenthesize(left, precedence, node.op.__class__ is ast.Pow)
+            right_text = _parenthesize(right, precedence, node.op.__class__ is not ast.Pow)
+            left_eval, right_eval = left[2], right[2]
+            return (left_text + ' ' + symbol + ' ' + right_text, precedence,
+                    lambda read: function(left_eval(read), right_eval(read)))
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY:
+            symbol, function = UNARY[type(node.op)]
+            operand = self._compile(node.operand)
+            operand_eval = operand[2]
+            return (symbol + _parenthesize(operand, UNARY_PRECEDENCE, True), UNARY_PRECEDENCE,
+                    lambda read: function(operand_eval(read)))
+
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            name = node.func.id
+            if name not in FUNCTIONS:
+                raise ExpressionError("unknown function {}, use one of {}".format(
+                    name, ", ".join(sorted(FUNCTIONS))))
+            function = FUNCTIONS[name]
+            arguments = [self._compile(argument) for argument in node.args]
+            evaluations = [argument[2] for argument in arguments]
+            if len(arguments) != (2 if name in ('min', 'max') else 1):
+                raise ExpressionError("wrong number of arguments to {}".format(name))
+            return (name + '(' + ', '.join(argument[0] for argument in arguments) + ')', ATOM_PRECEDENCE,
+                    lambda read: function(*[evaluate(read) for evaluate in evaluations]))
+
+        if isinstance(node, ast.Name):
+            name = node.id
+            if name not in self.columns:
+                self.columns.append(name)
+            return name, ATOM_PRECEDENCE, lambda read: read(name)
+
+        number = number_of(node)
+        if number is not None:
+            # inf and nan would be written back as names, 'inf' reads as a column
+            if not np.isfinite(number):
+                raise ExpressionError("numbers must be finite")
+            return number_text(number), ATOM_PRECEDENCE, lambda read: number
+
+        raise ExpressionError("only numbers, columns, + - * / ** and {} are allowed".format(
+            ", ".join(sorted(FUNCTIONS))))
+
+    def evaluate(self, column, rows):
+        """float32 values of the rows counties, reading each column with column(name)
+
+        Divisions by zero and other undefined results are missing values (NaN).
+        """
+        def read(name):
+            return np.asarray(column(name), dtype=np.float64)
+
+        with np.errstate(all='ignore'):
+            values = np.broadcast_to(np.asarray(self._evaluate(read), dtype=np.float64), (rows,))
+            values = np.where(np.isfinite(values), values, np.nan).astype(np.float32)
+        values.flags.writeable = False
+        return values
+
+
+def _parenthesize(compiled, precedence, strict):
+    """text of an operand, in parentheses when it binds looser than its operator"""
+    text, own, _ = compiled
+    if own < precedence or (strict and own == precedence):
+        return '(' + text + ')'
+    return text
+
+
+def number_text(value):
+    """a number as written in normalized text, 12 rather than 12.0"""
+    return str(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+
+def number_of(node):
+    """value of a number literal (or a negated one), None for any other node"""
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY:
+        value = number_of(node.operand)
+        return None if value is None else float(UNARY[type(node.op)][1](value))
+    # numbers are ast.Num before python 3.8, ast.Constant after
+    if type(node).__name__ == 'Constant':
+        value = node.value
+    elif type(node).__name__ == 'Num':
+        value = node.n
+    else:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+@functools.lru_cache(maxsize=1024)
+def parse(text):
+    """Expression of text, parsed once per distinct text"""
+    return Expression(text)
@@ -0,0 +1,147 @@
+"""Filters like POVERTY_RATE > 20 and MEDIAN_RENT < 700, answered from sorted indexes
+
+FilterIndex keeps, for every metric, its values sorted and each county's position
+among them. A comparison with a number is then a binary search for the range of
+positions that match, and the counties in it are found with two comparisons of
+the position column, no sorting or scanning of values per request. Comparisons
+give one boolean per county and are combined with & | ~, so a compound filter
+over every county costs a few microseconds per condition.
+
+Queries use python syntax: comparisons of a field, or of a derived expression
+(see expressions.py), with numbers, chained ones like 10 <= UNEMPL_RATE < 20
+too, combined with and, or, not and parentheses.
+"""
+import ast
+import functools
+
+import numpy as np
+
+from expressions import MAX_LENGTH, MAX_NODES, Expression, ExpressionError, number_of, number_text
+
+COMPARISONS = {ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=', ast.Eq: '=='}
+
+# the comparison with its sides swapped, 20 < X is X > 20
+FLIPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '=='}
+
+
+class FilterIndex:
+    """Sorted values of every metric and the position of every county among them
+
+    Missing values sort last, after the count present, so no comparison matches them.
+    """
+
+    def __init__(self, frame, metrics):
+        self.metrics = list(metrics)
+        self.column = {metric: j for j, metric in enumerate(self.metrics)}
+
+        values = frame[self.metrics].to_numpy()
+        order = np.argsort(values, axis=0, kind='stable')
+        self.sorted = np.asfortranarray(np.take_along_axis(values, order, axis=0))
+        self.count = (~np.isnan(values)).sum(axis=0)
+
+        # one column per metric read at a time, kept contiguous
+        self.position = np.empty(values.shape, dtype=np.int32, order='F')
+        np.put_along_axis(self.position, order, np.arange(len(values), dtype=np.int32)[:, None], axis=0)
+
+    def compare(self, metric, operator, value):
+        """mask of the counties whose value of metric compares to value with operator"""
+        j = self.column[metric]
+        column = self.sorted[:self.count[j], j]
+        # in the precision of the values, so == matches a value as it is displayed
+        value = column.dtype.type(value)
+        low, high = 0, len(column)
+        if operator in ('>', '>=', '=='):
+            low = np.searchsorted(column, value, side='right' if operator == '>' else 'left')
+        if operator in ('<', '<=', '=='):
+            high = np.searchsorted(column, value, side='left' if operator == '<' else 'right')
+        position = self.position[:, j]
+        return (position >= low) & (position < high)
+
+
+class CountyFilter:
+    """A parsed filter query
+
+    text is the normalized query and metrics the normalized text of every field
+    or derived expression it compares.
+    """
+
+    def __init__(self, text):
+        if len(text) > MAX_LENGTH:
+            raise ExpressionError("filter longer than {} characters".format(MAX_LENGTH))
+        try:
+            tree = ast.parse(text.strip(), mode='eval')
+        except SyntaxError:
+            raise ExpressionError("not a valid filter: {}".format(text))
+        if sum(1 for _ in ast.walk(tree)) > MAX_NODES:
+            raise ExpressionError("filter too long")
+
+        self.metrics = []
+        self.text, self._mask = self._compile(tree.body)
+
+    def _compile(self, node):
+        """normalized text and mask function (index of a metric -> mask) of a node"""
+        if isinstance(node, ast.BoolOp):
+            word = ' and ' if isinstance(node.op, ast.And) else ' or '
+            parts = [self._compile(value) for value in node.values]
+            texts = [_group(value, text, node.op) for value, (text, _) in zip(node.values, parts)]
+            masks = [mask for _, mask in parts]
+            combine = np.logical_and.reduce if isinstance(node.op, ast.And) else np.logical_or.reduce
+            return word.join(texts), lambda index: combine([mask(index) for mask in masks])
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            text, mask = self._compile(node.operand)
+            if isinstance(node.operand, ast.BoolOp):
+                text = '(' + text + ')'
+            return 'not ' + text, lambda index: ~mask(index)
+
+        if isinstance(node, ast.Compare):
+            operands = [node.left] + node.comparators
+            texts = []
+            conditions = []
+            for left, operator, right in zip(operands, node.ops, operands[1:]):
+                if type(operator) not in COMPARISONS:
+                    raise ExpressionError("compare with <, <=, >, >= or ==")
+                conditions.append(self._condition(left, COMPARISONS[type(operator)], right))
+            for operand, operator in zip(operands, node.ops):
+                texts += [_operand_text(operand), COMPARISONS[type(operator)]]
+            texts.append(_operand_text(operands[-1]))
+            return ' '.join(texts), lambda index: np.logical_and.reduce(
+                [index(metric).compare(metric, operator, value) for metric, operator, value in conditions])
+
+        raise ExpressionError("a filter compares fields with numbers, e.g. POVERTY_RATE > 20 and MEDIAN_RENT < 700")
+
+    def _condition(self, left, operator, right):
+        """(metric, operator, number) of one comparison, the field on the left"""
+        if number_of(right) is None:
+            left, right, operator = right, left, FLIPPED[operator]
+        value = number_of(right)
+        if value is None or number_of(left) is not None:
+            raise ExpressionError("compare a field with a number")
+        metric = Expression.from_node(left).text
+        if metric not in self.metrics:
+            self.metrics.append(metric)
+        return metric, operator, value
+
+    def mask(self, index):
+        """bool per county, True where it matches; index(metric) is a FilterIndex with metric in it"""
+        return self._mask(index)
+
+
+def _group(node, text, op):
+    """text of a part of an and/or, in parentheses when it is the other one"""
+    if isinstance(node, ast.BoolOp) and type(node.op) is not type(op):
+        return '(' + text + ')'
+    return text
+
+
+def _operand_text(node):
+    value = number_of(node)
+    if value is None:
+        return Expression.from_node(node).text
+    return number_text(value)
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_filter(text):
+    """CountyFilter of text, parsed once per distinct text"""
+    return CountyFilter(text)
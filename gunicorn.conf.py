@@ -0,0 +1,49 @@
+"""Production settings for serving the dashboard with gunicorn
+
+    gunicorn app:server -c gunicorn.conf.py
+
+The app is imported once in the master before the workers fork (preload_app),
+so the census tables and everything built from them are loaded a single time and
+shared by every worker until a worker writes to them. Every setting can be
+overridden from the environment or the command line, e.g. --workers 2.
+
+Reload gracefully with `kill -HUP <master pid>`: new workers start and the old
+ones finish the requests they hold. With preload the code is not re-imported on
+HUP, so deploy new code with a full restart.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:' + os.getenv('PORT', '8000'))
+
+preload_app = True
+
+# the callbacks are cpu bound (numpy, pandas, json), so one worker per core, and
+# a few threads each to keep the cores busy while requests wait on the network
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+# the workers share what each page was last sent, so none skips a render the page needs
+if workers > 1:
+    os.environ.setdefault('SESSION_STORE', 'sqlite:' + os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'cache', 'sessions.sqlite'))
+
+# the browser keeps one connection open for the stream of callback requests
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+timeout = 60
+graceful_timeout = 30
+
+# recycle workers now and then, forking from the preloaded master is cheap
+max_requests = 2000
+max_requests_jitter = 200
+
+accesslog = os.getenv('GUNICORN_ACCESSLOG')
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """threads don't survive the fork, start the data watcher again in every worker"""
+    import app
+    if app.DATA_WATCH_INTERVAL:
+        app.registry.watch(app.DATA_WATCH_INTERVAL)
@@ -0,0 +1,254 @@
+"""Stream census CSVs into partitioned parquet files
+
+Source files are read in chunks, so memory stays bounded no matter how many rows
+(county, tract or block group) a file has. A first pass decides which columns
+are text and which numeric, for the whole file, so every part gets the same
+dtypes. Then each chunk is validated, converted to those compact dtypes and split
+by schema family (income, education, occupation, nativity, housing, core) and by
+state, and written as its own parquet part:
+
+    <out>/<geography>/<family>/state=<SS>/part-<chunk>.parquet
+
+A manifest.json next to the families records the columns of every family and the
+validation report. PartitionStore reads back only the partitions a view needs.
+
+    python ingest.py data/acs_tracts.csv --geography tract --key GEOID
+"""
+import argparse
+import json
+import pathlib
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# digits in the FIPS/GEOID key of each geography, the first two are the state
+KEY_WIDTH = {'county': 5, 'tract': 11, 'block_group': 12}
+
+# placeholders the ACS tables use for missing or suppressed values
+MISSING_VALUES = ['-', 'N', '(X)', '**', '***', '*****', 'null']
+
+OCCUPATIONS = ['MANAGEMENT_BUSINESS_SCIENCE_ARTS', 'SERVICE', 'SALES_OFFICE',
+               'CONSTRUCTION_NATURAL_RESOURCES', 'PRODUCTION_TRANSPORTATION_MATERIAL',
+               'EMPLOYED']
+
+FAMILIES = ['income', 'education', 'occupation', 'nativity', 'housing', 'core']
+
+
+def column_family(column):
+    """schema family a census column belongs to"""
+    if column.startswith('INCOME_') or column == 'MEDIAN_INCOME_DOLLARS':
+        return 'income'
+    if column.startswith('EDUCATION'):
+        return 'education'
+    if any(column.endswith(occupation) for occupation in OCCUPATIONS):
+        return 'occupation'
+    if 'NATIVE' in column or 'FOREIGN' in column or column.upper() == 'TOTAL_POPULATION':
+        return 'nativity'
+    if column.startswith(('OWNER_', 'RENT_', 'MEDIAN_RENT', 'MEDIAN_HOUSEHOLD_VALUE')) or \
+            column.endswith(('_UNITS', '_UNITs', '_MORTGAGE')):
+        return 'housing'
+    return 'core'
+
+
+def is_percent(column):
+    """columns holding a percentage, which must lie within 0-100"""
+    if column.startswith(('MALE_', 'FEMALE_')):
+        return not column.endswith('_EMPLOYED')
+    return column.startswith(('PER_', 'PERCENT', 'EDUCATION', 'INCOME_')) or \
+        column.endswith('_RATE')
+
+
+class Report:
+    """running validation counts for one ingest"""
+
+    def __init__(self):
+        self.rows = 0
+        self.rejected_keys = 0
+        self.duplicate_keys = 0
+        self.coerced = {}
+        self.out_of_range = {}
+
+    def add(self, counts, column, n):
+        if n:
+            counts[column] = counts.get(column, 0) + int(n)
+
+    def to_dict(self):
+        return {'rows': self.rows, 'rejected_keys': self.rejected_keys,
+                'duplicate_keys': self.duplicate_keys, 'coerced_to_missing': self.coerced,
+                'out_of_range': self.out_of_range}
+
+
+def read_chunks(source, key, chunksize, text=()):
+    """chunks of the source, the key and text columns read as text"""
+    dtype = dict.fromkeys(text, str)
+    dtype[key] = str
+    return pd.read_csv(source, chunksize=chunksize, dtype=dtype,
+                       na_values=MISSING_VALUES, low_memory=False)
+
+
+def text_columns(source, key, chunksize=20000):
+    """columns of the source that are text, decided once for the whole file
+
+    A column is text when fewer than half of its values read as numbers, so a
+    numeric column with a few placeholders stays numeric.
+    """
+    present = {}
+    numeric = {}
+    for chunk in read_chunks(source, key, chunksize):
+        for column in chunk.columns:
+            if column == key or column.startswith('Unnamed'):
+                continue
+            values = chunk[column]
+            present[column] = present.get(column, 0) + int(values.notna().sum())
+            if not pd.api.types.is_numeric_dtype(values):
+                values = pd.to_numeric(values, errors='coerce')
+            numeric[column] = numeric.get(column, 0) + int(values.notna().sum())
+    return {column for column in present if numeric[column] < present[column] / 2}
+
+
+def clean_chunk(chunk, key, width, report, seen, text=frozenset()):
+    """validate one chunk and convert it to compact dtypes, text columns to categories"""
+    chunk = chunk.drop(columns=[c for c in chunk.columns if c.startswith('Unnamed')])
+
+    keys = chunk[key].astype(str).str.strip().str.split('.').str[0].str.zfill(width)
+    valid = keys.str.match(r'\d{%d}$' % width)
+    report.rejected_keys += int((~valid).sum())
+    chunk = chunk[valid.values].copy()
+    keys = keys[valid.values]
+
+    # keys are unique across the whole file, not just the chunk
+    codes = keys.astype(np.int64).values
+    duplicated = pd.Series(codes).duplicated().values | np.isin(codes, seen[0])
+    report.duplicate_keys += int(duplicated.sum())
+    chunk = chunk[~duplicated]
+    keys = keys[~duplicated]
+    seen[0] = np.union1d(seen[0], codes[~duplicated])
+
+    chunk[key] = keys.values
+    chunk['STATEFP'] = keys.str[:2].values
+
+    for column in chunk.columns:
+        if column in (key, 'STATEFP'):
+            continue
+        values = chunk[column]
+        if column in text:
+            chunk[column] = values.astype('category')
+            continue
+        if not pd.api.types.is_numeric_dtype(values):
+            numeric = pd.to_numeric(values, errors='coerce')
+            report.add(report.coerced, column, numeric.isna().sum() - values.isna().sum())
+            values = numeric
+
+        if is_percent(column):
+            bad = (values < 0) | (values > 100)
+            report.add(report.out_of_range, column, bad.sum())
+            values = values.mask(bad)
+
+        # float32 for every numeric so all parts agree on the dtype, it holds counts exactly up to 2**24
+        chunk[column] = values.astype(np.float32)
+
+    report.rows += len(chunk)
+    return chunk
+
+
+def ingest(source, out, geography='county', key='FIPS', chunksize=20000):
+    """stream one source CSV into partitioned parquet files, returns the manifest"""
+    width = KEY_WIDTH[geography]
+    root = pathlib.Path(out).joinpath(geography)
+    # parts of an earlier ingest of this geography would otherwise mix with the new
+    # ones, also those of one that stopped before writing its manifest
+    if root.exists():
+        shutil.rmtree(root)
+    report = Report()
+    seen = [np.empty(0, dtype=np.int64)]
+    family_columns = {}
+    text = text_columns(source, key, chunksize)
+
+    for number, chunk in enumerate(read_chunks(source, key, chunksize, text)):
+        chunk = clean_chunk(chunk, key, width, report, seen, text)
+
+        by_family = {}
+        for column in chunk.columns:
+            if column not in (key, 'STATEFP'):
+                by_family.setdefault(column_family(column), []).append(column)
+
+        for family, columns in by_family.items():
+            known = family_columns.setdefault(family, [])
+            known.extend(column for column in columns if column not in known)
+
+            part = chunk[[key, 'STATEFP'] + columns]
+            for state, rows in part.groupby('STATEFP', sort=False, observed=True):
+                folder = root.joinpath(family, 'state=' + state)
+                folder.mkdir(parents=True, exist_ok=True)
+                rows.drop(columns='STATEFP').to_parquet(
+                    folder.joinpath('part-%05d.parquet' % number), index=False)
+
+    manifest = {'geography': geography, 'key': key, 'source': str(source),
+                'families': family_columns, 'report': report.to_dict()}
+    root.mkdir(parents=True, exist_ok=True)
+    root.joinpath('manifest.json').write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+class PartitionStore:
+    """reads back only the families, states and columns a view needs"""
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+
+    def manifest(self, geography):
+        return json.loads(self.root.joinpath(geography, 'manifest.json').read_text())
+
+    def files(self, geography, family, states=None):
+        folder = self.root.joinpath(geography, family)
+        if states is None:
+            return sorted(folder.glob('state=*/*.parquet'))
+        return sorted(path for state in states
+                      for path in folder.joinpath('state=' + state).glob('*.parquet'))
+
+    def load(self, geography, families=FAMILIES, states=None, columns=None):
+        """one row per key with the requested families joined side by side
+
+        states restricts to two digit state FIPS codes, columns to a subset of the
+        family columns. Nothing is kept after it is returned, a view that needs a
+        table again reads it again, so memory stays bounded by what is in use.
+        """
+        manifest = self.manifest(geography)
+        key = manifest['key']
+
+        table = None
+        for family in families:
+            wanted = manifest['families'].get(family, [])
+            if columns is not None:
+                wanted = [column for column in wanted if column in columns]
+                if not wanted:
+                    continue
+            parts = [pd.read_parquet(path, columns=[key] + wanted)
+                     for path in self.files(geography, family, states)]
+            if not parts:
+                continue
+            frame = pd.concat(parts, ignore_index=True)
+            table = frame if table is None else table.merge(frame, on=key, how='outer')
+
+        if table is None:
+            return pd.DataFrame(columns=[key])
+        return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', help="CSV file to ingest")
+    parser.add_argument('--out', default=str(pathlib.Path(__file__).parent.joinpath(
+        'data', 'partitions')), help="root folder of the partitioned files")
+    parser.add_argument('--geography', default='county', choices=sorted(KEY_WIDTH))
+    parser.add_argument('--key', default='FIPS', help="FIPS/GEOID column of the source")
+    parser.add_argument('--chunksize', type=int, default=20000)
+    args = parser.parse_args()
+
+    manifest = ingest(args.source, args.out, args.geography, args.key, args.chunksize)
+    print(json.dumps(manifest['report'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Load test the dashboard the way browsers use it
+
+Every client repeatedly picks a random metric and county and fires the callbacks a
+browser fires for that: the map, the scatter and the county details. Requests go
+back to back on a kept-alive connection, so the numbers show what the server can
+sustain, not what a person clicking would ask of it. Each client is its own browser
+session, so the server's per-session render skipping and coalescing treat it as
+one. Responses that skipped the render (204) or left some outputs as they were are
+counted apart from full renders, and the latency percentiles are of full renders.
+
+    gunicorn app:server -c gunicorn.conf.py
+    python loadtest.py http://localhost:8000 --clients 16 --duration 30
+"""
+import argparse
+import gzip
+import http.client
+import json
+import pathlib
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+
+# callbacks fired on every pick, by their first output
+SCENARIO = ['main-map.figure', 'scatter.figure', 'box1.figure', 'rent_text.children',
+            'rent_rank.children', 'similar-list.children']
+
+
+def find(component, component_id):
+    """props of the component with the given id in a layout"""
+    if isinstance(component, dict):
+        props = component.get('props', {})
+        if props.get('id') == component_id:
+            return props
+        component = props.get('children')
+    if isinstance(component, list):
+        for child in component:
+            found = find(child, component_id)
+            if found is not None:
+                return found
+    elif isinstance(component, dict):
+        return find(component, component_id)
+    return None
+
+
+class Client:
+    """one kept-alive connection to the dashboard"""
+
+    def __init__(self, url):
+        self.url = urllib.parse.urlsplit(url)
+        self.connect()
+
+    def connect(self):
+        self.connection = http.client.HTTPConnection(
+            self.url.hostname, self.url.port or 80, timeout=120)
+
+    def request(self, method, path, body=None):
+        """status and (decompressed) body of a request"""
+        # compressed like a browser would have it, gzip since brotli is not in the standard library
+        headers = {'Accept-Encoding': 'gzip'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # the server closed the kept-alive connection (e.g. a recycled worker), a
+            # browser would reconnect and send the request again
+            self.connection.close()
+            self.connect()
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+        data = response.read()
+        if response.status not in (200, 204):
+            raise RuntimeError('{} {}: {}'.format(path, response.status, data[:200]))
+        if response.getheader('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        return response.status, data
+
+
+def callback_body(dependency, values, session):
+    """body of the callback request for the given input values, from a browser session"""
+    output = dependency['output']
+    if output.startswith('..'):
+        outputs = [dict(zip(('id', 'property'), part.split('.')))
+                   for part in output.strip('.').split('...')]
+    else:
+        outputs = dict(zip(('id', 'property'), output.split('.')))
+    inputs = [dict(id=i['id'], property=i['property'], value=values.get((i['id'], i['property'])))
+              for i in dependency['inputs']]
+    return {'output': output, 'outputs': outputs, 'inputs': inputs,
+            'changedPropIds': [inputs[0]['id'] + '.' + inputs[0]['property']],
+            'state': [dict(id=s['id'], property=s['property'],
+                           value=session if s['id'] == 'session' else values.get((s['id'], s['property'])))
+                      for s in dependency.get('state', [])]}
+
+
+def outcome(status, data, dependency):
+    """'rendered', 'partial' when some outputs were left as they are, or 'skipped' (204)"""
+    if status == 204:
+        return 'skipped'
+    outputs = dependency['output'].strip('.').split('...')
+    response = json.loads(data).get('response', {})
+    sent = sum(len(properties) for properties in response.values()) if isinstance(response, dict) else 1
+    return 'partial' if sent < len(outputs) else 'rendered'
+
+
+def run(url, clients, duration, seed=0):
+    """requests per second and latency percentiles (ms) of clients hitting url for duration seconds"""
+    setup = Client(url)
+    layout = json.loads(setup.request('GET', '/_dash-layout')[1])
+    dependencies = json.loads(setup.request('GET', '/_dash-dependencies')[1])
+    metrics = [option['value'] for option in find(layout, 'dropdown_map')['options']]
+    years = find(layout, 'year-slider')
+    year = years['value'] if years else None
+    rows = sum(1 for _ in open(pathlib.Path(__file__).parent.joinpath(
+        'data', 'total_census_county_grouped.csv'))) - 1
+
+    scenario = [d for d in dependencies if any(output in d['output'] for output in SCENARIO)]
+
+    latencies = []
+    outcomes = {'rendered': 0, 'partial': 0, 'skipped': 0}
+    errors = []
+    lock = threading.Lock()
+    stop = time.time() + duration
+
+    def client(number):
+        picks = random.Random(seed + number)
+        connection = Client(url)
+        session = uuid.uuid4().hex
+        while time.time() < stop:
+            row = picks.randrange(rows)
+            click = {'points': [{'pointNumber': row, 'customdata': row, 'curveNumber': 0}]}
+            values = {('dropdown_map', 'value'): picks.choice(metrics),
+                      ('dropdown_scatterx', 'value'): picks.choice(metrics),
+                      ('main-map', 'clickData'): click,
+                      ('year-slider', 'value'): year,
+                      ('radio_rank_direction', 'value'): 'top',
+                      ('dropdown_rank_n', 'value'): 10,
+                      ('radio_correlation', 'value'): 'pearson'}
+            for dependency in scenario:
+                start = time.perf_counter()
+                try:
+                    status, data = connection.request('POST', '/_dash-update-component',
+                                                      callback_body(dependency, values, session))
+                except Exception as error:
+                    with lock:
+                        errors.append(repr(error))
+                    connection = Client(url)
+                    continue
+                latency = time.perf_counter() - start
+                result = outcome(status, data, dependency)
+                with lock:
+                    outcomes[result] += 1
+                    if result == 'rendered':
+                        latencies.append(latency)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(int(p / 100 * len(latencies)), len(latencies) - 1)] * 1000 \
+            if latencies else float('nan')
+
+    if errors:
+        print("first error:", errors[0])
+    requests = sum(outcomes.values())
+    return {'requests': requests, 'rendered': outcomes['rendered'], 'partial': outcomes['partial'],
+            'skipped': outcomes['skipped'], 'errors': len(errors),
+            'requests_per_second': requests / elapsed,
+            'renders_per_second': outcomes['rendered'] / elapsed,
+            'p50_ms': percentile(50), 'p90_ms': percentile(90), 'p99_ms': percentile(99)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url', nargs='?', default='http://localhost:8000')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    args = parser.parse_args()
+
+    result = run(args.url, args.clients, args.duration)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
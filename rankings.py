@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+
+class MetricRanks:
+    """Rank, percentile and z-score of every county for every metric, computed once at load time
+
+    All lookups index into precomputed (counties x metrics) arrays, so asking where a county
+    sits is O(1) and asking for the top/bottom N counties is O(N); nothing is sorted per request.
+    """
+
+    def __init__(self, df, metrics):
+        self.metrics = list(metrics)
+        self.column = {metric: j for j, metric in enumerate(self.metrics)}
+
+        # some metric columns come in as strings because of '-' / 'N' placeholders
+        values = df[self.metrics].apply(
+            pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+        missing = np.isnan(values)
+
+        self.values = values
+        self.count = (~missing).sum(axis=0)
+
+        mean = np.nanmean(values, axis=0)
+        std = np.nanstd(values, axis=0)
+        std[std == 0] = np.nan
+        self.zscore = (values - mean) / std
+
+        # descending order per metric, missing values pushed to the end
+        filled = np.where(missing, -np.inf, values)
+        self.order = np.argsort(-filled, axis=0, kind='stable')
+
+        # rank 1 is the highest value, ties share the best rank
+        ascending = np.sort(np.where(missing, np.inf, values), axis=0)
+        self.rank = np.zeros(values.shape, dtype=np.int32)
+        for j in range(values.shape[1]):
+            n = self.count[j]
+            above = n - np.searchsorted(ascending[:n, j], values[:, j], side='right')
+            self.rank[:, j] = np.where(missing[:, j], 0, above + 1)
+
+        # share of counties with a strictly lower value
+        below = self.count - self.rank - _ties(ascending, values, self.count) + 1
+        self.percentile = np.where(
+            missing, np.nan, 100.0 * below / np.maximum(self.count - 1, 1))
+
+    def lookup(self, metric, row):
+        """rank, number of ranked counties, percentile and z-score of one county"""
+        j = self.column[metric]
+        if self.rank[row, j] == 0:
+            return None
+        return {'rank': int(self.rank[row, j]),
+                'count': int(self.count[j]),
+                'percentile': float(self.percentile[row, j]),
+                'zscore': float(self.zscore[row, j])}
+
+    def top(self, metric, n=10):
+        """row indices of the n counties with the highest value"""
+        j = self.column[metric]
+        return self.order[:min(n, self.count[j]), j]
+
+    def bottom(self, metric, n=10):
+        """row indices of the n counties with the lowest value, lowest first"""
+        j = self.column[metric]
+        count = self.count[j]
+        return self.order[max(count - n, 0):count, j][::-1]
+
+
+def _ties(ascending, values, count):
+    """number of counties sharing each county's value (itself included)"""
+    ties = np.zeros(values.shape, dtype=np.int32)
+    for j in range(values.shape[1]):
+        n = count[j]
+        column = ascending[:n, j]
+        ties[:, j] = (np.searchsorted(column, values[:, j], side='right') -
+                      np.searchsorted(column, values[:, j], side='left'))
+    return ties
+
+
+def ordinal(n):
+    """1 -> '1st', 22 -> '22nd'"""
+    if 10 <= n % 100 <= 20:
+        suffix = 'th'
+    else:
+        suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
+    return str(n) + suffix
+
+
+def rank_text(ranks, metric, row):
+    """one line summary of where a county ranks nationally for a metric"""
+    found = ranks.lookup(metric, row)
+    if found is None:
+        return "No national ranking available"
+    return "Ranks {:,} of {:,} counties ({} percentile, z = {:+.2f})".format(
+        found['rank'], found['count'], ordinal(int(found['percentile'])), found['zscore'])
@@ -0,0 +1,270 @@
+import hashlib
+import logging
+import pathlib
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from classify import Classification, MetricClasses
+from correlation import PairwiseStats
+from expressions import ExpressionError, parse
+from filters import FilterIndex, parse_filter
+from rankings import MetricRanks
+from schema import format_fips, read_table, TABLES
+from search import CountySearch
+from similarity import CountySimilarity
+from validate import Validation
+from vintages import load_vintages
+
+log = logging.getLogger(__name__)
+
+
+class DataSnapshot:
+    """Every table the dashboard reads, built from one version of the data folder
+
+    The tables are validated against each other while the snapshot is built (see
+    validate.py), and the charts read their rows through the joins it keeps.
+    A snapshot is never modified after it is built. Rankings, similarity search,
+    correlations, map classes, county search and any figure parts cached with
+    cached() are built on first use and live with the snapshot, so they go away
+    with it when newer data is swapped in. What is built for derived metrics and
+    filters, which users type in and can be anything, only lives in the
+    derived_max most recently used entries of cached_derived().
+    """
+
+    def __init__(self, data_path, version, base_year, metrics, geo_ids=None, derived_max=256):
+        self.version = version
+        self.base_year = base_year
+        self.metrics = metrics
+
+        for name, filename in TABLES.items():
+            setattr(self, name, read_table(data_path.joinpath(filename)))
+
+        # map locations need the zero padded text of the int FIPS codes
+        self.county_fips = format_fips(self.total_census_grouped['FIPS'])
+
+        self.vintages = load_vintages(
+            self.total_census_grouped, base_year, data_path.joinpath('vintages'))
+
+        # geo_ids are the FIPS codes the map has shapes for
+        self.validation = Validation(self, geo_ids)
+
+        self._lock = threading.Lock()
+        self._built = {}
+        self.derived_max = derived_max
+        self._derived = OrderedDict()
+
+    def cached(self, key, build):
+        """build() the first time key is asked for, the stored result after that"""
+        if key not in self._built:
+            built = build()
+            with self._lock:
+                self._built.setdefault(key, built)
+        return self._built[key]
+
+    def cached_derived(self, key, build):
+        """build() unless key was built lately, the least recently used dropped first"""
+        with self._lock:
+            if key in self._derived:
+                self._derived.move_to_end(key)
+                return self._derived[key]
+        built = build()
+        with self._lock:
+            built = self._derived.setdefault(key, built)
+            self._derived.move_to_end(key)
+            while len(self._derived) > self.derived_max:
+                self._derived.popitem(last=False)
+        return built
+
+    def cached_for(self, metrics, key, build):
+        """cached() when every one of metrics is a census column, cached_derived() otherwise"""
+        if all(metric in self.vintages.column for metric in metrics):
+            return self.cached(key, build)
+        return self.cached_derived(key, build)
+
+    def expression(self, text):
+        """parsed derived metric of text, ExpressionError if it reads a column there isn't"""
+        expression = parse(text)
+        unknown = [column for column in expression.columns if column not in self.vintages.column]
+        if unknown:
+            raise ExpressionError("unknown column {}".format(", ".join(unknown)))
+        return expression
+
+    def values(self, metric, year):
+        """values of a census column, or of a derived metric expression, in a census year
+
+        A derived metric is evaluated once per year and cached by the hash of its
+        normalized text.
+        """
+        if metric in self.vintages.column:
+            return self.vintages.values(metric, year)
+        expression = self.expression(metric)
+        return self.cached_derived(('derived', expression.key, year), lambda: expression.evaluate(
+            lambda column: self.vintages.values(column, year), len(self.county_fips)))
+
+    def frame(self, year, metrics):
+        """DataFrame of census columns or derived metrics in a year"""
+        return pd.DataFrame({metric: self.values(metric, year) for metric in metrics})
+
+    def ranks(self, year):
+        """rank/percentile/z-score lookups for a census year"""
+        return self.cached(('ranks', year), lambda: MetricRanks(
+            self.vintages.frame(year, self.metrics), self.metrics))
+
+    def similarity(self, year):
+        """similar county search for a census year"""
+        def build():
+            frame = self.vintages.frame(year, self.vintages.columns)
+            frame['FIPS'] = self.total_census_grouped['FIPS'].values
+            return CountySimilarity(frame, k=10)
+        return self.cached(('similarity', year), build)
+
+    def stats(self, year):
+        """pairwise correlation and trend lines for a census year"""
+        return self.cached(('stats', year), lambda: PairwiseStats(
+            self.vintages.frame(year, self.metrics), self.metrics))
+
+    def classes(self, year):
+        """map class breaks and county classes of every metric for a census year"""
+        return self.cached(('classes', year), lambda: MetricClasses(
+            self.vintages.frame(year, self.metrics), self.metrics))
+
+    def metric_ranks(self, metric, year):
+        """MetricRanks with metric in it, the shared one unless metric is derived"""
+        if metric in self.metrics:
+            return self.ranks(year)
+        key = self.expression(metric).key
+        return self.cached_derived(('ranks', year, key), lambda: MetricRanks(
+            self.frame(year, [metric]), [metric]))
+
+    def pair_stats(self, x, y, year):
+        """PairwiseStats with the pair x, y in it, the shared one unless one of them is derived"""
+        if x in self.metrics and y in self.metrics:
+            return self.stats(year)
+        keys = tuple(metric if metric in self.metrics else self.expression(metric).key
+                     for metric in (x, y))
+        pair = list(dict.fromkeys([x, y]))
+        return self.cached_derived(('stats', year) + keys, lambda: PairwiseStats(self.frame(year, pair), pair))
+
+    def classification(self, metric, year, method='quantile'):
+        """map classes of a metric, precomputed unless metric is derived"""
+        if metric in self.metrics:
+            return self.classes(year).classes(metric, method)
+        key = self.expression(metric).key
+        return self.cached_derived(('classes', year, key, method), lambda: Classification(
+            self.values(metric, year), method))
+
+    def filter_index(self, metric, year):
+        """FilterIndex with metric in it, the shared one unless metric is derived"""
+        if metric in self.metrics:
+            return self.cached(('filter_index', year), lambda: FilterIndex(
+                self.vintages.frame(year, self.metrics), self.metrics))
+        key = self.expression(metric).key
+        return self.cached_derived(('filter_index', year, key), lambda: FilterIndex(
+            self.frame(year, [metric]), [metric]))
+
+    def matching(self, query, year):
+        """bool per county, True where it matches the filter query in a census year
+
+        Raises ExpressionError when the query isn't a valid filter.
+        """
+        return parse_filter(query).mask(lambda metric: self.filter_index(metric, year))
+
+    def search(self):
+        """county name search index, see search.py"""
+        return self.cached(('search',), lambda: CountySearch(
+            self.total_census_grouped['Geographic Area Name'].to_numpy(),
+            self.total_census_grouped['STATE'].to_numpy(), self.county_fips))
+
+    def warm(self):
+        """build the base year lookups up front so the first request after a swap is fast"""
+        self.ranks(self.base_year)
+        self.similarity(self.base_year)
+        self.stats(self.base_year)
+        self.classes(self.base_year)
+        self.filter_index(self.metrics[0], self.base_year)
+        self.search()
+        return self
+
+
+class DataRegistry:
+    """Holds the current DataSnapshot and swaps in a new one when the data folder changes
+
+    A new snapshot is built completely (off the request path when reloading in the
+    background) before it replaces the old one with a single reference assignment,
+    so requests always see one consistent version. Functions registered with
+    on_swap run after every swap, e.g. to clear figure caches of the old version.
+    """
+
+    def __init__(self, data_path, base_year, metrics, geo_ids=None, report_path=None, derived_max=256):
+        self.data_path = pathlib.Path(data_path)
+        self.derived_max = derived_max
+        self.base_year = base_year
+        self.metrics = list(metrics)
+        self.geo_ids = geo_ids
+        self.report_path = report_path
+        self._listeners = []
+        self._reload_lock = threading.Lock()
+        self.current = self._build(self.fingerprint())
+
+    def fingerprint(self):
+        """version of the data folder, changes whenever a data file is added, removed or edited"""
+        digest = hashlib.sha1()
+        for path in sorted(self.data_path.glob('**/*.csv')):
+            stat = path.stat()
+            digest.update('{}:{}:{};'.format(
+                path.relative_to(self.data_path), stat.st_size, stat.st_mtime_ns).encode())
+        return digest.hexdigest()[:12]
+
+    def _build(self, version):
+        snapshot = DataSnapshot(self.data_path, version, self.base_year, self.metrics, self.geo_ids,
+                                self.derived_max)
+        log.info("data %s: %s", version, snapshot.validation.summary())
+        if self.report_path:
+            snapshot.validation.write(self.report_path, version)
+        return snapshot.warm()
+
+    def on_swap(self, listener):
+        """call listener(new_snapshot) after each swap"""
+        self._listeners.append(listener)
+        return listener
+
+    def reload(self, force=False):
+        """rebuild and swap in the data if it changed, returns the current version"""
+        with self._reload_lock:
+            version = self.fingerprint()
+            if version == self.current.version and not force:
+                return version
+            snapshot = self._build(version)
+            self.current = snapshot
+            for listener in self._listeners:
+                listener(snapshot)
+            return version
+
+    def reload_in_background(self, force=False):
+        """reload on a worker thread, returns the thread"""
+        thread = threading.Thread(target=self.reload, kwargs={'force': force}, daemon=True)
+        thread.start()
+        return thread
+
+    def watch(self, interval=30):
+        """poll the data folder every interval seconds and reload when it changes"""
+        def poll():
+            last = self.current.version
+            while True:
+                time.sleep(interval)
+                try:
+                    version = self.fingerprint()
+                    # only reload once the files stopped changing, not halfway through a copy
+                    if version != self.current.version and version == last:
+                        self.reload()
+                    last = version
+                except Exception:
+                    # keep serving the last good snapshot, try again next time
+                    log.exception("data reload failed")
+
+        thread = threading.Thread(target=poll, daemon=True)
+        thread.start()
+        return thread
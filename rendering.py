@@ -0,0 +1,39 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FigurePool:
+    """Builds independent figures at the same time on a bounded thread pool
+
+    The figures for one clicked county don't depend on each other, so building
+    them side by side makes a click take about as long as its slowest figure. Each
+    worker also turns its figure's plotly objects into the plain dicts Dash sends,
+    leaving only the final encode on the request thread. Threads rather than
+    processes, since the figures read the current data snapshot in place, which a
+    process would have to copy and re-read after every data reload.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix='figures')
+
+    def build(self, jobs):
+        """figure of every (function, *args) job, in the order given"""
+        futures = [self.executor.submit(_build_plain, job[0], *job[1:]) for job in jobs]
+        return [future.result() for future in futures]
+
+
+def _build_plain(function, *args):
+    return plain(function(*args))
+
+
+def plain(figure):
+    """figure with every plotly object (traces, layout) converted to a plain dict"""
+    if hasattr(figure, 'to_plotly_json'):
+        return figure.to_plotly_json()
+    if isinstance(figure, dict):
+        return {key: plain(value) for key, value in figure.items()}
+    if isinstance(figure, (list, tuple)):
+        return [plain(value) for value in figure]
+    return figure
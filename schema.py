@@ -0,0 +1,86 @@
+"""Load the census csvs with compact dtypes
+
+Repeated strings become categoricals, FIPS codes become int32 (format_fips gives
+back the zero padded text), integers are downcast to the smallest type that holds
+them and floats become float32 wherever that keeps every value exactly as written
+in the csv. Run this file to see the memory each table takes before and after:
+
+    python schema.py
+"""
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+# placeholders the census tables use for missing values
+MISSING_VALUES = ['-', 'N']
+
+# strings repeated across many rows
+CATEGORICAL = ['state', 'COUNTYNAME', 'STATE', 'CLASSFP', 'USPS', 'NAME',
+               'EDUCATION_LEVEL', 'OCCUPATION_LEVEL']
+
+# zero padded county codes and their width
+FIPS_COLUMNS = {'FIPS': 5, 'STCOUNTYFP': 5}
+
+TABLES = {
+    'total_census_grouped': 'total_census_county_grouped.csv',
+    'census_education': 'census_county_data_education.csv',
+    'census_occ': 'census_data_occ.csv',
+    'census_nat': 'census_nat.csv',
+}
+
+
+def read_table(path):
+    """read one census csv with compact dtypes"""
+    return compact(pd.read_csv(path, na_values=MISSING_VALUES))
+
+
+def compact(df):
+    """convert a freshly read census table to compact dtypes in place"""
+    for column in df.columns:
+        values = df[column]
+        if column in FIPS_COLUMNS:
+            df[column] = pd.to_numeric(values).astype(np.int32)
+        elif column in CATEGORICAL:
+            df[column] = values.astype('category')
+        elif pd.api.types.is_integer_dtype(values):
+            df[column] = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values) and _float32_lossless(values.values):
+            df[column] = values.astype(np.float32)
+    return df
+
+
+def _float32_lossless(values):
+    """True when every value reads back the same after a trip through float32
+
+    The csvs hold short decimals like 12.3, which float32 can't hold exactly but
+    whose shortest float32 repr is still '12.3', so comparing at text level is the
+    right test of whether anything written in the file would be lost.
+    """
+    back = values.astype(np.float32).astype(str).astype(np.float64)
+    return bool(((back == values) | (np.isnan(back) & np.isnan(values))).all())
+
+
+def format_fips(codes, width=5):
+    """zero padded text of int FIPS codes, e.g. 1001 -> '01001'"""
+    return np.char.zfill(np.asarray(codes).astype(str), width)
+
+
+def memory_report(data_path):
+    """MB used by each table read as plain csv and read with compact dtypes"""
+    report = {}
+    for name, filename in TABLES.items():
+        path = pathlib.Path(data_path).joinpath(filename)
+        before = pd.read_csv(path).memory_usage(deep=True).sum()
+        after = read_table(path).memory_usage(deep=True).sum()
+        report[name] = (before / 1e6, after / 1e6)
+    return report
+
+
+if __name__ == '__main__':
+    report = memory_report(pathlib.Path(__file__).parent.joinpath('data'))
+    print("{:<24}{:>12}{:>12}".format('table', 'before MB', 'after MB'))
+    for name, (before, after) in report.items():
+        print("{:<24}{:>12.2f}{:>12.2f}".format(name, before, after))
+    print("{:<24}{:>12.2f}{:>12.2f}".format(
+        'total', sum(b for b, _ in report.values()), sum(a for _, a in report.values())))
@@ -0,0 +1,154 @@
+"""Free text county search, over indexes built once per data snapshot
+
+Every county is indexed by the words of its name and state (both the name and
+the USPS code) two ways:
+
+    prefix index   every word of every county, sorted, so the counties with a
+                   word starting with what was typed are one binary search away
+    typo index     every word with each of its letters left out in turn, so a
+                   word one typo away (a letter missed, added, changed or two
+                   swapped) shares a key with the right one: 'dnae' and 'dane'
+                   both give 'dae', 'milwaukie' and 'milwaukee' 'milwauke'
+
+A query's words each have to start a word of the county ('dane', 'dan wi',
+'st louis mo') or be one typo from one ('dnae county', 'los angles'). Words like
+County and Parish only order the results, they are not required. Matches with
+fewer typos come first, then those whose name starts with the query, then the
+shorter names. Digits search the FIPS codes.
+"""
+import re
+import unicodedata
+
+import numpy as np
+
+# results of a search
+LIMIT = 8
+
+# shortest word looked up in the typo index, shorter ones have too many neighbors
+MIN_TYPO_LENGTH = 4
+
+# cost of a query word that only starts a word of the county, against 1 for a typo
+PARTIAL = 0.1
+
+# words of county names that tell what kind of county it is, not which
+TYPE_WORDS = {'county', 'parish', 'city', 'borough', 'census', 'area', 'municipality'}
+
+# spellings of the same word, as they are written in the census
+SPELLINGS = {'saint': 'st', 'sainte': 'ste'}
+
+
+def normalize(text):
+    """lower case words without accents or punctuation, 'St. Louis County' -> 'st louis county'"""
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode()
+    return ' '.join(SPELLINGS.get(word, word) for word in re.split(r'[^a-z0-9]+', text.lower()) if word)
+
+
+def deletions(word):
+    """word and every word it gives with one letter left out"""
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def one_typo(word, other):
+    """whether other is word with at most one letter missed, added, changed or two swapped"""
+    if abs(len(word) - len(other)) > 1:
+        return False
+    start = 0
+    while start < min(len(word), len(other)) and word[start] == other[start]:
+        start += 1
+    word, other = word[start:], other[start:]
+    return (word[1:] == other[1:] or word[1:] == other or word == other[1:]
+            or (word[:2] == other[1::-1] and word[2:] == other[2:]))
+
+
+class CountySearch:
+    """Prefix and typo indexes of county names and states
+
+    Counties listed more than once in the table are indexed once, at their first row.
+    """
+
+    def __init__(self, names, states, fips):
+        fips = np.asarray(fips)
+        _, first = np.unique(fips, return_index=True)
+        self.rows = np.sort(first)
+        self.fips = fips[self.rows].astype(str)
+        self.names = np.asarray(names, dtype=object)[self.rows]
+        self.lengths = np.array([len(name) for name in self.names])
+
+        texts = [normalize(name) + ' ' + normalize(state)
+                 for name, state in zip(self.names, np.asarray(states)[self.rows])]
+        self.words, self.owners = self._sorted_words(set(text.split(' ')) for text in texts)
+        self.first_words, self.first_owners = self._sorted_words([text.split(' ')[0]] for text in texts)
+        self.codes, self.code_owners = self._sorted_words([code] for code in self.fips)
+
+        # the words (not counties) under each key, checked against the query word,
+        # the same key is shared by some words two typos apart
+        typos = {}
+        for word in set(self.words.tolist()):
+            if len(word) >= MIN_TYPO_LENGTH:
+                for key in deletions(word):
+                    typos.setdefault(key, []).append(word)
+        self.typos = typos
+
+    @staticmethod
+    def _sorted_words(word_sets):
+        """sorted array of the words of every entry, and the entry of each"""
+        words = sorted((word, entry) for entry, words in enumerate(word_sets) for word in words)
+        return np.array([word for word, _ in words]), np.array([entry for _, entry in words], dtype=np.int32)
+
+    @staticmethod
+    def _range(words, word):
+        """positions in sorted words of word itself, and of the words starting with it"""
+        low, exact, high = np.searchsorted(words, [word, word + ' ', word + '\x7f'])
+        return slice(low, exact), slice(low, high)
+
+    def prefixed(self, word):
+        """entries with word, and entries with a word starting with word"""
+        exact, prefix = self._range(self.words, word)
+        return self.owners[exact], self.owners[prefix]
+
+    def misspelled(self, word):
+        """entries with a word one typo from word"""
+        if len(word) < MIN_TYPO_LENGTH:
+            return np.zeros(0, dtype=np.int32)
+        near = {other for key in deletions(word) for other in self.typos.get(key, ()) if one_typo(word, other)}
+        found = [self.owners[self._range(self.words, other)[0]] for other in near]
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int32)
+
+    def search(self, query, limit=LIMIT):
+        """best matches of query as (row, FIPS, name) of the county table, best first"""
+        text = normalize(query)
+        if not text:
+            return []
+        if text.isdigit():
+            return self.results(self.code_owners[self._range(self.codes, text)[1]][:limit])
+
+        words = text.split(' ')
+        required = [word for word in words if word not in TYPE_WORDS] or words
+
+        # typos of each entry, infinite where a required word matches nothing, and
+        # a fraction of one per word only started, so whole words rank first
+        typos = np.zeros(len(self.rows))
+        for word in words:
+            missing = np.inf if word in required else 1
+            cost = np.full(len(self.rows), missing)
+            cost[self.misspelled(word)] = min(1, missing)
+            exact, prefix = self.prefixed(word)
+            cost[prefix] = PARTIAL
+            cost[exact] = 0
+            typos += cost
+
+        candidates = np.flatnonzero(np.isfinite(typos))
+        starts = np.zeros(len(self.rows), dtype=bool)
+        starts[self.first_owners[self._range(self.first_words, required[0])[1]]] = True
+        starts = starts[candidates]
+        best = candidates[np.lexsort((self.fips[candidates], self.lengths[candidates],
+                                      ~starts, typos[candidates]))][:limit]
+        return self.results(best)
+
+    def county(self, fips):
+        """(row, FIPS, name) of the county with a FIPS code, None when there is none"""
+        entries = self.code_owners[self._range(self.codes, str(fips))[0]]
+        return self.results(entries[:1])[0] if len(entries) else None
+
+    def results(self, entries):
+        return [(int(self.rows[entry]), str(self.fips[entry]), str(self.names[entry])) for entry in entries]
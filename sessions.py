@@ -0,0 +1,183 @@
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import dash
+from dash.exceptions import PreventUpdate
+
+import serialize
+
+
+class MemoryStore:
+    """Per session state in this process, the least recently used sessions dropped first"""
+
+    def __init__(self, max_sessions=10000):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def get(self, session, name):
+        with self._lock:
+            state = self._sessions.get(session)
+            if state is None:
+                return None
+            self._sessions.move_to_end(session)
+            return state.get(name)
+
+    def set(self, session, name, value):
+        with self._lock:
+            self._sessions.setdefault(session, {})[name] = value
+            self._sessions.move_to_end(session)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def replace(self, session, name, expected, value):
+        """set value only if the current one is expected"""
+        with self._lock:
+            state = self._sessions.get(session)
+            if state is not None and state.get(name) == expected:
+                state[name] = value
+
+
+class SQLiteStore:
+    """Per session state in a local SQLite file, shared by every process on the machine
+
+    Each thread of each process opens its own connection. Sessions not touched for
+    max_age seconds are deleted every few hundred writes.
+    """
+
+    def __init__(self, path, max_age=24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS session_state ('
+                               'session TEXT, name TEXT, value TEXT, touched REAL, '
+                               'PRIMARY KEY (session, name))')
+            connection.execute('CREATE INDEX IF NOT EXISTS session_touched ON session_state (touched)')
+
+    def _connection(self):
+        # connections don't survive a fork, open another in the child
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def get(self, session, name):
+        row = self._connection().execute(
+            'SELECT value FROM session_state WHERE session = ? AND name = ?', (session, name)).fetchone()
+        return row[0] if row else None
+
+    def set(self, session, name, value):
+        connection = self._connection()
+        now = time.time()
+        connection.execute('INSERT OR REPLACE INTO session_state VALUES (?, ?, ?, ?)',
+                           (session, name, value, now))
+        self._writes += 1
+        if self._writes % 500 == 0:
+            connection.execute('DELETE FROM session_state WHERE touched < ?', (now - self.max_age,))
+
+    def replace(self, session, name, expected, value):
+        """set value only if the current one is expected"""
+        self._connection().execute(
+            'UPDATE session_state SET value = ?, touched = ? WHERE session = ? AND name = ? AND value = ?',
+            (value, time.time(), session, name, expected))
+
+
+def open_store(url, max_sessions=10000):
+    """'memory' for a MemoryStore, 'sqlite:<path>' for a SQLiteStore"""
+    if url.startswith('sqlite:'):
+        return SQLiteStore(url[len('sqlite:'):])
+    if url == 'memory':
+        return MemoryStore(max_sessions)
+    raise ValueError("session store must be 'memory' or 'sqlite:<path>', got {!r}".format(url))
+
+
+class SessionState:
+    """Remembers what each browser session was last sent, to skip renders that would repeat it
+
+    For every output a callback renders, the store keeps the data version, the
+    inputs it was rendered from and which of them triggered it (callbacks like the
+    map's follow whichever graph was clicked last). Inputs go through normalize
+    first, so that e.g. two clicks on the same county compare equal however the
+    click was reported. A request with the same would rebuild what the page
+    already shows, so it is answered with PreventUpdate instead.
+
+    A render marks its output pending when it starts and records its inputs when it
+    returns, but only if no newer render of the output started meanwhile: of two
+    overlapping renders the browser keeps the newer one, and that is the one to
+    remember. A render that fails or is dropped (e.g. by the Coalescer) leaves the
+    output pending, and the next request renders it again.
+
+    With several gunicorn workers use the SQLite store: an in-process store only
+    knows what its own worker sent, and could skip a render the page needs after
+    another worker changed it.
+
+    A callback that can leave some of its outputs as they are reads previous()
+    while it renders, to know what the page is known to show.
+    """
+
+    def __init__(self, store, version, normalize=None):
+        self.store = store
+        self.version = version
+        self.normalize = normalize or (lambda value: value)
+        self._local = threading.local()
+
+    def state(self, session, name):
+        """inputs the output name was last rendered from for session, as json text"""
+        return self.store.get(session, name)
+
+    def previous(self, name):
+        """normalized inputs the output name was last sent to this request's session from
+
+        None when there is no session, the data changed since, or the last render
+        started is still pending (in flight, failed or dropped): then the page may
+        show anything and every output should be rendered.
+        """
+        state = getattr(self._local, 'previous', {}).get(name)
+        if state is None or state.startswith('pending '):
+            return None
+        version, _, inputs = json.loads(state)
+        return inputs if version == self.version() else None
+
+    def skip_unchanged(self, name, pass_session=False):
+        """decorator for a callback whose last argument is the session id
+
+        The session id is dropped before the callback is called, unless
+        pass_session is set for a callback that needs it too (e.g. a coalesced one).
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args):
+                session = args[-1]
+                call = args if pass_session else args[:-1]
+                if not hasattr(self._local, 'previous'):
+                    self._local.previous = {}
+                if session is None:
+                    self._local.previous[name] = None
+                    return function(*call)
+
+                triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+                state = serialize.dumps([self.version(), triggered,
+                                         [self.normalize(value) for value in args[:-1]]])
+                previous = self.store.get(session, name)
+                if previous == state:
+                    raise PreventUpdate
+                self._local.previous[name] = previous
+
+                pending = 'pending ' + uuid.uuid4().hex
+                self.store.set(session, name, pending)
+                result = function(*call)
+                self.store.replace(session, name, pending, state)
+                return result
+            return wrapper
+        return decorator
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+# numeric columns that identify or locate a county rather than describe it
+ID_COLUMNS = ['Unnamed: 0', 'STCOUNTYFP', 'FIPS', 'LAT', 'LONG']
+
+
+class CountySimilarity:
+    """Nearest counties in a standardized census feature space
+
+    The feature matrix is standardized and stored as float32 once. The k nearest
+    neighbors over all features are precomputed for every county with batched
+    matrix products, so the default lookup is a single row read. Searches over a
+    chosen subset of features are an exact O(counties x features) scan.
+    """
+
+    def __init__(self, df, k=10, batch_size=512, key='FIPS'):
+        # duplicated rows of the same county are never reported as its neighbors
+        self.codes = pd.factorize(df[key])[0]
+
+        numeric = df.drop(columns=[c for c in ID_COLUMNS if c in df.columns])
+        numeric = numeric.apply(pd.to_numeric, errors='coerce')
+        numeric = numeric.loc[:, numeric.notna().any()]
+
+        self.features = list(numeric.columns)
+        self.column = {feature: j for j, feature in enumerate(self.features)}
+
+        values = numeric.to_numpy(dtype=np.float64)
+        mean = np.nanmean(values, axis=0)
+        std = np.nanstd(values, axis=0)
+        std[std == 0] = 1.0
+
+        # missing values sit at the mean, i.e. contribute nothing to distances
+        standardized = np.nan_to_num((values - mean) / std)
+        self.matrix = np.ascontiguousarray(standardized, dtype=np.float32)
+
+        self.k = k
+        self.neighbors, self.distances = self._all_neighbors(k, batch_size)
+
+    def _all_neighbors(self, k, batch_size):
+        """k nearest neighbors of every county, excluding the county itself"""
+        matrix = self.matrix
+        n = matrix.shape[0]
+        k = min(k, n - 1)
+        norms = np.einsum('ij,ij->i', matrix, matrix)
+
+        neighbors = np.empty((n, k), dtype=np.int32)
+        distances = np.empty((n, k), dtype=np.float32)
+        for start in range(0, n, batch_size):
+            stop = min(start + batch_size, n)
+            block = norms[start:stop, None] + norms[None, :] - \
+                2 * matrix[start:stop] @ matrix.T
+            block[self.codes[start:stop, None] == self.codes[None, :]] = np.inf
+
+            nearest = np.argpartition(block, k, axis=1)[:, :k]
+            nearest_dist = np.take_along_axis(block, nearest, axis=1)
+            order = np.argsort(nearest_dist, axis=1)
+
+            neighbors[start:stop] = np.take_along_axis(nearest, order, axis=1)
+            distances[start:stop] = np.sqrt(np.maximum(
+                np.take_along_axis(nearest_dist, order, axis=1), 0))
+        return neighbors, distances
+
+    def similar(self, row, features=None, k=None):
+        """row indices and distances of the k counties most like `row`
+
+        With no features the precomputed all-feature neighbors are returned,
+        otherwise distances are computed over just those features.
+        """
+        k = self.k if k is None else k
+        if not features:
+            if k <= self.k:
+                return self.neighbors[row, :k], self.distances[row, :k]
+            columns = slice(None)
+        else:
+            columns = [self.column[feature] for feature in features]
+
+        subset = self.matrix[:, columns]
+        diff = subset - subset[row]
+        dist = np.einsum('ij,ij->i', diff, diff)
+        dist[self.codes == self.codes[row]] = np.inf
+
+        k = min(k, len(dist) - 1)
+        nearest = np.argpartition(dist, k)[:k]
+        nearest = nearest[np.argsort(dist[nearest])]
+        return nearest, np.sqrt(dist[nearest])
@@ -0,0 +1,265 @@
+// The dashboard without a server: every interaction is a lookup into the JSON
+// files written by bake.py, filled into the same figure templates the server uses.
+(function () {
+    'use strict';
+
+    var meta = null;
+    var geojson = null;
+    var files = {};
+    var state = {metric: 'UNEMPL_RATE', x: 'POVERTY_RATE', method: 'quantile', year: null, since: null,
+                 row: null, similar: []};
+
+    // each file is fetched once, later lookups share the same promise
+    function load(path) {
+        if (!(path in files)) {
+            files[path] = fetch('data/' + path).then(function (response) {
+                if (!response.ok) {
+                    throw new Error(path + ': ' + response.status);
+                }
+                return response.json();
+            });
+        }
+        return files[path];
+    }
+
+    function metric(name, year) {
+        return load(year + '/metrics/' + name + '.json');
+    }
+
+    function details(row, year) {
+        var state_fips = meta.counties.fips[row].slice(0, 2);
+        return load(year + '/counties/' + state_fips + '.json').then(function (shard) {
+            return shard[row];
+        });
+    }
+
+    // copy of base with update merged in, nested objects key by key (templates.merge)
+    function merge(base, update) {
+        var merged = Object.assign({}, base);
+        Object.keys(update || {}).forEach(function (key) {
+            var value = update[key];
+            if (isObject(value) && isObject(merged[key])) {
+                merged[key] = merge(merged[key], value);
+            } else {
+                merged[key] = value;
+            }
+        });
+        return merged;
+    }
+
+    function isObject(value) {
+        return value !== null && typeof value === 'object' && !Array.isArray(value);
+    }
+
+    // figure of a template with data[i] merged into the i-th trace (FigureTemplate.fill)
+    function fill(template, data, layout) {
+        var traces = template.data.map(function (trace, i) {
+            return data && data[i] ? merge(trace, data[i]) : trace;
+        });
+        return {data: traces, layout: merge(template.layout, layout)};
+    }
+
+    function draw(id, figure) {
+        return Plotly.react(id, figure.data, figure.layout);
+    }
+
+    // class of every value: the first break it doesn't exceed, one past the last class when missing
+    // (classify.class_codes)
+    function classCodes(values, breaks) {
+        return values.map(function (value) {
+            if (value === null) {
+                return breaks.length + 1;
+            }
+            var low = 0;
+            var high = breaks.length;
+            while (low < high) {
+                var middle = (low + high) >> 1;
+                if (breaks[middle] < value) {
+                    low = middle + 1;
+                } else {
+                    high = middle;
+                }
+            }
+            return low;
+        });
+    }
+
+    function metricInfo(name) {
+        return meta.metrics.filter(function (m) { return m.value === name; })[0];
+    }
+
+    function renderMap() {
+        var year = state.year;
+        var changed = state.since !== null && state.since !== year;
+        var loads = [metric(state.metric, year),
+                     load(year + (changed ? '/change/' + state.since : '/classes') + '.json')];
+        if (changed) {
+            loads.push(metric(state.metric, state.since));
+        }
+        return Promise.all(loads).then(function (values) {
+            var z = values[0];
+            var classes = values[1][state.metric][state.method];
+            var hover = metricInfo(state.metric).hover.split('AXIS').join('customdata');
+            if (changed) {
+                z = z.map(function (value, i) {
+                    return value === null || values[2][i] === null ? null : value - values[2][i];
+                });
+                hover = '<b>%{text}</b><br>' + metricInfo(state.metric).label + ' change ' +
+                    state.since + '-' + year + ': %{customdata:+.1f}';
+            }
+            var count = classes.breaks.length + 1;
+            var trace = {geojson: geojson, locations: meta.counties.fips, z: classCodes(z, classes.breaks),
+                         zmin: -0.5, zmax: count + 0.5, colorscale: classes.colorscale,
+                         colorbar: {tickvals: classes.labels.map(function (_, i) { return i; }),
+                                    ticktext: classes.labels},
+                         text: meta.counties.name, hovertemplate: hover, customdata: z};
+            var center = meta.default_row;
+            var zoom = 3;
+            if (state.row !== null) {
+                trace.selectedpoints = [state.row].concat(state.similar);
+                trace.selected = {marker: {opacity: 1}};
+                trace.unselected = {marker: {opacity: 0.3}};
+                center = state.row;
+                zoom = 5;
+            }
+            return draw('main-map', fill(meta.templates.choro, [trace], {mapbox: {
+                center: {lon: meta.counties.lon[center], lat: meta.counties.lat[center]}, zoom: zoom}}));
+        });
+    }
+
+    function renderScatter() {
+        var year = state.year;
+        var row = state.row === null ? meta.default_row : state.row;
+        return Promise.all([metric(state.x, year), metric(state.metric, year), load(year + '/pairs.json')])
+            .then(function (loaded) {
+                var rows = loaded[0].map(function (_, i) { return i; });
+                var pair = loaded[2][state.x][state.metric];
+                var hoverX = metricInfo(state.x).hover.split('AXIS').join('x');
+                var hoverY = metricInfo(state.metric).hover.split('AXIS').join('y').replace('<b>%{text}</b><br>', '');
+                // the first trace holds the counties a filter leaves out, the static page has no filter
+                var data = [
+                    null,
+                    {x: loaded[0], y: loaded[1], text: meta.counties.name, customdata: rows,
+                     selectedpoints: [row], hovertemplate: hoverX + '<br>' + hoverY},
+                    {x: pair.trend_x, y: pair.trend_y}
+                ];
+                var layout = {
+                    xaxis: {title: {text: metricInfo(state.x).axis}},
+                    yaxis: {title: {text: metricInfo(state.metric).axis}},
+                    annotations: [{
+                        text: 'Pearson r = ' + pair.pearson.toFixed(2) + ' | Spearman ρ = ' +
+                            pair.spearman.toFixed(2) + ' | R² = ' + pair.r2.toFixed(2),
+                        xref: 'paper', yref: 'paper', x: 0, y: 1.06, xanchor: 'left', showarrow: false
+                    }]
+                };
+                return draw('scatter', fill(meta.templates.scatter, data, layout));
+            });
+    }
+
+    function renderDetails() {
+        var year = state.year;
+        var row = state.row === null ? meta.default_row : state.row;
+        return details(row, year).then(function (county) {
+            document.querySelectorAll('.county-name').forEach(function (element) {
+                element.textContent = meta.counties.county[row];
+            });
+            ['rent', 'house', 'commute', 'income'].forEach(function (name) {
+                document.getElementById(name + '_text').textContent = county.text[name];
+                document.getElementById(name + '_rank').textContent = county.rank[name];
+            });
+
+            var boxes = [['box1', 'rent'], ['box2', 'house'], ['box3', 'commute']];
+            boxes.forEach(function (box) {
+                metric(meta.detail_metrics[box[1]], year).then(function (values) {
+                    draw(box[0], fill(meta.templates.box[box[1]],
+                                      [{y: values, text: meta.counties.county, selectedpoints: [row]}]));
+                });
+            });
+            draw('distribution', fill(meta.templates.dist, county.dist));
+            draw('treemap', fill(meta.templates.treemap, county.treemap));
+            draw('bar', fill(meta.templates.bar, county.bar));
+            draw('pie', fill(meta.templates.pie, county.pie));
+
+            var list = document.getElementById('similar-list');
+            list.innerHTML = '';
+            county.similar.forEach(function (similar, i) {
+                var item = document.createElement('li');
+                var name = document.createElement('b');
+                name.textContent = meta.counties.name[similar];
+                item.appendChild(name);
+                item.appendChild(document.createTextNode(' (distance ' + county.distances[i].toFixed(2) + ')'));
+                list.appendChild(item);
+            });
+            return county;
+        });
+    }
+
+    function render() {
+        var row = state.row === null ? meta.default_row : state.row;
+        return Promise.all([
+            details(row, state.year).then(function (county) {
+                state.similar = county.similar;
+                return renderMap();
+            }),
+            renderScatter(),
+            renderDetails()
+        ]);
+    }
+
+    function options(id, items, selected) {
+        var select = document.getElementById(id);
+        items.forEach(function (item) {
+            var option = document.createElement('option');
+            option.value = item.value;
+            option.textContent = item.label;
+            option.selected = String(item.value) === String(selected);
+            select.appendChild(option);
+        });
+        return select;
+    }
+
+    function select(row) {
+        state.row = row;
+        render();
+    }
+
+    Promise.all([load('meta.json'), load('counties.geojson')]).then(function (loaded) {
+        meta = loaded[0];
+        geojson = loaded[1];
+        state.year = meta.base_year;
+
+        var years = meta.years.map(function (year) { return {value: year, label: String(year)}; });
+        options('dropdown_map', meta.metrics, state.metric).addEventListener('change', function (event) {
+            state.metric = event.target.value;
+            render();
+        });
+        options('dropdown_scatterx', meta.metrics, state.x).addEventListener('change', function (event) {
+            state.x = event.target.value;
+            renderScatter();
+        });
+        options('year', years, state.year).addEventListener('change', function (event) {
+            state.year = Number(event.target.value);
+            render();
+        });
+        options('classes', [
+            {value: 'quantile', label: 'Quantiles'}, {value: 'equal_interval', label: 'Equal intervals'},
+            {value: 'jenks', label: 'Natural breaks'}
+        ], state.method).addEventListener('change', function (event) {
+            state.method = event.target.value;
+            renderMap();
+        });
+        options('since', [{value: '', label: 'No comparison'}].concat(years), '').addEventListener('change', function (event) {
+            state.since = event.target.value ? Number(event.target.value) : null;
+            renderMap();
+        });
+
+        return render().then(function () {
+            document.getElementById('main-map').on('plotly_click', function (event) {
+                select(event.points[0].pointNumber);
+            });
+            document.getElementById('scatter').on('plotly_click', function (event) {
+                select(event.points[0].customdata);
+            });
+        });
+    });
+}());
@@ -0,0 +1,34 @@
+from rendering import plain
+
+
+class FigureTemplate:
+    """The static skeleton of a chart, validated once and filled per request with plain dicts
+
+    Traces and layouts built as go.* objects are validated by plotly when they are
+    constructed, property by property. A template is built from those objects once,
+    at startup, and keeps only the resulting plain dicts. fill() then merges in the
+    per request values (arrays, hovertemplates, selections) without going through
+    plotly's validators again, copying only the parts it changes.
+    """
+
+    def __init__(self, data, layout):
+        self.data = plain(list(data))
+        self.layout = plain(layout)
+
+    def fill(self, data=(), layout=None):
+        """figure dict with data[i] merged into the i-th trace and layout into the layout"""
+        traces = list(self.data)
+        for i, update in enumerate(data):
+            traces[i] = merge(traces[i], update)
+        return {"data": traces, "layout": merge(self.layout, layout or {})}
+
+
+def merge(base, update):
+    """copy of base with update merged in, nested dicts key by key, base left untouched"""
+    merged = dict(base)
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
@@ -0,0 +1,47 @@
+import threading
+import time
+
+from dash.exceptions import PreventUpdate
+
+from coalesce import Coalescer
+
+
+def run_together(render, calls):
+    """results of render(*call) for every call, all started at once, PreventUpdate as None"""
+    results = [None] * len(calls)
+
+    def run(i):
+        try:
+            results[i] = render(*calls[i])
+        except PreventUpdate:
+            pass
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(calls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def slow_render(county):
+    time.sleep(0.1)
+    return county
+
+
+def test_requests_without_session_all_render():
+    render = Coalescer(wait=0.05)('map')(slow_render)
+
+    assert run_together(render, [(1, None), (2, None)]) == [1, 2]
+
+
+def test_stale_request_of_a_session_is_dropped():
+    coalescer = Coalescer(wait=0.05)
+    render = coalescer('map')(slow_render)
+
+    first = threading.Thread(target=run_together, args=(render, [(1, 's1')]))
+    first.start()
+    time.sleep(0.02)
+    assert render(2, 's1') == 2
+    first.join()
+    assert coalescer.dropped == 1
@@ -0,0 +1,19 @@
+import numpy as np
+import pandas as pd
+
+from correlation import PairwiseStats
+
+
+def test_spearman_matches_pandas_with_missing_values():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(400, 5)), columns=list('abcde'))
+    df['b'] = df['a'] * 2 + rng.normal(size=400)
+    df['e'] = df['e'].round()
+    df.loc[::7, 'a'] = np.nan
+    df.loc[::5, 'b'] = np.nan
+    df.loc[::3, 'c'] = np.nan
+
+    stats = PairwiseStats(df, list(df))
+
+    np.testing.assert_allclose(stats.spearman, df.corr(method='spearman').to_numpy(), atol=1e-12)
+    np.testing.assert_allclose(stats.pearson, df.corr(method='pearson').to_numpy(), atol=1e-12)
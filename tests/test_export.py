@@ -0,0 +1,20 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+from export import csv_stream, ndjson_stream
+
+
+def test_ndjson_values_match_csv():
+    frame = pd.DataFrame({'FIPS': ['01001', '01003', '01005', '01007'],
+                          'VALUE': np.array([5.2, 55.1, np.nan, 123456.79], dtype=np.float32)})
+
+    text = ''.join(csv_stream([frame]))
+    rows = [json.loads(line) for line in ''.join(ndjson_stream([frame])).splitlines()]
+
+    csv = pd.read_csv(io.StringIO(text), dtype={'FIPS': str})
+    assert [row['FIPS'] for row in rows] == list(csv['FIPS'])
+    assert [row['VALUE'] for row in rows] == [5.2, 55.1, None, 123456.79]
+    assert [None if np.isnan(value) else value for value in csv['VALUE']] == [5.2, 55.1, None, 123456.79]
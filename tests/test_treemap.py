@@ -0,0 +1,35 @@
+import pandas as pd
+
+from app import EDUCATION_LABELS, registry, treemap_data
+from validate import EDUCATION_LEVELS
+
+# colors of the education treemap as the app first drew them
+COLORS = {
+    'Finished less than 9th': "#f5874c",
+    'Highschool No Diploma': "#407D72",
+    'Highschool Diploma': "#B1836A",
+    'Some College': "#6AB187",
+    'Associates': "#B16A7F",
+    'Bachelors': "#CED2CC",
+    'Graduate': '#1F3F49'}
+
+
+def test_levels_in_csv_order():
+    education = registry.current.census_education
+    assert list(pd.unique(education['EDUCATION_LEVEL'])) == EDUCATION_LEVELS
+
+
+def test_label_colors():
+    trace, = treemap_data(713)
+    assert dict(zip(trace['labels'], trace['marker']['colors'])) == COLORS
+
+
+def test_label_values():
+    data = registry.current
+    education = data.census_education
+    county = data.total_census_grouped.iloc[713]
+    rows = education[(education['COUNTYNAME'] == county['COUNTYNAME']) & (education['STATE'] == county['STATE'])]
+    expected = dict(zip(rows['EDUCATION_LEVEL'].map(EDUCATION_LABELS), rows['PERCENT TOTAL']))
+
+    trace, = treemap_data(713)
+    assert dict(zip(trace['labels'], trace['values'])) == expected
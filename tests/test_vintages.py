@@ -0,0 +1,18 @@
+import numpy as np
+import pandas as pd
+
+from vintages import VintageTable
+
+
+def test_changed_values_read_back_exactly():
+    base = pd.DataFrame({'FIPS': [1, 2, 3], 'VALUE': [89000.0, 5.2, np.nan]})
+    later = pd.DataFrame({'FIPS': [1, 2, 3], 'VALUE': [0.3, np.nan, 7.1]})
+
+    table = VintageTable(base, 2018)
+    table.add_year(2019, later)
+
+    np.testing.assert_array_equal(table.values('VALUE', 2019),
+                                  np.array([0.3, np.nan, 7.1], dtype=np.float32))
+    np.testing.assert_array_equal(table.values('VALUE', 2018),
+                                  np.array([89000.0, 5.2, np.nan], dtype=np.float32))
+    assert table.stored_cells() == {2019: 3}
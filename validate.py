@@ -0,0 +1,183 @@
+"""Check the census tables against each other once, when a data snapshot is built
+
+The charts of a clicked county read its rows in three per county tables, joined
+on county name and state: one per education level, one per occupation level and
+one nativity row. Validation does every join up front with whole column
+operations and keeps the result as arrays (county row -> row in each table, -1
+where there is none), so the charts look their rows up by position and a county
+with a missing row draws an empty chart instead of raising.
+
+It also checks the county table's FIPS codes (valid, unique, on the map),
+duplicate rows, missing values and values out of range in every table, and sums
+it all up in a report:
+
+    python validate.py            # print the report of the csvs in data/
+"""
+import json
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from ingest import is_percent
+
+# levels each county has a row for in the per county tables, in the order of the csv files
+EDUCATION_LEVELS = ['EDUCATION_LESS_9TH', 'EDUCATION_NO_DIPLOMA', 'EDUCATION_HIGHSCHOOL',
+                    'EDUCATION_SOME_COLLEGE', 'EDUCATION_ASSOCIATES', 'EDUCATION_BACHELORS',
+                    'EDUCATION_GRADUATE']
+OCCUPATION_LEVELS = ['MANAGEMENT_BUSINESS_SCIENCE_ARTS', 'SERVICE', 'SALES_OFFICE',
+                     'CONSTRUCTION_NATURAL_RESOURCES', 'PRODUCTION_TRANSPORTATION_MATERIAL']
+
+# allowed range of columns that may be negative, other numbers that aren't percentages must be >= 0
+RANGES = {'LAT': (-90, 90), 'LONG': (-180, 180)}
+
+# numeric columns that are row numbers, not data
+IGNORE_COLUMNS = ['Unnamed: 0']
+
+# FIPS codes of the counties listed in the report for each problem
+SAMPLE = 20
+
+
+def county_keys(table):
+    """county name and state of every row, as one string to join on"""
+    return table['COUNTYNAME'].astype(str).values.astype(object) + '|' + \
+        table['STATE'].astype(str).values.astype(object)
+
+
+def join_levels(counties, table, level_column, levels):
+    """row of table holding each level of each county, and the number of rows there are of each
+
+    counties is the factorized county key of every county row and its uniques. Both
+    results are (counties x levels), rows are -1 where there is none.
+    """
+    codes, uniques = counties
+    county = uniques.get_indexer(county_keys(table))
+    if levels is None:
+        level = np.zeros(len(table), dtype=np.int64)
+        width = 1
+    else:
+        level = pd.Categorical(table[level_column].astype(str), categories=levels).codes.astype(np.int64)
+        width = len(levels)
+
+    known = (county >= 0) & (level >= 0)
+    counts = np.zeros((len(uniques), width), dtype=np.int64)
+    np.add.at(counts, (county[known], level[known]), 1)
+    rows = np.full((len(uniques), width), -1, dtype=np.int64)
+    # the first row wins when there are several, like .values[0] did
+    found = np.flatnonzero(known)[::-1]
+    rows[county[found], level[found]] = found
+    return rows[codes], counts[codes], int((county < 0).sum()), int((level < 0).sum())
+
+
+class Validation:
+    """What was checked about one snapshot's tables and the joins the charts use
+
+    education_rows (counties x 7) and occupation_rows (counties x 5) hold the row of
+    each level in census_education and census_occ, nativity_rows the census_nat row
+    of each county, -1 where there is none. complete marks the counties with every
+    one of those rows. skipped_vintages lists the folders under data/vintages that
+    were not read because their name is no year.
+    """
+
+    def __init__(self, data, geo_ids=None):
+        table = data.total_census_grouped
+        fips = table['FIPS'].values.astype(np.int64)
+        counties = pd.factorize(county_keys(table))
+        counties = (counties[0], pd.Index(counties[1]))
+
+        self.problems = {}
+        self.missing_values = {}
+        self.out_of_range = {}
+        self.unmatched_rows = {}
+        self.unknown_levels = {}
+
+        self.problem('invalid_fips', fips, (fips < 1000) | (fips > 99999))
+        self.problem('duplicate_fips', fips, pd.Series(fips).duplicated(keep=False).values)
+        self.problem('duplicate_county_name', fips, pd.Series(counties[0]).duplicated(keep=False).values)
+        if geo_ids is not None:
+            on_map = np.isin(data.county_fips, np.array(sorted(geo_ids), dtype=data.county_fips.dtype))
+            self.problem('fips_not_on_map', fips, ~on_map)
+
+        self.education_rows, counts, self.unmatched_rows['census_education'], \
+            self.unknown_levels['census_education'] = join_levels(
+                counties, data.census_education, 'EDUCATION_LEVEL', EDUCATION_LEVELS)
+        self.problem('missing_education_levels', fips, (counts == 0).any(axis=1))
+        self.problem('duplicate_education_levels', fips, (counts > 1).any(axis=1))
+
+        self.occupation_rows, counts, self.unmatched_rows['census_occ'], \
+            self.unknown_levels['census_occ'] = join_levels(
+                counties, data.census_occ, 'OCCUPATION_LEVEL', OCCUPATION_LEVELS)
+        self.problem('missing_occupation_levels', fips, (counts == 0).any(axis=1))
+        self.problem('duplicate_occupation_levels', fips, (counts > 1).any(axis=1))
+
+        rows, counts, self.unmatched_rows['census_nat'], _ = join_levels(
+            counties, data.census_nat, None, None)
+        self.nativity_rows = rows[:, 0]
+        self.problem('missing_nativity', fips, counts[:, 0] == 0)
+        self.problem('duplicate_nativity', fips, counts[:, 0] > 1)
+
+        self.complete = (self.education_rows >= 0).all(axis=1) & \
+            (self.occupation_rows >= 0).all(axis=1) & (self.nativity_rows >= 0)
+
+        for name in ('total_census_grouped', 'census_education', 'census_occ', 'census_nat'):
+            self.check_values(name, getattr(data, name))
+
+        self.skipped_vintages = list(data.vintages.skipped)
+
+    def problem(self, name, fips, bad):
+        """record the counties where bad is True"""
+        if bad.any():
+            codes = np.unique(fips[bad])
+            self.problems[name] = {'count': int(bad.sum()), 'fips': codes[:SAMPLE].tolist()}
+
+    def check_values(self, name, table):
+        """count missing and out of range values of every numeric column"""
+        missing = {}
+        out_of_range = {}
+        for column in table.select_dtypes('number').columns:
+            if column in IGNORE_COLUMNS:
+                continue
+            values = table[column].values.astype(np.float64)
+            nan = np.isnan(values)
+            if column in RANGES:
+                low, high = RANGES[column]
+            elif is_percent(column):
+                low, high = 0, 100
+            else:
+                low, high = 0, np.inf
+            bad = ~nan & ((values < low) | (values > high))
+            if nan.any():
+                missing[column] = int(nan.sum())
+            if bad.any():
+                out_of_range[column] = int(bad.sum())
+        self.missing_values[name] = missing
+        self.out_of_range[name] = out_of_range
+
+    def summary(self):
+        """one line for the log"""
+        problems = ", ".join("{} {}".format(problem['count'], name.replace('_', ' '))
+                             for name, problem in self.problems.items())
+        if self.skipped_vintages:
+            problems += (", " if problems else "") + "vintages folders skipped (not a year): " + \
+                ", ".join(self.skipped_vintages)
+        return "{} of {} counties complete{}".format(
+            int(self.complete.sum()), len(self.complete), "; " + problems if problems else "")
+
+    def to_dict(self):
+        return {'counties': len(self.complete), 'complete_counties': int(self.complete.sum()),
+                'problems': self.problems, 'missing_values': self.missing_values,
+                'out_of_range': self.out_of_range, 'unmatched_rows': self.unmatched_rows,
+                'unknown_levels': self.unknown_levels, 'skipped_vintages': self.skipped_vintages}
+
+    def write(self, path, version):
+        """write the report as json"""
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(dict(self.to_dict(), version=version), indent=2))
+
+
+if __name__ == '__main__':
+    from registry import DataSnapshot
+    data_path = pathlib.Path(__file__).parent.joinpath('data')
+    snapshot = DataSnapshot(data_path, 'local', 2018, [])
+    print(json.dumps(snapshot.validation.to_dict(), indent=2))
@@ -0,0 +1,126 @@
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from schema import read_table
+
+
+class UnknownYear(KeyError):
+    """a census year that isn't loaded"""
+
+    def __str__(self):
+        return self.args[0]
+
+
+class VintageTable:
+    """Census values keyed by (county, year), stored as one base year plus per-year changes
+
+    Rows always line up with the base table, so a county keeps the same row (and the
+    same map geometry) in every year. Each later or earlier vintage only stores the
+    cells that differ from the base year, as (row, value) pairs per column: the
+    values themselves rather than differences, which float32 could not add back
+    exactly. Reading a column for a year rebuilds it with one vectorized scatter and
+    is cached.
+    """
+
+    def __init__(self, base, base_year, key='FIPS'):
+        self.key = key
+        self.keys = base[key].values
+        self.base_year = base_year
+
+        numeric = base.drop(columns=[key]).apply(pd.to_numeric, errors='coerce')
+        numeric = numeric.loc[:, numeric.notna().any()]
+        self.columns = list(numeric.columns)
+        self.column = {column: j for j, column in enumerate(self.columns)}
+
+        self.base = numeric.to_numpy(dtype=np.float32)
+        self.base_missing = np.isnan(self.base)
+
+        # year -> column index -> (rows, values)
+        self.changes = {}
+        # folders under the vintages folder that were not read, their name is no year
+        self.skipped = []
+        # (column, year) -> values read so far
+        self._values = {}
+
+    @property
+    def years(self):
+        return sorted([self.base_year] + list(self.changes))
+
+    def add_year(self, year, frame):
+        """store one more vintage as its cells that differ from the base year"""
+        frame = frame.drop_duplicates(self.key).set_index(self.key)
+        aligned = frame.reindex(self.keys)
+        values = np.full(self.base.shape, np.nan, dtype=np.float32)
+        for column in self.columns:
+            if column in aligned.columns:
+                values[:, self.column[column]] = pd.to_numeric(
+                    aligned[column], errors='coerce').to_numpy(dtype=np.float32)
+
+        missing = np.isnan(values)
+        changed = (missing != self.base_missing) | (~missing & (values != self.base))
+
+        # a county gone missing is stored as NaN
+        self.changes[year] = {
+            j: (np.flatnonzero(changed[:, j]).astype(np.int32),
+                values[changed[:, j], j])
+            for j in range(len(self.columns)) if changed[:, j].any()}
+        self._values.clear()
+
+    def stored_cells(self):
+        """number of changed cells kept for each non-base year"""
+        return {year: sum(len(rows) for rows, _ in columns.values())
+                for year, columns in self.changes.items()}
+
+    def values(self, column, year):
+        """float32 values of a column for every row in a given year (read only)"""
+        key = (column, year)
+        if key not in self._values:
+            self._values[key] = self._build_values(column, year)
+        return self._values[key]
+
+    def _build_values(self, column, year):
+        j = self.column[column]
+        if year == self.base_year:
+            values = self.base[:, j]
+        elif year not in self.changes:
+            raise UnknownYear("no census data for {}, the years loaded are {}".format(
+                year, ", ".join(str(loaded) for loaded in self.years)))
+        else:
+            values = self.base[:, j].copy()
+            if j in self.changes[year]:
+                rows, changed = self.changes[year][j]
+                values[rows] = changed
+        values.flags.writeable = False
+        return values
+
+    def change(self, column, year, since):
+        """how much a column changed from `since` to `year`, for every row"""
+        return self.values(column, year) - self.values(column, since)
+
+    def frame(self, year, columns):
+        """DataFrame of the given columns in a year, rows aligned with the base table"""
+        return pd.DataFrame({column: self.values(column, year) for column in columns})
+
+
+def load_vintages(base, base_year, folder, filename='total_census_county_grouped.csv'):
+    """VintageTable of the base table plus every <folder>/<year>/<filename> found
+
+    All vintages are read once at startup, switching years never touches the disk.
+    Folders whose name is not a year are skipped and listed in table.skipped.
+    """
+    table = VintageTable(base, base_year)
+    folder = pathlib.Path(folder)
+    if not folder.exists():
+        return table
+
+    for path in sorted(folder.glob('*/' + filename)):
+        if not path.parent.name.isdigit():
+            table.skipped.append(path.parent.name)
+            continue
+        year = int(path.parent.name)
+        if year == base_year:
+            continue
+        table.add_year(year, read_table(path))
+    return table